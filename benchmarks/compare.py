@@ -0,0 +1,50 @@
+# Compares two benchmarks/run.py reports and exits non-zero when a benchmark got slower than the threshold allows:
+#
+#   python benchmarks/compare.py baseline.json results.json --threshold 0.15
+import argparse
+import json
+import sys
+
+
+def compare(baseline, current, threshold):
+    # returns (name, baseline median, current median, relative change, regressed) for benchmarks in both reports;
+    # the change is signed so that positive always means worse
+    rows = []
+    for name, result in sorted(current["results"].items()):
+        if name not in baseline["results"]:
+            continue
+        before = baseline["results"][name]["median"]
+        after = result["median"]
+        if not before:
+            continue
+        change = (after - before) / before
+        if result["better"] == "higher":
+            change = -change
+        rows.append((name, before, after, change, change > threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed relative slowdown (0.1 = 10%%)")
+    args = parser.parse_args()
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    rows = compare(baseline, current, args.threshold)
+    for name, before, after, change, regressed in rows:
+        unit = current["results"][name]["unit"]
+        print(f"{'REGRESSION' if regressed else 'ok':<10} {name:<50} {before:>10.3f} -> {after:>10.3f} {unit:<10} "
+              f"{change:+.1%}")
+    regressions = sum(regressed for *_, regressed in rows)
+    print(f"{len(rows)} benchmarks compared, {regressions} regressed beyond {args.threshold:.0%} "
+          f"({baseline['environment'].get('commit')} -> {current['environment'].get('commit')})")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
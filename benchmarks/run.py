@@ -0,0 +1,214 @@
+# Throughput benchmarks for the API, run in-process on CPU against the sample media in tests/test_media:
+#
+#   python benchmarks/run.py --output results.json
+#   python benchmarks/compare.py baseline.json results.json
+#
+# Everything runs in a fresh temporary working directory (its own ./media, store, cache and job queue), and the
+# derived-artifact cache is emptied before every measured request, so each number is an uncached conversion or
+# transcription. Transcription models are loaded from the local whisper / Hugging Face caches; the first run
+# of a model is reported separately as its warm-up time and not counted in its real-time factor.
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SAMPLES = ROOT / "tests" / "test_media"
+SAMPLE_FILES = {"image": "car.jpg", "video": "bunny.mp4", "audio": "obama.mp3"}
+FORMATS = {
+    "image": ["png", "webp", "gif", "tiff", "bmp", "avif", "heic"],
+    "video": ["mov", "avi", "mkv", "flv", "wmv", "webm"],
+    "audio": ["wav", "ogg", "flac", "aac", "m4a", "opus"],
+}
+MODELS = ["tiny", "tiny.en", "base", "base.en", "small", "small.en"]
+ENDPOINTS = {"/transcribe": "whisper", "/transcribe-fast": "faster-whisper"}
+SECTIONS = ["upload", "convert", "transcribe", "concurrency"]
+
+
+def summarize(samples, unit, better):
+    return {"unit": unit, "better": better, "median": statistics.median(samples), "mean": statistics.fmean(samples),
+            "min": min(samples), "max": max(samples), "samples": samples}
+
+
+def drop_cache():
+    shutil.rmtree("./media/.cache", ignore_errors=True)
+
+
+def finish(websocket, data):
+    # sends one request and waits for its final (non-progress) message
+    websocket.send_json(data)
+    while (response := websocket.receive_json())["status"] == "progress":
+        pass
+    if response["status"] != "success":
+        raise RuntimeError(f"{data}: {response.get('message')}")
+    return response
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - started
+
+
+def upload(client, name):
+    with open(SAMPLES / name, "rb") as file:
+        response = client.post("/uploadmedia", files={"file": file})
+    response.raise_for_status()
+    return response.json()["fileID"]
+
+
+def bench_upload(client, repeat):
+    results = {}
+    for media_type, name in SAMPLE_FILES.items():
+        size_mb = (SAMPLES / name).stat().st_size / (1024 * 1024)
+        uploads, downloads = [], []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fileID = upload(client, name)
+            uploads.append(size_mb / (time.perf_counter() - started))
+            started = time.perf_counter()
+            client.get("/downloadmedia", params={"fileID": fileID, "filename": name}).raise_for_status()
+            downloads.append(size_mb / (time.perf_counter() - started))
+            client.post(f"/deletemedia?fileID={fileID}")
+        results[f"upload.{media_type}"] = summarize(uploads, "MB/s", "higher")
+        results[f"download.{media_type}"] = summarize(downloads, "MB/s", "higher")
+    return results
+
+
+def bench_convert(client, repeat, profile):
+    results = {}
+    for media_type, name in SAMPLE_FILES.items():
+        fileID = upload(client, name)
+        source_format = name.rsplit('.', 1)[1]
+        with client.websocket_connect("/changeformat") as websocket:
+            for output_format in FORMATS[media_type]:
+                data = {"filename": name, "fileID": fileID, "output_format": output_format, "profile": profile}
+                samples = []
+                for _ in range(repeat):
+                    drop_cache()
+                    samples.append(timed(finish, websocket, data))
+                results[f"convert.{media_type}.{source_format}-{output_format}"] = summarize(samples, "s", "lower")
+                print(f"convert {media_type} {source_format} -> {output_format}: {statistics.median(samples):.3f}s",
+                      file=sys.stderr)
+        client.post(f"/deletemedia?fileID={fileID}")
+    return results
+
+
+def bench_transcribe(client, repeat, models):
+    import ffmpeg
+
+    name = SAMPLE_FILES["audio"]
+    duration = float(ffmpeg.probe(str(SAMPLES / name))["format"]["duration"])
+    fileID = upload(client, name)
+    results = {}
+    for endpoint, engine in ENDPOINTS.items():
+        for model in models:
+            data = {"filename": name, "fileID": fileID, "model": model, "output_format": "txt"}
+            with client.websocket_connect(endpoint) as websocket:
+                drop_cache()
+                # the first run pays for loading the model (and decoding the audio once)
+                warm_up = timed(finish, websocket, data)
+                samples = []
+                for _ in range(repeat):
+                    drop_cache()
+                    samples.append(timed(finish, websocket, data) / duration)
+            results[f"transcribe.{engine}.{model}.warm_up"] = summarize([warm_up], "s", "lower")
+            results[f"transcribe.{engine}.{model}.rtf"] = summarize(samples, "x realtime", "lower")
+            print(f"{endpoint} {model}: rtf {statistics.median(samples):.3f}", file=sys.stderr)
+    client.post(f"/deletemedia?fileID={fileID}")
+    return results
+
+
+def bench_concurrency(client, repeat, clients, profile):
+    # every client converts its own upload of the sample video at the same time
+    name = SAMPLE_FILES["video"]
+    fileIDs = [upload(client, name) for _ in range(clients)]
+    barrier = threading.Barrier(clients)
+
+    def convert(fileID):
+        with client.websocket_connect("/changeformat") as websocket:
+            barrier.wait()
+            finish(websocket, {"filename": name, "fileID": fileID, "output_format": "webm", "profile": profile})
+
+    samples = []
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for _ in range(repeat):
+            drop_cache()
+            started = time.perf_counter()
+            list(pool.map(convert, fileIDs))
+            samples.append(clients / (time.perf_counter() - started))
+    for fileID in fileIDs:
+        client.post(f"/deletemedia?fileID={fileID}")
+    return {f"concurrency.convert.{clients}_clients": summarize(samples, "jobs/s", "higher")}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    try:
+        ffmpeg_version = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout.split("\n")[0]
+    except OSError:
+        ffmpeg_version = None
+    return {"commit": commit or None, "python": platform.python_version(), "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "ffmpeg": ffmpeg_version,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark conversion, transcription and transfer throughput")
+    parser.add_argument("--sections", default=",".join(SECTIONS), help=f"comma separated subset of {SECTIONS}")
+    parser.add_argument("--repeat", type=int, default=3, help="measured runs per benchmark")
+    parser.add_argument("--models", default=",".join(MODELS), help="transcription models to measure")
+    parser.add_argument("--clients", type=int, default=4, help="simultaneous clients in the concurrency benchmark")
+    parser.add_argument("--profile", default=None, help="encoding profile for video conversions")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    args = parser.parse_args()
+    sections = [section.strip() for section in args.sections.split(",") if section.strip()]
+    unknown = set(sections) - set(SECTIONS)
+    if unknown:
+        parser.error(f"unknown sections: {', '.join(sorted(unknown))}")
+
+    output = Path(args.output).resolve() if args.output else None
+    sys.path.insert(0, str(ROOT))
+    workdir = tempfile.mkdtemp(prefix="media-toolbox-bench-")
+    os.chdir(workdir)
+    os.mkdir("media")
+    try:
+        from fastapi.testclient import TestClient
+        from src.main import app
+
+        results = {}
+        # one client for the whole run, so every request is served by the same event loop
+        with TestClient(app) as client:
+            if "upload" in sections:
+                results.update(bench_upload(client, args.repeat))
+            if "convert" in sections:
+                results.update(bench_convert(client, args.repeat, args.profile))
+            if "transcribe" in sections:
+                results.update(bench_transcribe(client, args.repeat, args.models.split(",")))
+            if "concurrency" in sections:
+                results.update(bench_concurrency(client, args.repeat, args.clients, args.profile))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = json.dumps({"environment": environment(), "settings": vars(args), "results": results}, indent=2)
+    if output:
+        output.write_text(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
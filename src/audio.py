@@ -0,0 +1,31 @@
+import os
+import uuid
+
+import faster_whisper
+import numpy as np
+
+from src.storage import read_meta, write_meta
+
+SAMPLE_RATE = 16000
+
+
+def pcm_path(path):
+    dir_path, name = os.path.split(path)
+    return os.path.join(dir_path, f".{name}.pcm.npy")
+
+
+def load_pcm(path):
+    # 16 kHz mono float32 samples as both whisper engines want them, decoded once per file and memory mapped after
+    cached = pcm_path(path)
+    if read_meta(path).get("pcm") and os.path.exists(cached):
+        return np.load(cached, mmap_mode='r')
+    audio = faster_whisper.decode_audio(path, sampling_rate=SAMPLE_RATE)
+    tmp_path = f"{cached}.{uuid.uuid4().hex}.tmp.npy"
+    np.save(tmp_path, audio)
+    os.replace(tmp_path, cached)
+    write_meta(path, pcm=True)
+    return np.load(cached, mmap_mode='r')
+
+
+def audio_duration(path):
+    return len(load_pcm(path)) / SAMPLE_RATE
@@ -0,0 +1,74 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Whisper / faster-whisper model cache
+MODEL_CACHE_MAX_MB = int(os.getenv('MODEL_CACHE_MAX_MB', '4096'))
+FASTER_WHISPER_COMPUTE_TYPE = os.getenv('FASTER_WHISPER_COMPUTE_TYPE', 'int8')
+# comma separated "engine:model[:compute_type]" entries loaded at startup, e.g. "whisper:base.en,faster-whisper:small"
+WARMUP_MODELS = [m.strip() for m in os.getenv('WARMUP_MODELS', '').split(',') if m.strip()]
+
+# Transcription scheduler
+# whisper jobs on one cached model run one at a time, extra workers mainly help faster-whisper
+TRANSCRIBE_WORKERS_PER_MODEL = int(os.getenv('TRANSCRIBE_WORKERS_PER_MODEL', '1'))
+TRANSCRIBE_QUEUE_SIZE = int(os.getenv('TRANSCRIBE_QUEUE_SIZE', '16'))
+
+# Uploads
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE_KB', '1024')) * 1024
+MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE_MB', '8192')) * 1024 * 1024  # 0 disables the limit
+RESUMABLE_CHUNK_SIZE = int(os.getenv('RESUMABLE_CHUNK_SIZE_MB', '8')) * 1024 * 1024
+MAX_RESUMABLE_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Image conversion process pool
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', str(os.cpu_count() or 1)))
+
+# Parallel (VAD chunked) transcription
+TRANSCRIBE_PARALLEL_WORKERS = int(os.getenv('TRANSCRIBE_PARALLEL_WORKERS', str(max(1, (os.cpu_count() or 1) // 4))))
+TRANSCRIBE_CHUNK_SECONDS = int(os.getenv('TRANSCRIBE_CHUNK_SECONDS', '120'))
+
+# Transcripts keep word timings so later renders (and word level formats) need no new transcription
+TRANSCRIPT_WORD_TIMESTAMPS = os.getenv('TRANSCRIPT_WORD_TIMESTAMPS', 'true').lower() in ('1', 'true', 'yes')
+
+# ffmpeg encoding: profile used when a request names none, and the node wide cap on ffmpeg threads
+FFMPEG_DEFAULT_PROFILE = os.getenv('FFMPEG_DEFAULT_PROFILE', 'balanced')
+FFMPEG_THREAD_BUDGET = int(os.getenv('FFMPEG_THREAD_BUDGET', str(os.cpu_count() or 1)))
+
+# ffmpeg supervisor: concurrent ffmpeg processes per node and per-job limits (0 disables a limit)
+FFMPEG_MAX_PROCESSES = int(os.getenv('FFMPEG_MAX_PROCESSES', str(max(1, (os.cpu_count() or 1) // 2))))
+FFMPEG_JOB_TIMEOUT = int(os.getenv('FFMPEG_JOB_TIMEOUT', '3600'))  # wall-clock seconds
+FFMPEG_JOB_CPU_SECONDS = int(os.getenv('FFMPEG_JOB_CPU_SECONDS', '0'))  # CPU seconds summed over all threads
+
+# Progress messages forwarded to clients per second while ffmpeg runs (0 forwards every progress block)
+FFMPEG_PROGRESS_RATE = float(os.getenv('FFMPEG_PROGRESS_RATE', '4'))
+
+# Segmented (parallel) video transcoding: target segment length, cut at the next keyframe
+VIDEO_SEGMENT_SECONDS = int(os.getenv('VIDEO_SEGMENT_SECONDS', '60'))
+
+# Adaptive streaming (HLS/DASH) packaging: segment length and the "height:video kbps" ladder, highest first
+STREAM_SEGMENT_SECONDS = int(os.getenv('STREAM_SEGMENT_SECONDS', '6'))
+STREAM_LADDER = [tuple(int(part) for part in rung.split(':'))
+                 for rung in os.getenv('STREAM_LADDER', '1080:5000,720:2800,480:1400,360:800').split(',') if rung.strip()]
+STREAM_AUDIO_BITRATE = os.getenv('STREAM_AUDIO_BITRATE', '128k')
+
+# Media retention: job folders expire this long after their last use, and the least recently used ones are
+# evicted early while the media folder is over its quota (0 disables the quota)
+RETENTION_HOURS = float(os.getenv('RETENTION_HOURS', '12'))
+RETENTION_QUOTA_MB = int(os.getenv('RETENTION_QUOTA_MB', '0'))
+RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', '60'))  # seconds between eviction passes
+
+# Durable job queue (POST /jobs) served by worker processes (python -m src.worker) sharing ./media
+JOB_WORKER_CONCURRENCY = int(os.getenv('JOB_WORKER_CONCURRENCY', '2'))  # jobs one worker process runs at once
+# a running job whose worker has been silent for this many seconds is retried
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '60'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '2'))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '0.5'))  # seconds between queue and event polls
+
+# Port job workers serve Prometheus metrics on (0 disables it; the API serves them on /metrics)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+# Logging: level, "json" (one object per line) or "text", and how often sampled records (progress) may repeat
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+LOG_SAMPLE_SECONDS = float(os.getenv('LOG_SAMPLE_SECONDS', '5'))
@@ -0,0 +1,165 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+from src.config import FFMPEG_THREAD_BUDGET, FFMPEG_DEFAULT_PROFILE
+
+# encoder settings are per codec family because every encoder spells "speed vs quality" differently;
+# threads is what a job reserves from the node wide budget, the same numbers work on any core count
+PROFILES = {
+    "fast": {
+        "threads": 2,
+        "filter_threads": 1,
+        "x264": {"preset": "veryfast", "crf": 26},
+        "x265": {"preset": "veryfast", "crf": 30},
+        "vpx": {"deadline": "realtime", "cpu-used": 8, "crf": 36, "b:v": 0, "row-mt": 1},
+        "aom": {"cpu-used": 8, "crf": 36, "b:v": 0, "row-mt": 1},
+    },
+    "balanced": {
+        "threads": 4,
+        "filter_threads": 2,
+        "x264": {"preset": "medium", "crf": 23},
+        "x265": {"preset": "medium", "crf": 28},
+        "vpx": {"deadline": "good", "cpu-used": 2, "crf": 32, "b:v": 0, "row-mt": 1},
+        "aom": {"cpu-used": 6, "crf": 32, "b:v": 0, "row-mt": 1},
+    },
+    "archive": {
+        "threads": 8,
+        "filter_threads": 2,
+        "x264": {"preset": "slow", "crf": 18},
+        "x265": {"preset": "slow", "crf": 22},
+        "vpx": {"deadline": "good", "cpu-used": 1, "crf": 24, "b:v": 0, "row-mt": 1},
+        "aom": {"cpu-used": 4, "crf": 24, "b:v": 0, "row-mt": 1},
+    },
+}
+CODEC_FAMILIES = {
+    "libx264": "x264",
+    "h264": "x264",
+    "libx265": "x265",
+    "hevc": "x265",
+    "libvpx": "vpx",
+    "vp8": "vpx",
+    "libvpx-vp9": "vpx",
+    "vp9": "vpx",
+    "libaom-av1": "aom",
+    "av1": "aom",
+}
+
+
+def get_profile(name=None):
+    name = name or FFMPEG_DEFAULT_PROFILE
+    if name not in PROFILES:
+        raise ValueError(f"Unknown encoding profile: {name}. Available profiles are: {', '.join(PROFILES)}")
+    return name, PROFILES[name]
+
+
+def codec_options(profile, vcodec):
+    # preset/crf style options for the video encoder, nothing for stream copies and unknown encoders
+    return dict(PROFILES[profile].get(CODEC_FAMILIES.get(vcodec), {}))
+
+
+class ThreadBudget:
+    # caps the ffmpeg threads running on this node; jobs that do not fit wait in FIFO order
+    def __init__(self, total):
+        self.total = total
+        self.used = 0
+        self.waiting: deque = deque()  # (threads, future) per waiting job
+
+    def clamp(self, threads):
+        # what reserve(threads) will actually grant
+        return max(1, min(threads, self.total))
+
+    @asynccontextmanager
+    async def reserve(self, threads, on_wait=None):
+        threads = self.clamp(threads)
+        if self.waiting or self.used + threads > self.total:
+            turn = asyncio.get_running_loop().create_future()
+            entry = (threads, turn)
+            self.waiting.append(entry)
+            try:
+                if on_wait is not None:
+                    await on_wait()
+                await turn
+            except BaseException:
+                if entry in self.waiting:
+                    self.waiting.remove(entry)
+                    self._grant()
+                elif turn.done() and not turn.cancelled():
+                    self._release(threads)
+                raise
+        else:
+            self.used += threads
+        try:
+            yield threads
+        finally:
+            self._release(threads)
+
+    def _release(self, threads):
+        self.used -= threads
+        self._grant()
+
+    def _grant(self):
+        while self.waiting and self.used + self.waiting[0][0] <= self.total:
+            threads, turn = self.waiting.popleft()
+            self.used += threads
+            turn.set_result(None)
+
+
+ffmpeg_threads = ThreadBudget(FFMPEG_THREAD_BUDGET)
+
+
+# what each output container can hold as a stream copy (ffprobe codec names) and the encoder used when it cannot;
+# a container without a "video" entry cannot hold video at all, so that stream is dropped
+ANY = 'any'
+CONTAINERS = {
+    "mp4": {"video": {"h264", "hevc", "mpeg4", "av1", "vp9"}, "audio": {"aac", "mp3", "alac", "ac3", "opus", "flac"},
+            "video_encoder": "libx264", "audio_encoder": "aac"},
+    "mov": {"video": {"h264", "hevc", "mpeg4", "prores", "mjpeg"}, "audio": {"aac", "mp3", "alac", "ac3", "pcm_s16le"},
+            "video_encoder": "libx264", "audio_encoder": "aac"},
+    "mkv": {"video": ANY, "audio": ANY, "video_encoder": "libx264", "audio_encoder": "aac"},
+    "webm": {"video": {"vp8", "vp9", "av1"}, "audio": {"vorbis", "opus"},
+             "video_encoder": "libvpx-vp9", "audio_encoder": "libopus"},
+    "avi": {"video": {"mpeg4", "h264", "mjpeg", "msmpeg4v2", "msmpeg4v3"}, "audio": {"mp3", "ac3", "pcm_s16le"},
+            "video_encoder": "mpeg4", "audio_encoder": "libmp3lame"},
+    "flv": {"video": {"flv1", "h264"}, "audio": {"mp3", "aac"}, "video_encoder": "flv", "audio_encoder": "libmp3lame"},
+    "wmv": {"video": {"wmv1", "wmv2", "msmpeg4v3"}, "audio": {"wmav1", "wmav2", "mp3"},
+            "video_encoder": "wmv2", "audio_encoder": "wmav2"},
+    "mp3": {"audio": {"mp3"}, "audio_encoder": "libmp3lame"},
+    "wav": {"audio": {"pcm_s16le", "pcm_s24le", "pcm_f32le", "pcm_u8"}, "audio_encoder": "pcm_s16le"},
+    "ogg": {"audio": {"vorbis", "opus", "flac"}, "audio_encoder": "libvorbis"},
+    "flac": {"audio": {"flac"}, "audio_encoder": "flac"},
+    "aac": {"audio": {"aac"}, "audio_encoder": "aac"},
+    "m4a": {"audio": {"aac", "alac"}, "audio_encoder": "aac"},
+    "opus": {"audio": {"opus"}, "audio_encoder": "libopus"},
+}
+
+
+def stream_codecs(probe, kind):
+    # codecs of the probed streams of one kind, cover art is not a video stream
+    return [stream["codec_name"] for stream in probe["streams"]
+            if stream.get("codec_type") == kind and not stream.get("disposition", {}).get("attached_pic")]
+
+
+def resolve_codec(kind, requested, output_format, codecs):
+    # "auto" copies the streams when the container can hold them and encodes them otherwise, "copy" is remux-only
+    # and fails early instead of in ffmpeg, anything else names an encoder; None means the stream is dropped
+    container = CONTAINERS.get(output_format.lower())
+    if requested not in ("auto", "copy"):
+        return requested
+    if container is None or not codecs:
+        return "copy"
+    if kind not in container:
+        return None
+    if container[kind] == ANY or all(codec in container[kind] for codec in codecs):
+        return "copy"
+    if requested == "copy":
+        raise ValueError(f"Cannot remux {kind} ({', '.join(codecs)}) into {output_format}, "
+                         f"choose a {kind} codec or use auto")
+    return container[f"{kind}_encoder"]
+
+
+def codec_args(vcodec, acodec):
+    # ffmpeg output options for resolved codecs, a None codec drops that kind of stream
+    args = {"vn": None} if vcodec is None else {"vcodec": vcodec}
+    args.update({"an": None} if acodec is None else {"acodec": acodec})
+    return args
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+
+from fastapi import WebSocket
+
+from src.helper import (change_file_format, change_file_format_batch, generate_video_previews,
+                        package_adaptive_stream, transcribe_file, transcribe_file_fast)
+from src.logs import log_context
+from src.retention import retention
+from src.storage import media_file_path
+
+logger = logging.getLogger(__name__)
+
+
+async def outside_media(websocket: WebSocket, data):
+    # workers take requests straight from the queue, so the API's path check is repeated here before anything
+    # (outputs, sidecars) is written next to the file
+    if media_file_path(data.get("fileID"), data.get("filename")) is None:
+        await websocket.send_json({"status": "error", "message": f"File not found: {data.get('filename')}"})
+        return True
+    return False
+
+
+# request handlers shared by the WebSocket endpoints and the job workers: each one reads a request dict and
+# reports to anything with an async send_json (a client socket, or a job's event log)
+async def handle_change_format(websocket: WebSocket, data):
+    # the job folder counts as used while it runs and is re-measured once its outputs are written
+    if await outside_media(websocket, data):
+        return
+    with log_context(fileID=data["fileID"], filename=data["filename"]):
+        await asyncio.to_thread(retention.touch, data["fileID"])
+        try:
+            await run_change_format(websocket, data)
+        finally:
+            await asyncio.to_thread(retention.record, data["fileID"])
+
+
+async def run_change_format(websocket: WebSocket, data):
+    filename = data["filename"]
+    fileID = data["fileID"]
+    if data.get("mode") == "thumbnails":
+        logger.info("Generating previews")
+        await generate_video_previews(websocket, fileID, filename, data.get("interval", 10),
+                                      data.get("width", 160), data.get("columns", 10))
+        return
+    if data.get("mode") == "stream":
+        logger.info("Packaging adaptive stream")
+        await package_adaptive_stream(websocket, fileID, filename, data.get("dash", False), data.get("profile"))
+        return
+    if "outputs" in data:
+        logger.info("Changing format to %d outputs", len(data['outputs']))
+        await change_file_format_batch(websocket, fileID, filename, data["outputs"], data.get("profile"))
+        return
+    output_format = data["output_format"]
+    vcodec = data.get("video_codec", "auto")
+    acodec = data.get("audio_codec", "auto")
+    width = data.get("width")
+    height = data.get("height")
+    profile = data.get("profile")
+    parallel = data.get("parallel", False)
+    logger.info("Changing format to %s", output_format,
+                extra={"video_codec": vcodec, "audio_codec": acodec, "profile": profile})
+    await change_file_format(websocket, fileID, filename, output_format, vcodec, acodec, width, height, profile,
+                             parallel)
+
+
+async def handle_transcribe(websocket: WebSocket, data):
+    if await outside_media(websocket, data):
+        return
+    filename = data["filename"]
+    fileID = data["fileID"]
+    model = data.get("model", "base")
+    language = data.get("language", "en")
+    output_format = data.get("output_format", "srt")
+    parallel = data.get("parallel", False)
+    with log_context(fileID=fileID, filename=filename):
+        logger.info("Transcribing with whisper model %s", model)
+        await asyncio.to_thread(retention.touch, fileID)
+        await transcribe_file(websocket, fileID, filename, model, language, output_format, parallel)
+        await asyncio.to_thread(retention.record, fileID)
+
+
+async def handle_transcribe_fast(websocket: WebSocket, data):
+    if await outside_media(websocket, data):
+        return
+    filename = data["filename"]
+    fileID = data["fileID"]
+    model = data.get("model", "base")
+    output_format = data.get("output_format", "srt")
+    parallel = data.get("parallel", False)
+    with log_context(fileID=fileID, filename=filename):
+        logger.info("Transcribing with faster-whisper model %s", model)
+        await asyncio.to_thread(retention.touch, fileID)
+        await transcribe_file_fast(websocket, fileID, filename, model, output_format, parallel)
+        await asyncio.to_thread(retention.record, fileID)
+
+
+JOB_HANDLERS = {
+    "changeformat": handle_change_format,
+    "transcribe": handle_transcribe,
+    "transcribe-fast": handle_transcribe_fast,
+}
@@ -1,168 +1,506 @@
-from concurrent.futures import ThreadPoolExecutor
-
 import ffmpeg
-from PIL import Image, features
-from pillow_heif import register_heif_opener
-import whisper.utils
-from faster_whisper import WhisperModel
-import pysubs2 as pysubs
+import numpy as np
 from fastapi import WebSocket
-import mimetypes
 import asyncio
+import logging
+import math
+import os
+import shutil
+import threading
+import time
+
+from src.audio import load_pcm, audio_duration
+from src.config import TRANSCRIPT_WORD_TIMESTAMPS
+from src.encoding import (PROFILES, get_profile, codec_options, codec_args, resolve_codec, stream_codecs,
+                          ffmpeg_threads)
+from src.images import image_pool, convert_image, size_suffix
+from src.mediainfo import get_media_type, detect_media_type, probe_media
+from src.metrics import conversion_seconds, transcription_rtf
+from src.model_cache import model_cache
+from src.parallel_transcription import transcribe_in_chunks
+from src.scheduler import transcription_scheduler, SchedulerBusy
+from src.segmented import plan_segments, transcode_in_segments
+from src.storage import file_sha256, derived_key, cache_fetch, cache_put, prepare_output
+from src.streaming import select_rungs, rendition_names, hls_stream, dash_stream
+from src.supervisor import ffmpeg_supervisor, read_ffmpeg_progress, FFmpegLimitExceeded
+from src.transcripts import (RENDER_FORMATS, build_transcript, save_transcript, load_transcript, render_transcript,
+                             transcript_path, word_dict)
 
-mimetypes.add_type("image/webp", ".webp")  # mimetypes does not support webp by default
-mimetypes.add_type("video/flv", ".flv")  # mimetypes does not support flv by default
+logger = logging.getLogger(__name__)
 
 
-async def change_file_format(websocket: WebSocket, fileID, filename, output_format, vcodec, acodec):
+async def change_file_format(websocket: WebSocket, fileID, filename, output_format, vcodec, acodec,
+                             width=None, height=None, profile=None, parallel=False):
     filepath = f"./media/{fileID}/{filename}"
     filename_without_ext = filename.rsplit('.', 1)[0]
-    output_path = f"./media/{fileID}/{filename_without_ext}.{output_format}"
 
-    print(f"Converting {filepath} to {output_path} with format {output_format}")
+    if not os.path.isfile(filepath):
+        await websocket.send_json({"status": "error", "message": f"File not found: {filename}"})
+        return
 
     # find out whether the file is image or video
-    media_type = get_media_type(filepath)
+    media_type = await asyncio.to_thread(detect_media_type, filepath)
     if media_type is None:
         await websocket.send_json({"status": "error", "message": "Mimetype error: Unsupported file type"})
         return
-    elif media_type == 'image':
-        # For images, we can use ffmpeg to convert formats
+    if media_type != 'image':
+        width = height = None
+    try:
+        profile, settings = get_profile(profile)
+    except ValueError as e:
+        await websocket.send_json({"status": "error", "message": str(e)})
+        return
+
+    output_filename = f"{filename_without_ext}{size_suffix(width, height)}.{output_format}"
+    output_path = f"./media/{fileID}/{output_filename}"
+    logger.info("Converting to %s", output_filename)
+    if output_path == filepath:
+        await websocket.send_json({"status": "error", "message": "Output format is the same as the input format"})
+        return
+
+    # codecs are resolved before the cache lookup, so a cached reply names the same codecs as a fresh one
+    codecs = {}
+    if media_type != 'image':
         try:
-            # use PIL to open the image and convert it
-            input_format = filename.rsplit('.', 1)[-1].lower()
-            if output_format in ['heic', 'heif'] or input_format in ['heic', 'heif']:
-                register_heif_opener()
-            image = Image.open(filepath)
-            if output_format.lower() == 'jpg' and image.mode != 'RGB':
-                # JPEG does not support palette mode color, needs to be RGB
-                image = image.convert('RGB')
-            image.save(output_path)
+            probe = await asyncio.to_thread(probe_media, filepath)
+            if media_type == 'video':
+                vcodec = codecs["video_codec"] = resolve_codec('video', vcodec, output_format,
+                                                               stream_codecs(probe, 'video'))
+            acodec = codecs["audio_codec"] = resolve_codec('audio', acodec, output_format,
+                                                           stream_codecs(probe, 'audio'))
+        except (ffmpeg.Error, ValueError) as e:
+            logger.warning("Error converting %s: %s", media_type, e)
+            await websocket.send_json({"status": "error", "message": str(e)})
+            return
+
+    # identical input + conversion settings always give the same output, reuse it if we made it before
+    input_hash = await asyncio.to_thread(file_sha256, filepath)
+    cache_key = derived_key('convert', input_hash, output_format.lower(), vcodec, acodec, width, height,
+                            profile if media_type == 'video' else None)
+    if await asyncio.to_thread(cache_fetch, cache_key, output_path):
+        await websocket.send_json(
+            {"status": "success", "message": f"{media_type.capitalize()} converted to {output_format}",
+             "output_format": output_format, "fileID": fileID, "filename": output_filename, **codecs,
+             "cached": True})
+        return
+    await asyncio.to_thread(prepare_output, output_path)
+    started = time.perf_counter()
+
+    if media_type == 'image':
+        try:
+            # Pillow decodes and encodes in the image process pool, off the event loop
+            await asyncio.get_running_loop().run_in_executor(
+                image_pool(), convert_image, filepath, [(output_path, output_format, width, height)])
+            await asyncio.to_thread(cache_put, cache_key, output_path)
+            conversion_seconds.observe(time.perf_counter() - started, media_type='image', output_format=output_format)
             await websocket.send_json(
                 {"status": "success", "message": f"Image converted to {output_format}", "output_format": output_format,
-                 "fileID": fileID})
+                 "fileID": fileID, "filename": output_filename})
         except Exception as e:
-            print("Error converting image:", str(e))
+            logger.warning("Error converting image: %s", e)
             await websocket.send_json({"status": "error", "message": str(e)})
     elif media_type == 'video':
         # For videos, we can use ffmpeg to convert formats
         try:
-            # Get total duration in seconds using ffprobe
-            probe = ffmpeg.probe(filepath)
+            # Get total duration in seconds from the probe made at upload time
             duration = float(probe['format']['duration'])
-            process = (
-                ffmpeg
-                .input(filepath)
-                .output(output_path, vcodec=vcodec, acodec=acodec)
-                .global_args('-progress', 'pipe:1', '-nostats', '-loglevel', 'error')
-                .run_async(pipe_stdout=True, pipe_stderr=True, overwrite_output=True)
-            )
-
-            progress = {"status": "progress"}
-            # ffmpeg progress output parsing
-            print("Starting ffmpeg process for video conversion...")
-            while True:
-                output = await asyncio.get_event_loop().run_in_executor(None, process.stdout.readline)
-                try:
-                    if output == b'' and process.poll() is not None:
-                        break
-                    if output:
-                        print(output)
-                        decoded = output.decode(errors='ignore').strip()
-                        if '=' in decoded:
-                            key, value = decoded.split('=', 1)
-                            progress[key] = value
-                            # Calculate progress percentage using out_time (in format HH:MM:SS.microseconds)
-                            if key == 'out_time' and duration > 0:
-                                h, m, s = value.split(':')
-                                sec = float(h) * 3600 + float(m) * 60 + float(s)
-                                percent = min(100, (sec / duration) * 100)
-                                progress['progress_percent'] = percent
-                            if key == 'progress':
-                                # Only send progress update when ffmpeg emits a 'progress' key
-                                await websocket.send_json(progress)
-                                if value == 'end':
-                                    break  ##
-                except Exception as e:
-                    print("Error parsing ffmpeg output:", str(e))
-                    await websocket.send_json({"status": "error", "message": str(e)})
-                    continue
-
-            print("FFmpeg process completed, waiting for finalization...")
-            process.wait()
-            print("FFmpeg process finalized with return code:", process.returncode)
-            stderr_output = process.stderr.read()
-            for line in stderr_output.splitlines():
-                print(line)
-            if process.returncode == 0:
+            # parallel mode only pays off for an actual video encode on a long enough input
+            segments = []
+            if parallel and vcodec not in ('copy', None):
+                segments = await asyncio.to_thread(plan_segments, filepath, probe)
+            if len(segments) > 1:
+                logger.info("Transcoding in %d segments (%s/%s, %s profile)", len(segments), vcodec, acodec, profile)
+                returncode = await transcode_in_segments(websocket, filepath, output_path, segments, duration,
+                                                         vcodec, acodec, profile)
+            else:
+                # a remux barely uses the CPU, only an encode needs the profile's threads
+                threads = ffmpeg_threads.clamp(settings["threads"] if vcodec not in ('copy', None) else 1)
+                stream = (
+                    ffmpeg
+                    .input(filepath, threads=threads)
+                    .output(output_path, threads=threads, **codec_args(vcodec, acodec),
+                            **codec_options(profile, vcodec))
+                    .global_args('-filter_threads', str(settings["filter_threads"]),
+                                 '-progress', 'pipe:1', '-nostats', '-loglevel', 'error')
+                )
+                async with ffmpeg_supervisor.run(stream, [output_path], threads,
+                                                 ffmpeg_wait_notifier(websocket)) as process:
+                    logger.info("Started ffmpeg for video conversion (%s/%s, %s profile, %d threads)",
+                                vcodec, acodec, profile, threads)
+                    returncode = await read_ffmpeg_progress(websocket, process, duration)
+            if returncode == 0:
+                await asyncio.to_thread(cache_put, cache_key, output_path)
+                conversion_seconds.observe(time.perf_counter() - started, media_type='video',
+                                           output_format=output_format, video_codec=vcodec or 'none',
+                                           audio_codec=acodec or 'none')
                 await websocket.send_json({"status": "success", "message": f"Video converted to {output_format}",
-                                           "output_format": output_format, "fileID": fileID})
+                                           "output_format": output_format, "fileID": fileID,
+                                           "filename": output_filename, **codecs})
             else:
                 await websocket.send_json({
                     "status": "error",
-                    "message": f"ffmpeg failed with exit code {process.returncode}. Check if the output format is valid."
+                    "message": f"ffmpeg failed with exit code {returncode}. Check if the output format is valid."
                 })
-        except ffmpeg.Error as e:
-            print("FFmpeg error:", e)
+        except (ffmpeg.Error, FFmpegLimitExceeded, ValueError) as e:
+            logger.warning("Error converting video: %s", e)
             await websocket.send_json({"status": "error", "message": str(e)})
     elif media_type == 'audio':
         # For audio files, we can also use ffmpeg to convert formats
         try:
-            process = (
+            duration = float(probe['format'].get('duration', 0))
+            stream = (
                 ffmpeg
                 .input(filepath)
                 .output(output_path, acodec=acodec)
                 .global_args('-progress', 'pipe:1', '-nostats')
-                .run_async(pipe_stdout=True, pipe_stderr=True, overwrite_output=True)
             )
-
-            progress = {"status": "progress"}
-            # ffmpeg progress output parsing
-            while True:
-                output = await asyncio.get_event_loop().run_in_executor(None, process.stdout.readline)
-                if output == b'' and process.poll() is not None:
-                    break
-                if output:
-                    decoded = output.decode(errors='ignore').strip()
-                    if '=' in decoded:
-                        key, value = decoded.split('=', 1)
-                        progress[key] = value
-                        if key == 'progress':
-                            # Only send progress update when ffmpeg emits a 'progress' key
-                            await websocket.send_json(progress)
-                            if value == 'end':
-                                break
-
-            process.wait()
-            if process.returncode == 0:
+            async with ffmpeg_supervisor.run(stream, [output_path], 1, ffmpeg_wait_notifier(websocket)) as process:
+                returncode = await read_ffmpeg_progress(websocket, process, duration)
+            if returncode == 0:
+                await asyncio.to_thread(cache_put, cache_key, output_path)
+                conversion_seconds.observe(time.perf_counter() - started, media_type='audio',
+                                           output_format=output_format, audio_codec=acodec or 'none')
                 await websocket.send_json({"status": "success", "message": f"Audio converted to {output_format}",
-                                           "output_format": output_format, "fileID": fileID})
+                                           "output_format": output_format, "fileID": fileID,
+                                           "filename": output_filename, **codecs})
             else:
                 await websocket.send_json({
                     "status": "error",
-                    "message": f"ffmpeg failed with exit code {process.returncode}. Check if the output format is valid."
+                    "message": f"ffmpeg failed with exit code {returncode}. Check if the output format is valid."
                 })
-        except ffmpeg.Error as e:
-            print("FFmpeg error:", e)
+        except (ffmpeg.Error, FFmpegLimitExceeded, ValueError) as e:
+            logger.warning("Error converting audio: %s", e)
             await websocket.send_json({"status": "error", "message": str(e)})
 
 
-def get_media_type(filename):
-    mimestart = mimetypes.guess_type(filename)[0]
-    print(mimestart)
-    if mimestart and mimestart.startswith('image/'):
-        return 'image'
-    elif mimestart and mimestart.startswith('video/'):
-        return 'video'
-    elif mimestart and mimestart.startswith('audio/'):
-        return 'audio'
-    else:
-        return None
+async def change_file_format_batch(websocket: WebSocket, fileID, filename, outputs, profile=None):
+    # one decode of the input feeding every requested output
+    filepath = f"./media/{fileID}/{filename}"
+    filename_without_ext = filename.rsplit('.', 1)[0]
 
+    if not os.path.isfile(filepath):
+        await websocket.send_json({"status": "error", "message": f"File not found: {filename}"})
+        return
+    media_type = await asyncio.to_thread(detect_media_type, filepath)
+    if media_type is None:
+        await websocket.send_json({"status": "error", "message": "Mimetype error: Unsupported file type"})
+        return
+    formats = [output["output_format"] for output in outputs]
+    output_filenames = []
+    for output in outputs:
+        suffix = size_suffix(output.get("width"), output.get("height")) if media_type == 'image' else ""
+        output_filenames.append(f"{filename_without_ext}{suffix}.{output['output_format']}")
+    if not outputs or len({f.lower() for f in output_filenames}) != len(output_filenames):
+        await websocket.send_json({"status": "error", "message": "Each output can only be requested once"})
+        return
+    if filename in output_filenames:
+        await websocket.send_json({"status": "error", "message": "Output format is the same as the input format"})
+        return
+
+    try:
+        profiles = [get_profile(output.get("profile", profile)) for output in outputs]
+    except ValueError as e:
+        await websocket.send_json({"status": "error", "message": str(e)})
+        return
+
+    logger.info("Converting to %s in one pass", ', '.join(formats))
+    input_hash = await asyncio.to_thread(file_sha256, filepath)
+    started = time.perf_counter()
+    results = []
+    pending = []
+    try:
+        probe = await asyncio.to_thread(probe_media, filepath) if media_type != 'image' else None
+        for output, output_filename, (output_profile, _) in zip(outputs, output_filenames, profiles):
+            output_format = output["output_format"]
+            vcodec = output.get("video_codec", "auto")
+            acodec = output.get("audio_codec", "auto")
+            size = (output.get("width"), output.get("height")) if media_type == 'image' else (None, None)
+            output_path = f"./media/{fileID}/{output_filename}"
+            result = {"output_format": output_format, "filename": output_filename}
+            if probe is not None:
+                # each output copies the streams its container can hold and encodes the rest; resolved before the
+                # cache lookup so cached outputs report their codecs too
+                if media_type == 'audio' or get_media_type(output_path) == 'audio':
+                    # audio-only target: drop the picture instead of encoding it
+                    vcodec = None
+                else:
+                    vcodec = result["video_codec"] = resolve_codec('video', vcodec, output_format,
+                                                                   stream_codecs(probe, 'video'))
+                acodec = result["audio_codec"] = resolve_codec('audio', acodec, output_format,
+                                                               stream_codecs(probe, 'audio'))
+            cache_key = derived_key('convert', input_hash, output_format.lower(), vcodec, acodec, *size,
+                                    output_profile if media_type == 'video' else None)
+            if await asyncio.to_thread(cache_fetch, cache_key, output_path):
+                results.append({**result, "cached": True})
+                continue
+            await asyncio.to_thread(prepare_output, output_path)
+            pending.append((result, vcodec, acodec, output_path, cache_key, size, output_profile))
+    except (ffmpeg.Error, ValueError) as e:
+        logger.warning("Error in batch conversion: %s", e)
+        await websocket.send_json({"status": "error", "message": str(e)})
+        return
+
+    try:
+        if pending and media_type == 'image':
+            targets = [(path, r["output_format"], *size) for r, _, _, path, _, size, _ in pending]
+            await asyncio.get_running_loop().run_in_executor(image_pool(), convert_image, filepath, targets)
+        elif pending:
+            duration = float(probe['format'].get('duration', 0))
+            # every video encoder gets its profile's threads (within the node budget), the whole process reserves
+            # their sum, clamped the same way
+            encoder_threads = [ffmpeg_threads.clamp(PROFILES[p]["threads"] if vcodec not in ('copy', None) else 1)
+                               for _, vcodec, _, _, _, _, p in pending]
+            filter_threads = max(PROFILES[p]["filter_threads"] for *_, p in pending)
+            source = ffmpeg.input(filepath, threads=max(encoder_threads))
+            streams = []
+            for (_, vcodec, acodec, output_path, _, _, output_profile), threads in zip(pending, encoder_threads):
+                streams.append(source.output(output_path, threads=threads, **codec_args(vcodec, acodec),
+                                             **codec_options(output_profile, vcodec)))
+            stream = (
+                ffmpeg
+                .merge_outputs(*streams)
+                .global_args('-filter_threads', str(filter_threads),
+                             '-progress', 'pipe:1', '-nostats', '-loglevel', 'error')
+            )
+            output_paths = [path for _, _, _, path, *_ in pending]
+            async with ffmpeg_supervisor.run(stream, output_paths, ffmpeg_threads.clamp(sum(encoder_threads)),
+                                             ffmpeg_wait_notifier(websocket)) as process:
+                returncode = await read_ffmpeg_progress(
+                    websocket, process, duration, {"outputs": [r["output_format"] for r, *_ in pending]})
+            if returncode != 0:
+                await websocket.send_json({
+                    "status": "error",
+                    "message": f"ffmpeg failed with exit code {returncode}. Check if the output formats are valid."
+                })
+                return
+    except Exception as e:
+        logger.warning("Error in batch conversion: %s", e)
+        await websocket.send_json({"status": "error", "message": str(e)})
+        return
 
-async def transcribe_file(websocket: WebSocket, fileID, filename, model, language, output_format):
+    for result, _, _, output_path, cache_key, _, _ in pending:
+        await asyncio.to_thread(cache_put, cache_key, output_path)
+        results.append(result)
+    if pending:
+        # one pass produced every output, so the pass is timed as a whole
+        conversion_seconds.observe(time.perf_counter() - started, media_type=media_type, output_format='batch')
+    await websocket.send_json(
+        {"status": "success", "message": f"{media_type.capitalize()} converted to {', '.join(formats)}",
+         "outputs": results, "fileID": fileID})
+
+
+async def generate_video_previews(websocket: WebSocket, fileID, filename, interval=10, width=160, columns=10):
+    # poster frame, contact-sheet sprite and WebVTT thumbnail track from one keyframe-only decode
     filepath = f"./media/{fileID}/{filename}"
     filename_without_ext = filename.rsplit('.', 1)[0]
+    names = {
+        "poster": f"{filename_without_ext}_poster.jpg",
+        "sprite": f"{filename_without_ext}_sprite.jpg",
+        "thumbnails": f"{filename_without_ext}_thumbnails.vtt",
+    }
+    paths = {part: f"./media/{fileID}/{name}" for part, name in names.items()}
+
+    if not os.path.isfile(filepath):
+        await websocket.send_json({"status": "error", "message": f"File not found: {filename}"})
+        return
+    if await asyncio.to_thread(detect_media_type, filepath) != 'video':
+        await websocket.send_json({"status": "error", "message": "Previews can only be generated for videos"})
+        return
+    if interval <= 0 or width <= 0 or columns <= 0:
+        await websocket.send_json({"status": "error", "message": "interval, width and columns must be positive"})
+        return
+
+    input_hash = await asyncio.to_thread(file_sha256, filepath)
+    cache_keys = {part: derived_key('previews', input_hash, interval, width, columns, part) for part in names}
+    cached = [await asyncio.to_thread(cache_fetch, cache_keys[part], paths[part]) for part in names]
+    if all(cached):
+        await websocket.send_json({"status": "success", "message": "Video previews generated", "fileID": fileID,
+                                   **names, "cached": True})
+        return
+    for path in paths.values():
+        await asyncio.to_thread(prepare_output, path)
+
+    try:
+        probe = await asyncio.to_thread(probe_media, filepath)
+        duration = float(probe['format']['duration'])
+        video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
+        if video_stream is None:
+            raise ValueError("Video has no video stream")
+        tile_height = max(2, round(width * int(video_stream['height']) / int(video_stream['width']) / 2) * 2)
+        # keep the sprite inside JPEG's 65535px limit by spacing thumbnails out on long videos
+        max_rows = 65535 // tile_height
+        interval = max(interval, duration / (max_rows * columns))
+        count = max(1, math.ceil(duration / interval))
+        rows = math.ceil(count / columns)
+        poster_time = min(duration * 0.1, 30)
+
+        # -skip_frame nokey decodes keyframes only; the poster is the last keyframe before poster_time
+        # and every sprite cell shows the latest keyframe at its timestamp
+        video = ffmpeg.input(filepath, skip_frame='nokey', threads=PROFILES['fast']['threads']).video.split()
+        poster = video[0].filter('select', f'lte(t,{poster_time})').output(
+            paths["poster"], fps_mode='passthrough', update=1)
+        sprite = (
+            video[1]
+            .filter('scale', width, tile_height)
+            .filter('fps', fps=f'1/{interval}', eof_action='pass')
+            .filter('tile', f'{columns}x{rows}')
+            .output(paths["sprite"], vframes=1, update=1)
+        )
+        stream = (
+            ffmpeg
+            .merge_outputs(poster, sprite)
+            .global_args('-filter_complex_threads', str(PROFILES['fast']['filter_threads']),
+                         '-progress', 'pipe:1', '-nostats', '-loglevel', 'error')
+        )
+        async with ffmpeg_supervisor.run(stream, [paths["poster"], paths["sprite"]], PROFILES['fast']['threads'],
+                                         ffmpeg_wait_notifier(websocket)) as process:
+            returncode = await read_ffmpeg_progress(websocket, process, duration)
+        if returncode != 0:
+            await websocket.send_json(
+                {"status": "error", "message": f"ffmpeg failed with exit code {returncode} while generating previews"})
+            return
+
+        cues = ["WEBVTT", ""]
+        for i in range(count):
+            x, y = (i % columns) * width, (i // columns) * tile_height
+            cues.append(f"{vtt_timestamp(i * interval)} --> {vtt_timestamp(min((i + 1) * interval, duration))}")
+            cues.append(f"{names['sprite']}#xywh={x},{y},{width},{tile_height}")
+            cues.append("")
+        with open(paths["thumbnails"], 'w') as f:
+            f.write("\n".join(cues))
+    except (ffmpeg.Error, FFmpegLimitExceeded, KeyError, ValueError) as e:
+        logger.warning("Error generating previews: %s", e)
+        await websocket.send_json({"status": "error", "message": str(e)})
+        return
+
+    for part in names:
+        await asyncio.to_thread(cache_put, cache_keys[part], paths[part])
+    await websocket.send_json({"status": "success", "message": "Video previews generated", "fileID": fileID, **names})
+
+
+async def package_adaptive_stream(websocket: WebSocket, fileID, filename, dash=False, profile=None):
+    # HLS ladder (and optionally a DASH manifest over the same renditions) under <name>_stream/
+    filepath = f"./media/{fileID}/{filename}"
+    stream_dir = f"{filename.rsplit('.', 1)[0]}_stream"
+    out_dir = f"./media/{fileID}/{stream_dir}"
+
+    if not os.path.isfile(filepath):
+        await websocket.send_json({"status": "error", "message": f"File not found: {filename}"})
+        return
+    if await asyncio.to_thread(detect_media_type, filepath) != 'video':
+        await websocket.send_json({"status": "error", "message": "Adaptive streams can only be made from videos"})
+        return
+    try:
+        profile, settings = get_profile(profile)
+    except ValueError as e:
+        await websocket.send_json({"status": "error", "message": str(e)})
+        return
+
+    try:
+        probe = await asyncio.to_thread(probe_media, filepath)
+        duration = float(probe['format']['duration'])
+        video_stream = next((s for s in probe['streams'] if s['codec_type'] == 'video'), None)
+        if video_stream is None:
+            raise ValueError("Video has no video stream")
+        has_audio = bool(stream_codecs(probe, 'audio'))
+        rungs = select_rungs(int(video_stream['height']))
+        names = rendition_names(rungs, has_audio)
+
+        await asyncio.to_thread(shutil.rmtree, out_dir, True)
+        for name in names + (["dash"] if dash else []):
+            await asyncio.to_thread(os.makedirs, f"{out_dir}/{name}")
+        threads = ffmpeg_threads.clamp(settings["threads"])
+        stream = hls_stream(filepath, out_dir, rungs, has_audio, profile, threads).global_args(
+            '-progress', 'pipe:1', '-nostats', '-loglevel', 'error')
+        async with ffmpeg_supervisor.run(stream, [], ffmpeg_threads.clamp(threads * len(rungs)),
+                                         ffmpeg_wait_notifier(websocket)) as process:
+            logger.info("Packaging as HLS with renditions %s", ', '.join(names))
+            returncode = await read_ffmpeg_progress(websocket, process, duration, {"stage": "hls"})
+        if returncode == 0 and dash:
+            stream = dash_stream(out_dir, names).global_args('-progress', 'pipe:1', '-nostats', '-loglevel', 'error')
+            async with ffmpeg_supervisor.run(stream, [], 1, ffmpeg_wait_notifier(websocket)) as process:
+                returncode = await read_ffmpeg_progress(websocket, process, duration, {"stage": "dash"})
+        if returncode != 0:
+            await asyncio.to_thread(shutil.rmtree, out_dir, True)
+            await websocket.send_json(
+                {"status": "error", "message": f"ffmpeg failed with exit code {returncode} while packaging"})
+            return
+    except (ffmpeg.Error, FFmpegLimitExceeded, KeyError, ValueError) as e:
+        logger.warning("Error packaging adaptive stream: %s", e)
+        await asyncio.to_thread(shutil.rmtree, out_dir, True)
+        await websocket.send_json({"status": "error", "message": str(e)})
+        return
+    except BaseException:
+        # cancelled job or closed socket: no half written ladder is left behind
+        await asyncio.to_thread(shutil.rmtree, out_dir, True)
+        raise
+
+    response = {"status": "success", "message": "Adaptive stream packaged", "fileID": fileID,
+                "hls": f"{stream_dir}/master.m3u8", "renditions": names}
+    if dash:
+        response["dash"] = f"{stream_dir}/dash/manifest.mpd"
+    await websocket.send_json(response)
+
+
+def vtt_timestamp(seconds):
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{secs:06.3f}"
+
+
+def ffmpeg_wait_notifier(websocket: WebSocket):
+    async def notify():
+        await websocket.send_json(
+            {"status": "progress", "progress_percent": 0.0, "message": "Waiting for a free ffmpeg slot"})
+    return notify
+
+
+def queue_position_notifier(websocket: WebSocket):
+    async def notify(position):
+        await websocket.send_json(
+            {"status": "progress", "progress": 0.0, "message": f"Queued at position {position}",
+             "queue_position": position})
+    return notify
+
+
+async def send_rendered_transcript(websocket: WebSocket, filepath, document, output_format, cached=False):
+    # every output format is rendered from the stored transcript, so asking for another one never re-transcribes
+    filename_without_ext = os.path.basename(filepath).rsplit('.', 1)[0]
+    output_path = f"{os.path.dirname(filepath)}/{filename_without_ext}.{output_format}"
+    await asyncio.to_thread(prepare_output, output_path)
+    await asyncio.to_thread(render_transcript, document, output_path)
+    response = {"status": "success", "message": f"Transcription completed: {filename_without_ext}.{output_format}",
+                "filename": f"{filename_without_ext}.{output_format}",
+                "transcript": os.path.basename(transcript_path(filepath))}
+    if cached:
+        response["cached"] = True
+    await websocket.send_json(response)
+
+
+async def observe_real_time_factor(engine, model, parallel, filepath, started):
+    # model loading and queueing are left out, only the transcription itself is compared to the audio length
+    elapsed = time.perf_counter() - started
+    duration = await asyncio.to_thread(audio_duration, filepath)
+    if duration:
+        transcription_rtf.observe(elapsed / duration, engine=engine, model=model,
+                                  mode='parallel' if parallel else 'sequential')
+
+
+async def store_transcript(filepath, document, cache_key):
+    path = transcript_path(filepath)
+    await asyncio.to_thread(prepare_output, path)
+    await asyncio.to_thread(save_transcript, filepath, document)
+    await asyncio.to_thread(cache_put, cache_key, path)
+
+
+async def fetch_transcript(filepath, cache_key):
+    if not await asyncio.to_thread(cache_fetch, cache_key, transcript_path(filepath)):
+        return None
+    return await asyncio.to_thread(load_transcript, filepath)
+
+
+async def transcribe_file(websocket: WebSocket, fileID, filename, model, language, output_format, parallel=False):
+    filepath = f"./media/{fileID}/{filename}"
 
     if language != "en" and model != "tiny":
         await websocket.send_json(
@@ -179,57 +517,92 @@ async def transcribe_file(websocket: WebSocket, fileID, filename, model, languag
             {"status": "error", "message": f"Unsupported model: {model}. Supported models are: tiny, tiny.en, base, base.en, small, small.en"})
         return
 
+    if output_format not in RENDER_FORMATS:
+        await websocket.send_json(
+            {"status": "error", "message": f"Unsupported output format: {output_format}. Supported formats are: "
+                                           f"{', '.join(RENDER_FORMATS)}"})
+        return
+
     if language == 'en':
         MODEL_TIMEOUT = 60
     else:
         MODEL_TIMEOUT = 120
 
-    print(f"Transcribing {filepath} using model {model} and language {language}")
+    logger.info("Transcribing with whisper model %s, language %s", model, language)
     try:
-        model = whisper.load_model(model)
-        queue: asyncio.Queue = asyncio.Queue()
-        loop = asyncio.get_running_loop()
-        executor = ThreadPoolExecutor(max_workers=1)
-        print("Setting up transcription with Whisper model...")
-
-        def progress_callback(progress):
-            print("Progress callback:", progress)
-            queue.put_nowait({"status": "progress", "progress": progress})
-
-        task = loop.run_in_executor(
-            executor,
-            lambda: model.transcribe(filepath, verbose=False, language=language, progress_callback=progress_callback)
-        )
+        input_hash = await asyncio.to_thread(file_sha256, filepath)
+        cache_key = derived_key('transcript', 'whisper', input_hash, model, language, parallel,
+                                TRANSCRIPT_WORD_TIMESTAMPS)
+        document = await fetch_transcript(filepath, cache_key)
+        if document is not None:
+            await send_rendered_transcript(websocket, filepath, document, output_format, cached=True)
+            return
 
-        await websocket.send_json({"status": "progress", "message": "Transcription started", "progress": 0.0})
-        while True:
-            try:
-                print("Waiting for transcription updates...")
-                update = await asyncio.wait_for(queue.get(), timeout=MODEL_TIMEOUT)
-                await websocket.send_json(update)
-                await asyncio.sleep(0.1)  # Avoid busy waiting
-                if update.get("status") == "progress" and update.get("progress") == 100.0:
-                    break
-            except asyncio.TimeoutError:
-                await websocket.send_json(
-                    {"status": "error", "message": f"Transcription timeout ({MODEL_TIMEOUT}s without updates)"})
-
-        result = await task
-        writer = whisper.utils.get_writer(output_format, f'./media/{fileID}/')
-        writer(result, filepath)
-        await websocket.send_json(
-            {"status": "success", "message": f"Transcription completed: {filename_without_ext}.{output_format}",
-             "filename": f"{filename_without_ext}.{output_format}"})
+        if parallel:
+            # the chunks run in the shared process pool, the scheduler slot only bounds how many such jobs queue up
+            async with transcription_scheduler.acquire(('whisper', model, 'parallel'),
+                                                       queue_position_notifier(websocket)):
+                started = time.perf_counter()
+                result = await transcribe_in_chunks(websocket, 'whisper', filepath, model, language)
+        else:
+            async with transcription_scheduler.acquire(('whisper', model),
+                                                       queue_position_notifier(websocket)) as executor:
+                queue: asyncio.Queue = asyncio.Queue()
+                loop = asyncio.get_running_loop()
+                cached = await loop.run_in_executor(executor, model_cache.get, 'whisper', model)
+
+                def progress_callback(progress):
+                    # runs in the executor thread, outside the job's log context
+                    logger.debug("Transcription progress %.1f%%", progress,
+                                 extra={"sample": "transcription", "fileID": fileID})
+                    loop.call_soon_threadsafe(queue.put_nowait, {"status": "progress", "progress": progress})
 
+                def run_transcription():
+                    # torch wants a writable buffer, so whisper gets a copy of the memory mapped samples
+                    audio = np.array(load_pcm(filepath))
+                    with cached.lock:
+                        return cached.model.transcribe(audio, verbose=False, language=language,
+                                                       word_timestamps=TRANSCRIPT_WORD_TIMESTAMPS,
+                                                       progress_callback=progress_callback)
+
+                started = time.perf_counter()
+                task = loop.run_in_executor(executor, run_transcription)
+
+                await websocket.send_json({"status": "progress", "message": "Transcription started", "progress": 0.0})
+                while not task.done():
+                    # waits on the transcription too, so a failed one (which never reports 100%) ends the loop
+                    # and gives the scheduler slot back instead of timing out forever
+                    update = asyncio.ensure_future(queue.get())
+                    done, _ = await asyncio.wait({update, task}, timeout=MODEL_TIMEOUT,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    if update not in done:
+                        update.cancel()
+                        if not done:
+                            await websocket.send_json({"status": "error",
+                                                       "message": f"Transcription timeout ({MODEL_TIMEOUT}s without "
+                                                                  f"updates)"})
+                        continue
+                    await websocket.send_json(update.result())
+                    if update.result().get("status") == "progress" and update.result().get("progress") == 100.0:
+                        break
+
+                # re-raises the transcription's exception, which is reported below
+                result = await task
+        await observe_real_time_factor('whisper', model, parallel, filepath, started)
+        document = build_transcript('whisper', model, result["language"], result["segments"])
+        await store_transcript(filepath, document, cache_key)
+        await send_rendered_transcript(websocket, filepath, document, output_format)
+
+    except SchedulerBusy as e:
+        await websocket.send_json({"status": "error", "code": 503, "message": str(e)})
     except Exception as e:
-        print("Error during transcription:", str(e))
+        logger.exception("Error during transcription: %s", e)
         await websocket.send_json({"status": "error", "message": str(e)})
         return
 
 
-async def transcribe_file_fast(websocket: WebSocket, fileID, filename, model, output_format):
+async def transcribe_file_fast(websocket: WebSocket, fileID, filename, model, output_format, parallel=False):
     filepath = f"./media/{fileID}/{filename}"
-    filename_without_ext = filename.rsplit('.', 1)[0]
 
     # if language != "en" and model != "tiny":
     #     await websocket.send_json(
@@ -241,33 +614,82 @@ async def transcribe_file_fast(websocket: WebSocket, fileID, filename, model, ou
             {"status": "error", "message": f"Unsupported model: {model}. Supported models are: tiny, tiny.en, base, base.en, small, small.en"})
         return
 
-    print(f"Transcribing {filepath} using model {model} and CTranslate2")
+    if output_format not in RENDER_FORMATS:
+        await websocket.send_json(
+            {"status": "error", "message": f"Unsupported output format: {output_format}. Supported formats are: "
+                                           f"{', '.join(RENDER_FORMATS)}"})
+        return
+
+    logger.info("Transcribing with faster-whisper model %s", model)
     try:
-        model = WhisperModel(model, device="cpu", compute_type="int8")
-        segments, info = model.transcribe(filepath, beam_size=2, log_progress=True)  # this is just a generator
-        print(f"Detected language: {info.language} with probability {info.language_probability*100}%, "
-              f"duration: {info.duration} seconds")
-        # actually run the generation to create transcription segments
-        res = []
-        for s in segments:
-            seg_dict = {
-                "start": s.start,
-                "end": s.end,
-                "text": s.text
-            }
-            res.append(seg_dict)
-
-            percent = min(100, (s.end / info.duration) * 100)
-            await websocket.send_json({"status": "progress", "progress": percent})
+        input_hash = await asyncio.to_thread(file_sha256, filepath)
+        cache_key = derived_key('transcript', 'faster-whisper', input_hash, model, parallel, TRANSCRIPT_WORD_TIMESTAMPS)
+        document = await fetch_transcript(filepath, cache_key)
+        if document is not None:
+            await send_rendered_transcript(websocket, filepath, document, output_format, cached=True)
+            return
+
+        if parallel:
+            async with transcription_scheduler.acquire(('faster-whisper', model, 'parallel'),
+                                                       queue_position_notifier(websocket)):
+                started = time.perf_counter()
+                res = (await transcribe_in_chunks(websocket, 'faster-whisper', filepath, model))["segments"]
+                language = None
+        else:
+            async with transcription_scheduler.acquire(('faster-whisper', model),
+                                                       queue_position_notifier(websocket)) as executor:
+                loop = asyncio.get_running_loop()
+                cached = await loop.run_in_executor(executor, model_cache.get, 'faster-whisper', model)
+                queue: asyncio.Queue = asyncio.Queue()
+                stop = threading.Event()
+
+                def run_transcription():
+                    # decoding happens while the segments generator is consumed, so consume it off the event loop
+                    try:
+                        segments, info = cached.model.transcribe(load_pcm(filepath), beam_size=2, log_progress=True,
+                                                                 word_timestamps=TRANSCRIPT_WORD_TIMESTAMPS)
+                        loop.call_soon_threadsafe(queue.put_nowait, info)
+                        for s in segments:
+                            if stop.is_set():
+                                break
+                            loop.call_soon_threadsafe(queue.put_nowait, s)
+                    finally:
+                        loop.call_soon_threadsafe(queue.put_nowait, None)
+
+                started = time.perf_counter()
+                task = loop.run_in_executor(executor, run_transcription)
+                try:
+                    res = []
+                    info = None
+                    while (item := await queue.get()) is not None:
+                        if info is None:
+                            info = item
+                            logger.info("Detected language %s (probability %.0f%%), duration %.1fs",
+                                        info.language, info.language_probability * 100, info.duration)
+                            continue
+                        seg_dict = {
+                            "start": item.start,
+                            "end": item.end,
+                            "text": item.text
+                        }
+                        res.append({**seg_dict, "words": [word_dict(w) for w in item.words or []]})
+
+                        percent = min(100, (item.end / info.duration) * 100) if info.duration else 0.0
+                        await websocket.send_json({"status": "progress", "progress": percent, "segment": seg_dict})
+                finally:
+                    # stops the worker early if the client went away mid-transcription
+                    stop.set()
+                    await task
+                language = info.language if info is not None else None
         await websocket.send_json({"status": "progress", "progress": 100.0})
-        subs = pysubs.load_from_whisper(res)
-        output_path = f"./media/{fileID}/{filename_without_ext}.{output_format}"
-        subs.save(output_path)
-        await websocket.send_json(
-            {"status": "success", "message": f"Transcription completed: {filename_without_ext}.{output_format}",
-             "filename": f"{filename_without_ext}.{output_format}"})
+        await observe_real_time_factor('faster-whisper', model, parallel, filepath, started)
+        document = build_transcript('faster-whisper', model, language, res)
+        await store_transcript(filepath, document, cache_key)
+        await send_rendered_transcript(websocket, filepath, document, output_format)
 
+    except SchedulerBusy as e:
+        await websocket.send_json({"status": "error", "code": 503, "message": str(e)})
     except Exception as e:
-        print("Error during transcription:", str(e))
+        logger.exception("Error during transcription: %s", e)
         await websocket.send_json({"status": "error", "message": str(e)})
         return
@@ -0,0 +1,64 @@
+from concurrent.futures import ProcessPoolExecutor
+import math
+import multiprocessing
+
+from PIL import Image
+from pillow_heif import register_heif_opener
+
+from src.config import IMAGE_WORKERS
+
+_image_pool = None
+
+
+def image_pool():
+    # spawned rather than forked: the API process holds torch/whisper threads that must not be forked,
+    # and this module is all a worker needs to import
+    global _image_pool
+    if _image_pool is None:
+        _image_pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context('spawn'),
+                                          initializer=register_heif_opener)
+    return _image_pool
+
+
+def shutdown_image_pool():
+    global _image_pool
+    if _image_pool is not None:
+        _image_pool.shutdown(wait=False, cancel_futures=True)
+        _image_pool = None
+
+
+def size_suffix(width, height):
+    if width and height:
+        return f"_{width}x{height}"
+    elif width:
+        return f"_{width}w"
+    elif height:
+        return f"_{height}h"
+    return ""
+
+
+def save_image(image, output_path, output_format):
+    if output_format.lower() == 'jpg' and image.mode != 'RGB':
+        # JPEG does not support palette mode color, needs to be RGB
+        image = image.convert('RGB')
+    image.save(output_path)
+
+
+def convert_image(filepath, targets):
+    # targets are (output_path, output_format, width, height) tuples, width/height bound a thumbnail
+    with Image.open(filepath) as image:
+        # a single given dimension bounds the other one through the aspect ratio, so draft() can shrink for it too
+        bounds = [(width or math.ceil(height * image.width / image.height),
+                   height or math.ceil(width * image.height / image.width)) if width or height
+                  else (image.width, image.height) for _, _, width, height in targets]
+        if all(width or height for _, _, width, height in targets):
+            # JPEG can decode straight to 1/2, 1/4 or 1/8 scale, ask for the largest size we need
+            image.draft(None, (max(w for w, _ in bounds), max(h for _, h in bounds)))
+        image.load()
+        for (output_path, output_format, width, height), bound in zip(targets, bounds):
+            result = image
+            if width or height:
+                # reducing_gap lets Pillow shrink with reduce() before the final resampling pass
+                result = image.copy()
+                result.thumbnail(bound, reducing_gap=2.0)
+            save_image(result, output_path, output_format)
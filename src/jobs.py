@@ -0,0 +1,170 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from src.config import JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS
+from src.metrics import jobs_queued
+
+FINISHED = ("success", "error", "cancelled")
+
+CANCELLED = {"status": "cancelled", "message": "Job cancelled"}
+WORKER_LOST = {"status": "error", "message": "Job failed: its worker stopped responding"}
+
+
+class JobQueue:
+    # jobs and every message they send live in SQLite next to the media, so any number of API and worker processes
+    # sharing ./media see the same queue; a job outlives the socket that submitted it and its messages can be
+    # replayed from any point (events.seq) by a client that reconnects
+    def __init__(self, db_path, lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self):
+        # each thread (the API threadpool, every worker's publish thread) keeps one connection open; only the first
+        # one creates the schema
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        with self._schema_lock:
+            if not self._schema_ready:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, status TEXT NOT NULL,
+                    result TEXT, progress TEXT, worker TEXT, attempts INTEGER NOT NULL DEFAULT 0,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0, heartbeat REAL,
+                    created REAL NOT NULL, started REAL, finished REAL);
+                CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+                CREATE TABLE IF NOT EXISTS events (seq INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL,
+                                                   data TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS events_job ON events (job_id, seq);
+                """)
+                self._schema_ready = True
+        self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front, so two workers can never claim the same job
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def submit(self, kind, payload):
+        job_id = str(uuid.uuid4())
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO jobs (id, kind, payload, status, created) VALUES (?, ?, ?, 'queued', ?)",
+                         (job_id, kind, json.dumps(payload), time.time()))
+        return job_id
+
+    def get(self, job_id):
+        conn = self._connect()
+        row = conn.execute("SELECT id, kind, payload, status, result, progress, attempts, created, started, "
+                           "finished FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {"jobID": row[0], "type": row[1], "payload": json.loads(row[2]), "status": row[3],
+               "result": json.loads(row[4]) if row[4] else None,
+               "progress": json.loads(row[5]) if row[5] else None,
+               "attempts": row[6], "created": row[7], "started": row[8], "finished": row[9]}
+        if job["status"] == "queued":
+            job["queue_position"] = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created <= ?", (row[7],)).fetchone()[0]
+        return job
+
+    def claim(self, worker):
+        # hands the oldest queued job to `worker`; jobs whose worker died (no heartbeat within the lease)
+        # go back to the queue first, or fail once they have used up their attempts
+        now = time.time()
+        with self._transaction() as conn:
+            stale = conn.execute("SELECT id, attempts, cancel_requested FROM jobs "
+                                 "WHERE status = 'running' AND heartbeat < ?", (now - self.lease_seconds,)).fetchall()
+            for job_id, attempts, cancel_requested in stale:
+                if cancel_requested:
+                    self._finish(conn, job_id, "cancelled", CANCELLED, now)
+                elif attempts < self.max_attempts:
+                    conn.execute("UPDATE jobs SET status = 'queued', worker = NULL WHERE id = ?", (job_id,))
+                else:
+                    self._finish(conn, job_id, "error", WORKER_LOST, now)
+            row = conn.execute("SELECT id, kind, payload, created FROM jobs WHERE status = 'queued' "
+                               "ORDER BY created LIMIT 1").fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, started = ?, "
+                         "heartbeat = ? WHERE id = ?", (worker, now, now, row[0]))
+        return {"id": row[0], "kind": row[1], "payload": json.loads(row[2]), "created": row[3]}
+
+    def queued(self):
+        return self._connect().execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+    def heartbeat(self, job_id):
+        # extends the lease of a running job, returns True once a client asked to cancel it
+        with self._transaction() as conn:
+            conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time(), job_id))
+            return bool(conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()[0])
+
+    def publish(self, job_id, data):
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO events (job_id, data) VALUES (?, ?)", (job_id, json.dumps(data)))
+            if data.get("status") == "progress":
+                conn.execute("UPDATE jobs SET progress = ? WHERE id = ?", (json.dumps(data), job_id))
+
+    def events(self, job_id, after=0):
+        rows = self._connect().execute("SELECT seq, data FROM events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                                       (job_id, after)).fetchall()
+        return [(seq, json.loads(data)) for seq, data in rows]
+
+    def finish(self, job_id, status, result):
+        with self._transaction() as conn:
+            self._finish(conn, job_id, status, result, time.time(), publish=False)
+
+    def _finish(self, conn, job_id, status, result, now, publish=True):
+        conn.execute("UPDATE jobs SET status = ?, result = ?, finished = ? WHERE id = ?",
+                     (status, json.dumps(result), now, job_id))
+        if publish:
+            conn.execute("INSERT INTO events (job_id, data) VALUES (?, ?)", (job_id, json.dumps(result)))
+
+    def requeue(self, job_id):
+        # a worker shutting down hands its job back without spending an attempt (unless it was being cancelled)
+        with self._transaction() as conn:
+            conn.execute("UPDATE jobs SET status = 'queued', worker = NULL, attempts = attempts - 1 "
+                         "WHERE id = ? AND status = 'running' AND cancel_requested = 0", (job_id,))
+            if conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()[0] == "running":
+                self._finish(conn, job_id, "cancelled", CANCELLED, time.time())
+
+    def cancel(self, job_id):
+        # queued jobs are cancelled right away, running ones when their worker next renews the lease;
+        # returns the job's status, or None for an unknown job
+        with self._transaction() as conn:
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row[0] == "queued":
+                self._finish(conn, job_id, "cancelled", CANCELLED, time.time())
+                return "cancelled"
+            if row[0] == "running":
+                conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+            return row[0]
+
+    def purge(self, before):
+        # forgets jobs (and their messages) that finished before `before`
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM events WHERE job_id IN (SELECT id FROM jobs WHERE finished < ?)", (before,))
+            conn.execute("DELETE FROM jobs WHERE finished < ?", (before,))
+
+
+job_queue = JobQueue('./media/.jobs.db')
+jobs_queued.set_function(job_queue.queued)
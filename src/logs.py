@@ -0,0 +1,113 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from contextlib import contextmanager
+
+from src.config import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_SECONDS
+
+# fields (fileID, jobID, ...) attached to every record logged while they are bound; asyncio tasks and
+# asyncio.to_thread copy the context, so whatever a job starts is correlated with it
+_context = contextvars.ContextVar("log_context", default={})
+
+# attributes every LogRecord has, anything else on a record came from extra= and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample"}
+
+_listener = None
+
+
+@contextmanager
+def log_context(**fields):
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class SampleFilter(logging.Filter):
+    # records logged with extra={"sample": key} (progress ticks and the like) pass at most once every `interval`
+    # seconds per key and file/job, the rest are dropped before they are queued
+    def __init__(self, interval):
+        super().__init__()
+        self.interval = interval
+        self.last = {}
+
+    def filter(self, record):
+        key = getattr(record, "sample", None)
+        if key is None:
+            return True
+        key = (key, getattr(record, "fileID", None), getattr(record, "jobID", None))
+        now = time.monotonic()
+        if now - self.last.get(key, float("-inf")) < self.interval:
+            return False
+        self.last[key] = now
+        if len(self.last) > 10000:
+            self.last = {k: t for k, t in self.last.items() if now - t < self.interval}
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # only the message is rendered in the calling thread, formatting happens on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"time": self.formatTime(record), "level": record.levelname, "logger": record.name,
+                 "message": record.getMessage(), **_fields(record)}
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        fields = " ".join(f"{key}={value}" for key, value in _fields(record).items())
+        return super().format(record) + (f" [{fields}]" if fields else "")
+
+
+def setup_logging():
+    # records are put on a queue by the logging thread and written to stderr by a listener thread,
+    # so a slow terminal or pipe never blocks the event loop
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    records = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    # context and sampling are applied in the calling thread, the context is gone once the record is queued
+    handler.addFilter(ContextFilter())
+    handler.addFilter(SampleFilter(LOG_SAMPLE_SECONDS))
+    logger = logging.getLogger("src")
+    logger.setLevel(LOG_LEVEL)
+    logger.addHandler(handler)
+    logger.propagate = False
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    atexit.register(_listener.stop)
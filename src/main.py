@@ -1,13 +1,53 @@
+import asyncio
+import hashlib
+import logging
 import os
-import uuid
+import shutil
+import time
+from collections import deque
+from contextlib import asynccontextmanager, suppress
 
-from fastapi import FastAPI, UploadFile, HTTPException, WebSocket
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, WebSocket, Request
+from fastapi.responses import FileResponse, Response
+from starlette.concurrency import run_in_threadpool
 from starlette.websockets import WebSocketDisconnect
 
-from src.helper import change_file_format, transcribe_file, transcribe_file_fast
+from src.config import (MAX_UPLOAD_SIZE, UPLOAD_CHUNK_SIZE, RESUMABLE_CHUNK_SIZE, MAX_RESUMABLE_CHUNK_SIZE,
+                        JOB_POLL_INTERVAL)
+from src.handlers import handle_change_format, handle_transcribe, handle_transcribe_fast, JOB_HANDLERS
+from src.images import shutdown_image_pool
+from src.jobs import job_queue, FINISHED
+from src.logs import setup_logging
+from src.mediainfo import probe_media, media_info
+from src.metrics import CONTENT_TYPE, render_metrics, upload_throughput
+from src.model_cache import warm_up_models
+from src.parallel_transcription import shutdown_transcription_pool
+from src.retention import retention, retention_loop, remove_media_dir
+from src.scheduler import transcription_scheduler
+from src.storage import (store_content, file_sha256, create_media_dir, prepare_output, valid_file_id, media_file_path,
+                         UploadWriter, MultipartFileReader, ResumableUpload, UploadTooLarge, ChecksumMismatch)
+from src.supervisor import ffmpeg_supervisor
+from src.transcripts import RENDER_FORMATS, load_transcript, render_transcript
 
-app = FastAPI()
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # load configured models in the background so startup is not blocked on weight downloads
+    warm_up = asyncio.create_task(asyncio.to_thread(warm_up_models))
+    evictor = asyncio.create_task(retention_loop(retention))
+    yield
+    warm_up.cancel()
+    evictor.cancel()
+    transcription_scheduler.shutdown()
+    ffmpeg_supervisor.shutdown()
+    shutdown_image_pool()
+    shutdown_transcription_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 @app.get("/")
@@ -15,71 +55,369 @@ async def root():
     return {"status": "200 OK"}
 
 
+@app.get("/metrics")
+async def metrics():
+    return Response(await run_in_threadpool(render_metrics), media_type=CONTENT_TYPE)
+
+
+def cache_probe(path):
+    # probed once at upload so conversions and /mediainfo never spawn ffprobe again; unreadable files are fine here
+    try:
+        probe_media(path)
+    except (ValueError, OSError) as e:
+        logger.warning("Could not probe %s: %s", path, e)
+
+
+# boundaries and part headers around the file; a body longer than the limit plus this cannot hold an allowed file
+MULTIPART_OVERHEAD = 64 * 1024
+
+
 @app.post("/uploadmedia")
-async def upload_media(file: UploadFile):
+async def upload_media(request: Request):
+    # the multipart body is parsed as it streams in and the file part written straight to its job folder,
+    # so an upload is written once and stops as soon as it goes over the limit
+    content_length = request.headers.get("content-length", "")
+    if MAX_UPLOAD_SIZE and content_length.isdigit() and int(content_length) > MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413,
+                            detail=f"File exceeds the maximum upload size of {MAX_UPLOAD_SIZE // (1024 * 1024)} MB")
+    try:
+        reader = MultipartFileReader(request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     try:
-        fileID = uuid.uuid4()
-        while os.path.exists(f'./media/{fileID}'):
-            fileID = uuid.uuid4()
-        os.mkdir(f'./media/{fileID}')
-
-        file_path = f"./media/{fileID}/" + file.filename
-        print('Uploading file:', file_path)
-        with open(file_path, "wb") as f:
-            f.write(await file.read())
+        fileID = create_media_dir()
+        try:
+            started = time.perf_counter()
+            writer = await run_in_threadpool(UploadWriter, f'./media/{fileID}', MAX_UPLOAD_SIZE)
+            try:
+                async for chunk in request.stream():
+                    reader.feed(chunk)
+                    if len(reader.data) >= UPLOAD_CHUNK_SIZE:
+                        await run_in_threadpool(writer.write, bytes(reader.data))
+                        reader.data.clear()
+                reader.finish()
+                filename = os.path.basename(reader.filename or "")
+                if not filename or filename.startswith('.'):
+                    raise ValueError("No file in the upload")
+                await run_in_threadpool(writer.write, bytes(reader.data))
+                file_path = f"./media/{fileID}/{filename}"
+                size, sha256 = await run_in_threadpool(writer.commit, file_path)
+                logger.info("Uploaded file %s", filename, extra={"fileID": fileID})
+            except BaseException:
+                await run_in_threadpool(writer.discard)
+                raise
+            upload_throughput.observe(size / max(time.perf_counter() - started, 1e-6), kind="upload")
+            await run_in_threadpool(store_content, file_path, sha256)
+            await run_in_threadpool(cache_probe, file_path)
+            await run_in_threadpool(retention.record, fileID)
+        except BaseException:
+            shutil.rmtree(f'./media/{fileID}', ignore_errors=True)
+            raise
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        # includes malformed multipart bodies
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print("Error uploading file")
+        logger.exception("Error uploading file")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        file.file.close()
-    return {"filename": file.filename, "size": file.size, "fileID": str(fileID)}
+    return {"filename": filename, "size": size, "fileID": fileID, "sha256": sha256}
+
+
+@app.post("/uploadmedia/init")
+async def init_resumable_upload(filename: str, size: int, chunk_size: int = RESUMABLE_CHUNK_SIZE):
+    filename = os.path.basename(filename)
+    # dot names are reserved for the session files and sidecars kept in the job folder
+    if not filename or filename.startswith('.') or size < 0 or not 0 < chunk_size <= MAX_RESUMABLE_CHUNK_SIZE:
+        raise HTTPException(status_code=400, detail="Invalid filename, size or chunk_size")
+    if MAX_UPLOAD_SIZE and size > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413,
+                            detail=f"File exceeds the maximum upload size of {MAX_UPLOAD_SIZE // (1024 * 1024)} MB")
+    try:
+        fileID = create_media_dir()
+        upload = await run_in_threadpool(ResumableUpload.create, fileID, filename, size, chunk_size)
+        await run_in_threadpool(retention.record, fileID)
+    except Exception as e:
+        logger.exception("Error starting resumable upload: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"fileID": fileID, "filename": filename, "size": size, "chunk_size": chunk_size,
+            "total_chunks": upload.total_chunks}
+
+
+@app.put("/uploadmedia/chunk")
+async def upload_chunk(fileID: str, index: int, request: Request, sha256: str | None = None):
+    upload = ResumableUpload.load(fileID) if valid_file_id(fileID) else None
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if not 0 <= index < upload.total_chunks:
+        raise HTTPException(status_code=400, detail=f"Chunk index must be between 0 and {upload.total_chunks - 1}")
+
+    offset, length = upload.chunk_range(index)
+    started = time.perf_counter()
+    hasher = hashlib.sha256()
+    written = 0
+    buffer = bytearray()
+    async for data in request.stream():
+        if written + len(buffer) + len(data) > length:
+            raise HTTPException(status_code=400, detail=f"Chunk {index} must be exactly {length} bytes")
+        buffer += data
+        if len(buffer) >= UPLOAD_CHUNK_SIZE:
+            hasher.update(buffer)
+            await run_in_threadpool(upload.write, offset + written, bytes(buffer))
+            written += len(buffer)
+            buffer.clear()
+    if buffer:
+        hasher.update(buffer)
+        await run_in_threadpool(upload.write, offset + written, bytes(buffer))
+        written += len(buffer)
+
+    if written != length:
+        raise HTTPException(status_code=400, detail=f"Chunk {index} must be exactly {length} bytes")
+    if sha256 and hasher.hexdigest() != sha256.lower():
+        raise HTTPException(status_code=400, detail=f"Checksum mismatch for chunk {index}")
+    await run_in_threadpool(upload.mark_received, index)
+    upload_throughput.observe(written / max(time.perf_counter() - started, 1e-6), kind="chunk")
+    await run_in_threadpool(retention.touch, fileID)
+    return {"fileID": fileID, "index": index, "size": written}
+
+
+@app.get("/uploadmedia/status")
+async def resumable_upload_status(fileID: str):
+    upload = ResumableUpload.load(fileID) if valid_file_id(fileID) else None
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"fileID": fileID, "filename": upload.filename, "size": upload.size, "chunk_size": upload.chunk_size,
+            "total_chunks": upload.total_chunks, "received": upload.received(), "missing": upload.missing()}
+
+
+@app.post("/uploadmedia/finalize")
+async def finalize_resumable_upload(fileID: str, sha256: str | None = None):
+    upload = ResumableUpload.load(fileID) if valid_file_id(fileID) else None
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    missing = upload.missing()
+    if missing:
+        raise HTTPException(status_code=409, detail=f"Upload incomplete, missing chunks: {missing}")
+    try:
+        size, digest = await run_in_threadpool(upload.finalize, sha256)
+        await run_in_threadpool(store_content, f'./media/{fileID}/{upload.filename}', digest)
+        await run_in_threadpool(cache_probe, f'./media/{fileID}/{upload.filename}')
+        await run_in_threadpool(retention.record, fileID)
+    except ChecksumMismatch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("Error finalizing upload: %s", e, extra={"fileID": fileID})
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"filename": upload.filename, "size": size, "fileID": fileID, "sha256": digest}
+
+class MediaFileResponse(FileResponse):
+    # Starlette already answers Range/If-Range and hands the path to servers that offer
+    # http.response.pathsend (sendfile); bigger chunks cut per-chunk overhead everywhere else
+    chunk_size = 1024 * 1024
+
+
+def etag_matches(if_none_match, etag):
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+
+def media_path(fileID, filename):
+    # fileID and filename come from the client, a path that leaves the job folder is treated as missing
+    # (reads and sidecar writes must never touch anything outside ./media)
+    filepath = media_file_path(fileID, filename)
+    if filepath is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return filepath
+
 
 @app.get('/downloadmedia')
-async def download_media(fileID: str, filename: str):
+async def download_media(fileID: str, filename: str, request: Request, hash: str | None = None):
+    response = await serve_media(media_path(fileID, filename), request, hash)
+    await run_in_threadpool(retention.touch, fileID)
+    return response
+
+
+@app.get('/stream/{fileID}/{path:path}')
+async def stream_media(fileID: str, path: str, request: Request):
+    # path based twin of /downloadmedia, so the relative URIs inside HLS playlists and DASH manifests resolve
+    response = await serve_media(media_path(fileID, path), request)
+    await run_in_threadpool(retention.touch, fileID)
+    return response
+
+
+async def serve_media(filepath, request: Request, hash=None):
+    if not os.path.isfile(filepath):
+        raise HTTPException(status_code=404, detail="File not found")
     try:
-        filepath = f'./media/{fileID}/{filename}'
-        return FileResponse(filepath)
+        sha256 = await run_in_threadpool(file_sha256, filepath)
+        headers = {
+            "etag": f'"{sha256}"',
+            # a URL that pins the content hash can never change, anything else must be revalidated
+            "cache-control": "public, max-age=31536000, immutable" if hash == sha256 else "no-cache",
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, headers["etag"]):
+            return Response(status_code=304, headers=headers)
+        return MediaFileResponse(filepath, headers=headers)
     except Exception as e:
-        print("Error downloading file:", str(e))
+        logger.exception("Error downloading %s: %s", filepath, e)
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@app.get('/mediainfo')
+async def get_media_info(fileID: str, filename: str):
+    filepath = media_path(fileID, filename)
+    if not os.path.isfile(filepath):
+        raise HTTPException(status_code=404, detail="File not found")
+    try:
+        info = await run_in_threadpool(media_info, filepath)
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    await run_in_threadpool(retention.touch, fileID)
+    return {"fileID": fileID, "filename": filename, **info}
+
+
+@app.post('/rendertranscript')
+async def render_transcript_file(fileID: str, filename: str, output_format: str):
+    # filename is the transcribed media file, its latest transcript is rendered without running a model
+    if output_format not in RENDER_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported output format: {output_format}. "
+                                                    f"Supported formats are: {', '.join(RENDER_FORMATS)}")
+    filepath = media_path(fileID, filename)
+    document = await run_in_threadpool(load_transcript, filepath)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Transcript not found, transcribe the file first")
+    output_filename = f"{filename.rsplit('.', 1)[0]}.{output_format}"
+    output_path = media_path(fileID, output_filename)
+    try:
+        await run_in_threadpool(prepare_output, output_path)
+        await run_in_threadpool(render_transcript, document, output_path)
+        await run_in_threadpool(retention.record, fileID)
+    except Exception as e:
+        logger.exception("Error rendering transcript: %s", e, extra={"fileID": fileID})
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"status": "success", "fileID": fileID, "filename": output_filename}
+
 @app.post('/deletemedia')
 async def delete_media(fileID: str):
     try:
         dir_path = f'./media/{fileID}'
-        if not os.path.exists(dir_path):
+        if not valid_file_id(fileID) or not os.path.exists(dir_path):
             raise HTTPException(status_code=404, detail="File not found")
-        for filename in os.listdir(dir_path):
-            file_path = os.path.join(dir_path, filename)
-            if os.path.isfile(file_path):
-                os.remove(file_path)
-        os.rmdir(dir_path)
+        await run_in_threadpool(remove_media_dir, './media', fileID)
+        await run_in_threadpool(retention.forget, fileID)
         return {"status": "success", "message": "File deleted successfully"}
     except Exception as e:
-        print("Error deleting file:", str(e))
+        logger.exception("Error deleting media: %s", e, extra={"fileID": fileID})
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post('/jobs', status_code=202)
+async def submit_job(data: dict):
+    # queues a changeformat/transcribe/transcribe-fast request for the worker processes; the body is the message
+    # the matching WebSocket endpoint takes, plus "type"
+    kind = data.pop("type", None)
+    if kind not in JOB_HANDLERS:
+        raise HTTPException(status_code=400, detail=f"Unsupported job type: {kind}. "
+                                                    f"Supported types are: {', '.join(JOB_HANDLERS)}")
+    fileID = data.get("fileID")
+    if not os.path.isfile(media_path(fileID, data.get("filename"))):
+        raise HTTPException(status_code=404, detail="File not found")
+    jobID = await run_in_threadpool(job_queue.submit, kind, data)
+    await run_in_threadpool(retention.touch, fileID)
+    return {"jobID": jobID, "status": "queued"}
+
+
+@app.get('/jobs/{jobID}')
+async def get_job(jobID: str):
+    job = await run_in_threadpool(job_queue.get, jobID)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.post('/jobs/{jobID}/cancel')
+async def cancel_job(jobID: str):
+    status = await run_in_threadpool(job_queue.cancel, jobID)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if status in FINISHED and status != "cancelled":
+        raise HTTPException(status_code=409, detail=f"Job already finished ({status})")
+    return {"jobID": jobID, "status": status}
+
+
+@app.websocket('/jobs/{jobID}/events')
+async def job_events(websocket: WebSocket, jobID: str, after: int = 0):
+    # replays the job's messages after `after` and follows it until it finishes; every message carries its "seq",
+    # so a client that reconnects picks up where it left off
+    await websocket.accept()
+    try:
+        while True:
+            # status first: a job seen as finished has written all of its messages already
+            job = await run_in_threadpool(job_queue.get, jobID)
+            if job is None:
+                await websocket.send_json({"status": "error", "message": "Job not found"})
+                break
+            for seq, data in await run_in_threadpool(job_queue.events, jobID, after):
+                await websocket.send_json({**data, "jobID": jobID, "seq": seq})
+                after = seq
+            if job["status"] in FINISHED:
+                break
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+        await websocket.close(1000, "Job finished")
+    except WebSocketDisconnect:
+        logger.info("WebSocket disconnected while following job", extra={"jobID": jobID})
+
+
+async def run_cancellable_jobs(websocket: WebSocket, handle):
+    # requests still run one at a time, but the socket keeps being read while one runs so that
+    # {"action": "cancel"} or a disconnect stops the job (and kills its ffmpeg child) right away
+    pending = deque()
+    job = None
+    receive = asyncio.ensure_future(websocket.receive_json())
+    try:
+        while True:
+            await asyncio.wait({receive, job} - {None}, return_when=asyncio.FIRST_COMPLETED)
+            if job is not None and job.done():
+                job.result()
+                job = None
+            if receive.done():
+                data = receive.result()
+                receive = asyncio.ensure_future(websocket.receive_json())
+                logger.debug("Received data: %s", data)
+                if data.get("action") == "cancel":
+                    if job is None:
+                        await websocket.send_json({"status": "error", "message": "No job to cancel"})
+                        continue
+                    pending.clear()
+                    job.cancel()
+                    with suppress(asyncio.CancelledError):
+                        await job
+                    job = None
+                    await websocket.send_json({"status": "cancelled", "message": "Job cancelled"})
+                else:
+                    pending.append(data)
+            if job is None and pending:
+                job = asyncio.create_task(handle(websocket, pending.popleft()))
+    finally:
+        receive.cancel()
+        if job is not None:
+            job.cancel()
+            await asyncio.gather(job, return_exceptions=True)
+
+
 @app.websocket("/changeformat")
 async def change_format(websocket: WebSocket):
     await websocket.accept()
     try:
-        while True:
-            data = await websocket.receive_json()
-            print("Received data:", data)
-            filename = data["filename"]
-            fileID = data["fileID"]
-            output_format = data["output_format"]
-            vcodec = data.get("video_codec", "copy")
-            acodec = data.get("audio_codec", "copy")
-            print(vcodec, acodec)
-            print(f"Changing format of {filename} ({fileID}) to {output_format}")
-            await change_file_format(websocket, fileID, filename, output_format, vcodec, acodec)
+        await run_cancellable_jobs(websocket, handle_change_format)
     except WebSocketDisconnect:
-        print("WebSocket disconnected")
+        logger.info("WebSocket disconnected")
         await websocket.close(1000, "WebSocket closed")
     except Exception as e:
-        print("Error in WebSocket connection:", str(e))
+        logger.exception("Error in WebSocket connection: %s", e)
         await websocket.close(1011, "Internal Server Error")
 
 @app.websocket("/transcribe")
@@ -88,20 +426,14 @@ async def transcribe(websocket: WebSocket):
     try:
         while True:
             data = await websocket.receive_json()
-            print("Received data for transcription:", data)
-            filename = data["filename"]
-            fileID = data["fileID"]
-            model = data.get("model", "base")
-            language = data.get("language", "en")
-            output_format = data.get("output_format", "srt")
-            print(f"Transcribing {filename} ({fileID}) using model {model}")
-            await transcribe_file(websocket, fileID, filename, model, language, output_format)
+            logger.debug("Received data for transcription: %s", data)
+            await handle_transcribe(websocket, data)
 
     except WebSocketDisconnect:
-        print("WebSocket disconnected during transcription")
+        logger.info("WebSocket disconnected during transcription")
         await websocket.close(1000, "WebSocket closed")
     except Exception as e:
-        print("Error in transcription WebSocket connection:", str(e))
+        logger.exception("Error in transcription WebSocket connection: %s", e)
         await websocket.close(1011, "Internal Server Error")
 
 @app.websocket("/transcribe-fast")
@@ -110,17 +442,12 @@ async def transcribe_fast(websocket: WebSocket):
     try:
         while True:
             data = await websocket.receive_json()
-            print("Received data for fast transcription:", data)
-            filename = data["filename"]
-            fileID = data["fileID"]
-            model = data.get("model", "base")
-            output_format = data.get("output_format", "srt")
-            print(f"Fast transcribing {filename} ({fileID}) using model {model}")
-            await transcribe_file_fast(websocket, fileID, filename, model, output_format)
+            logger.debug("Received data for fast transcription: %s", data)
+            await handle_transcribe_fast(websocket, data)
 
     except WebSocketDisconnect:
-        print("WebSocket disconnected during fast transcription")
+        logger.info("WebSocket disconnected during fast transcription")
         await websocket.close(1000, "WebSocket closed")
     except Exception as e:
-        print("Error in fast transcription WebSocket connection:", str(e))
+        logger.exception("Error in fast transcription WebSocket connection: %s", e)
         await websocket.close(1011, "Internal Server Error")
\ No newline at end of file
@@ -0,0 +1,99 @@
+import logging
+import mimetypes
+
+import ffmpeg
+
+from src.storage import read_meta, write_meta
+
+logger = logging.getLogger(__name__)
+
+mimetypes.add_type("image/webp", ".webp")  # mimetypes does not support webp by default
+mimetypes.add_type("video/flv", ".flv")  # mimetypes does not support flv by default
+# adaptive streaming playlists and segments
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/mp2t", ".ts")
+mimetypes.add_type("application/dash+xml", ".mpd")
+mimetypes.add_type("video/iso.segment", ".m4s")
+
+# ffprobe reads still images through these demuxers (plus the per-codec *_pipe ones)
+IMAGE_FORMATS = {"image2", "gif", "webp", "apng"}
+
+
+def get_media_type(filename):
+    mimestart = mimetypes.guess_type(filename)[0]
+    if mimestart and mimestart.startswith('image/'):
+        return 'image'
+    elif mimestart and mimestart.startswith('video/'):
+        return 'video'
+    elif mimestart and mimestart.startswith('audio/'):
+        return 'audio'
+    else:
+        return None
+
+
+def probe_media(path):
+    # ffprobe runs once per stored file, the result (or the fact that ffprobe cannot read it) is kept in the
+    # file's meta sidecar, so it is dropped together with the file and never outlives a rewrite
+    meta = read_meta(path)
+    if "probe" not in meta:
+        try:
+            probe = ffmpeg.probe(path)
+        except ffmpeg.Error as e:
+            logger.warning("Could not probe %s: %s", path, e.stderr.decode(errors='ignore').strip() if e.stderr else e)
+            probe = None
+        meta = write_meta(path, probe=probe)
+    if meta["probe"] is None:
+        raise ValueError(f"Could not read media information from {path.rsplit('/', 1)[-1]}")
+    return meta["probe"]
+
+
+def sniff_media_type(probe):
+    streams = [s for s in probe["streams"] if not s.get("disposition", {}).get("attached_pic")]
+    format_names = set(probe["format"].get("format_name", "").split(","))
+    video = [s for s in streams if s.get("codec_type") == "video"]
+    if video:
+        # still images inside ISO containers (avif, heif) come through the mov demuxer as one-frame videos
+        if (format_names & IMAGE_FORMATS or any(name.endswith("_pipe") for name in format_names)
+                or all(s.get("nb_frames") == "1" for s in video)):
+            return 'image'
+        return 'video'
+    if any(s.get("codec_type") == "audio" for s in streams):
+        return 'audio'
+    return None
+
+
+def detect_media_type(path):
+    # what the file contains, going by its extension only when ffprobe cannot tell (e.g. heic)
+    try:
+        media_type = sniff_media_type(probe_media(path))
+    except ValueError:
+        media_type = None
+    return media_type or get_media_type(path)
+
+
+def media_info(path):
+    probe = probe_media(path)
+    fmt = probe["format"]
+    streams = []
+    for stream in probe["streams"]:
+        info = {"index": stream["index"], "type": stream.get("codec_type"), "codec": stream.get("codec_name")}
+        if stream.get("codec_type") == "video":
+            info.update(width=stream.get("width"), height=stream.get("height"), pix_fmt=stream.get("pix_fmt"),
+                        frame_rate=stream.get("avg_frame_rate"),
+                        cover_art=bool(stream.get("disposition", {}).get("attached_pic")))
+        elif stream.get("codec_type") == "audio":
+            info.update(sample_rate=int(stream.get("sample_rate", 0)) or None, channels=stream.get("channels"),
+                        channel_layout=stream.get("channel_layout"))
+        if "bit_rate" in stream:
+            info["bit_rate"] = int(stream["bit_rate"])
+        if "duration" in stream:
+            info["duration"] = float(stream["duration"])
+        streams.append(info)
+    return {
+        "media_type": sniff_media_type(probe) or get_media_type(path),
+        "format": fmt.get("format_name"),
+        "duration": float(fmt["duration"]) if "duration" in fmt else None,
+        "size": int(fmt["size"]) if "size" in fmt else None,
+        "bit_rate": int(fmt["bit_rate"]) if "bit_rate" in fmt else None,
+        "streams": streams,
+    }
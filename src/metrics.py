@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# Prometheus text exposition without the client library: a handful of histograms and callback gauges,
+# kept per process (the API serves them on /metrics, workers on METRICS_PORT)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+RATIO_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5)
+THROUGHPUT_BUCKETS = tuple(mb * 1024 * 1024 for mb in (1, 5, 10, 25, 50, 100, 250, 500, 1000))
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class Histogram:
+    def __init__(self, name, description, labels=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()  # observed from worker threads as well as the event loop
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        # observes how long the block took, only when it completes without an exception
+        started = time.perf_counter()
+        yield
+        self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            labels = list(zip(self.labels, key))
+            for bound, count in zip(self.buckets, values):
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', '+Inf')])} {values[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {values[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {values[-1]}")
+        return lines
+
+
+class Gauge:
+    # read when scraped, from the callback the owning module registers with set_function()
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._function = None
+        _registry.append(self)
+
+    def set_function(self, function):
+        self._function = function
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge"]
+        if self._function is not None:
+            try:
+                lines.append(f"{self.name} {float(self._function())}")
+            except Exception as e:
+                logger.warning("Could not read gauge %s: %s", self.name, e)
+        return lines
+
+
+def render_metrics():
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+upload_throughput = Histogram("media_upload_throughput_bytes_per_second",
+                              "Upload throughput of whole uploads and resumable chunks", ("kind",), THROUGHPUT_BUCKETS)
+conversion_seconds = Histogram("media_conversion_seconds", "Time to convert a file, excluding cache hits",
+                               ("media_type", "output_format", "video_codec", "audio_codec"))
+model_load_seconds = Histogram("transcription_model_load_seconds", "Time to load a transcription model",
+                               ("engine", "model"))
+transcription_rtf = Histogram("transcription_real_time_factor",
+                              "Transcription time divided by the audio duration", ("engine", "model", "mode"),
+                              RATIO_BUCKETS)
+queue_wait_seconds = Histogram("queue_wait_seconds", "Time a job waited for a worker, an ffmpeg slot or threads",
+                               ("queue",))
+ffmpeg_processes = Gauge("ffmpeg_processes_active", "ffmpeg processes currently running")
+models_cached = Gauge("transcription_models_cached", "Transcription models held in the model cache")
+model_cache_bytes = Gauge("transcription_model_cache_bytes", "Estimated size of the cached transcription models")
+transcriptions_queued = Gauge("transcriptions_queued", "Transcriptions waiting for a model worker")
+jobs_queued = Gauge("jobs_queued", "Jobs in the durable queue waiting for a worker process")
+
+
+async def serve_metrics(port):
+    # bare HTTP endpoint for processes without a web framework (the job workers)
+    async def respond(reader, writer):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = (await asyncio.to_thread(render_metrics)).encode()
+            writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: {CONTENT_TYPE}\r\nContent-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(respond, port=port)
+    async with server:
+        await server.serve_forever()
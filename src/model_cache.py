@@ -0,0 +1,114 @@
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import whisper
+from faster_whisper import WhisperModel
+
+from src.config import MODEL_CACHE_MAX_MB, FASTER_WHISPER_COMPUTE_TYPE, WARMUP_MODELS, TRANSCRIBE_WORKERS_PER_MODEL
+from src.metrics import model_load_seconds, models_cached, model_cache_bytes
+
+logger = logging.getLogger(__name__)
+
+# CTranslate2 does not expose its memory usage, so faster-whisper models are budgeted from their int8 size
+FASTER_WHISPER_SIZES_MB = {"tiny": 45, "tiny.en": 45, "base": 80, "base.en": 80, "small": 250, "small.en": 250}
+COMPUTE_TYPE_SCALE = {"int8": 1, "int8_float32": 1, "int8_float16": 1, "float16": 2, "float32": 4}
+# CTranslate2 threads per model, 0 lets it pick; lowered inside worker processes that share the CPU
+CPU_THREADS = 0
+
+
+@dataclass
+class CachedModel:
+    model: object
+    size: int
+    # whisper installs kv-cache hooks on the shared module while decoding, so one transcription at a time
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+def _load_model(engine, name, compute_type):
+    if engine == 'whisper':
+        return whisper.load_model(name)
+    elif engine == 'faster-whisper':
+        # one CTranslate2 worker per scheduler thread so concurrent jobs on the same model run in parallel
+        return WhisperModel(name, device="cpu", compute_type=compute_type, cpu_threads=CPU_THREADS,
+                            num_workers=TRANSCRIBE_WORKERS_PER_MODEL)
+    raise ValueError(f"Unknown transcription engine: {engine}")
+
+
+def _model_size(engine, name, compute_type, model):
+    if engine == 'whisper':
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    size_mb = FASTER_WHISPER_SIZES_MB.get(name, 250) * COMPUTE_TYPE_SCALE.get(compute_type, 4)
+    return size_mb * 1024 * 1024
+
+
+class ModelCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}  # key -> lock held while that model loads, so concurrent jobs load it only once
+
+    def get(self, engine, name, compute_type=None) -> CachedModel:
+        if engine == 'faster-whisper' and compute_type is None:
+            compute_type = FASTER_WHISPER_COMPUTE_TYPE
+        key = (engine, name, compute_type)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            load_lock = self._loading.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    return self._entries[key]
+            logger.info("Loading %s model %s (%s)", engine, name, compute_type or 'default')
+            with model_load_seconds.time(engine=engine, model=name):
+                model = _load_model(engine, name, compute_type)
+            entry = CachedModel(model, _model_size(engine, name, compute_type, model))
+            with self._lock:
+                self._entries[key] = entry
+                self._loading.pop(key, None)
+                self._evict()
+            return entry
+
+    def _evict(self):
+        # least recently used first; the newest entry always stays even if it alone exceeds the budget
+        while len(self._entries) > 1 and self.total_size() > self.max_bytes:
+            key, _ = self._entries.popitem(last=False)
+            logger.info("Evicting %s model %s from model cache", key[0], key[1])
+
+    def total_size(self):
+        return sum(entry.size for entry in self._entries.values())
+
+    def cached_size(self):
+        with self._lock:
+            return self.total_size()
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+model_cache = ModelCache(MODEL_CACHE_MAX_MB * 1024 * 1024)
+models_cached.set_function(lambda: len(model_cache.keys()))
+model_cache_bytes.set_function(model_cache.cached_size)
+
+
+def warm_up_models(specs=None):
+    for spec in WARMUP_MODELS if specs is None else specs:
+        parts = spec.split(':')
+        engine, name = parts[0], parts[1] if len(parts) > 1 else 'base'
+        compute_type = parts[2] if len(parts) > 2 else None
+        try:
+            model_cache.get(engine, name, compute_type)
+        except Exception as e:
+            logger.warning("Failed to warm up model %s: %s", spec, e)
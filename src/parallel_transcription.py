@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from faster_whisper.vad import get_speech_timestamps, VadOptions
+
+from src.audio import load_pcm, SAMPLE_RATE
+from src.config import TRANSCRIBE_PARALLEL_WORKERS, TRANSCRIBE_CHUNK_SECONDS, TRANSCRIPT_WORD_TIMESTAMPS
+from src.transcripts import word_dict
+
+logger = logging.getLogger(__name__)
+
+_transcription_pool = None
+
+
+def _init_worker(threads):
+    # every worker runs its own model copy, split the cores between them instead of oversubscribing
+    import torch
+    from src import model_cache
+    torch.set_num_threads(threads)
+    model_cache.CPU_THREADS = threads
+
+
+def transcription_pool():
+    global _transcription_pool
+    if _transcription_pool is None:
+        threads = max(1, (os.cpu_count() or 1) // TRANSCRIBE_PARALLEL_WORKERS)
+        _transcription_pool = ProcessPoolExecutor(max_workers=TRANSCRIBE_PARALLEL_WORKERS,
+                                                  mp_context=multiprocessing.get_context('spawn'),
+                                                  initializer=_init_worker, initargs=(threads,))
+    return _transcription_pool
+
+
+def shutdown_transcription_pool():
+    global _transcription_pool
+    if _transcription_pool is not None:
+        _transcription_pool.shutdown(wait=False, cancel_futures=True)
+        _transcription_pool = None
+
+
+def split_on_silence(audio, max_chunk_seconds=TRANSCRIBE_CHUNK_SECONDS):
+    # returns contiguous (start, end) sample ranges covering the audio, cut halfway through pauses
+    max_chunk = max_chunk_seconds * SAMPLE_RATE
+    if len(audio) <= max_chunk:
+        return [(0, len(audio))]
+    speech = get_speech_timestamps(audio, VadOptions(max_speech_duration_s=max_chunk_seconds))
+    cuts = [0]
+    for previous, current in zip(speech, speech[1:]):
+        if current["end"] - cuts[-1] > max_chunk:
+            cuts.append((previous["end"] + current["start"]) // 2)
+    cuts.append(len(audio))
+    return list(zip(cuts, cuts[1:]))
+
+
+def transcribe_chunk(engine, model, language, path, start, end):
+    # runs inside a pool worker, which keeps its own process-local model cache; the samples are sliced from the
+    # memory-mapped PCM sidecar here, so only the file path crosses the process boundary
+    from src.model_cache import model_cache
+    cached = model_cache.get(engine, model)
+    audio = np.array(load_pcm(path)[start:end])
+    offset = start / SAMPLE_RATE
+    if engine == 'whisper':
+        result = cached.model.transcribe(audio, verbose=None, language=language,
+                                         word_timestamps=TRANSCRIPT_WORD_TIMESTAMPS)
+        segments = result["segments"]
+    else:
+        generator, info = cached.model.transcribe(audio, beam_size=2, language=language,
+                                                  word_timestamps=TRANSCRIPT_WORD_TIMESTAMPS)
+        segments = [{"start": s.start, "end": s.end, "text": s.text, "words": [word_dict(w) for w in s.words or []]}
+                    for s in generator]
+    for segment in segments:
+        segment["start"] += offset
+        segment["end"] += offset
+        for word in segment.get("words") or []:
+            word["start"] += offset
+            word["end"] += offset
+    return segments
+
+
+async def transcribe_in_chunks(websocket, engine, filepath, model, language=None):
+    # transcribes VAD-delimited chunks of the file in parallel and stitches them back into one whisper-style result
+    loop = asyncio.get_running_loop()
+    audio = await asyncio.to_thread(load_pcm, filepath)
+    chunks = await asyncio.to_thread(split_on_silence, audio)
+    logger.info("Transcribing in %d chunks", len(chunks))
+    await websocket.send_json({"status": "progress", "message": f"Transcribing {len(chunks)} chunks in parallel",
+                               "progress": 0.0, "chunks_total": len(chunks), "chunks_done": 0})
+
+    pool = transcription_pool()
+    futures = [loop.run_in_executor(pool, transcribe_chunk, engine, model, language, filepath, start, end)
+               for start, end in chunks]
+    try:
+        done = 0
+        for future in asyncio.as_completed(futures):
+            await future
+            done += 1
+            await websocket.send_json({"status": "progress", "progress": done / len(chunks) * 100,
+                                       "chunks_total": len(chunks), "chunks_done": done})
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+    segments = []
+    for future in futures:
+        segments.extend(future.result())
+    for i, segment in enumerate(segments):
+        segment["id"] = i
+    return {"text": "".join(segment["text"] for segment in segments), "segments": segments, "language": language}
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from src.config import RETENTION_HOURS, RETENTION_QUOTA_MB, RETENTION_INTERVAL
+from src.storage import read_meta, valid_file_id
+
+logger = logging.getLogger(__name__)
+
+
+def dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+def _linked_entries(media_dir, dir_path):
+    # store blobs and cache entries the files in a job folder are hard linked to
+    linked = set()
+    for root, _, files in os.walk(dir_path):
+        for name in files:
+            meta = read_meta(os.path.join(root, name))
+            if "sha256" in meta:
+                linked.add(os.path.join(media_dir, '.store', meta["sha256"]))
+            if "cache_key" in meta:
+                linked.add(os.path.join(media_dir, '.cache', meta["cache_key"]))
+    return linked
+
+
+def _remove_unlinked(paths):
+    # an entry with a single link is not used by any job folder any more
+    for path in paths:
+        try:
+            if os.stat(path).st_nlink == 1:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def remove_media_dir(media_dir, fileID, ignore_errors=False):
+    # deletes a job folder along with the store blobs and cache entries only it was using
+    dir_path = os.path.join(media_dir, fileID)
+    linked = _linked_entries(media_dir, dir_path)
+    shutil.rmtree(dir_path, ignore_errors=ignore_errors)
+    _remove_unlinked(linked)
+
+
+def collect_garbage(media_dir):
+    # catches entries whose folder went away without remove_media_dir (a crash, a manual rm); stats every
+    # artifact, so it runs from the daily cron job and not with every sweep
+    for name in ('.store', '.cache'):
+        dir_path = os.path.join(media_dir, name)
+        if os.path.isdir(dir_path):
+            _remove_unlinked(entry.path for entry in os.scandir(dir_path)
+                             if entry.is_file() and not entry.name.startswith('.'))
+
+
+class RetentionIndex:
+    # fileID -> size, last access and expiry in a SQLite file next to the media, kept current by the API handlers;
+    # an eviction pass only reads the rows it is going to delete instead of stat-ing the whole tree
+    def __init__(self, media_dir, age_seconds, quota_bytes=0):
+        self.media_dir = str(media_dir)
+        self.db_path = os.path.join(self.media_dir, '.retention.db')
+        self.age_seconds = age_seconds
+        self.quota_bytes = quota_bytes
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self):
+        # one connection per thread, kept open; the schema is set up by the first connection only (on first use
+        # rather than here, the singleton is created at import time, possibly before ./media exists)
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        with self._schema_lock:
+            if not self._schema_ready:
+                created = conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS items (fileID TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                             "last_access REAL NOT NULL, expires REAL NOT NULL)")
+                conn.execute("CREATE INDEX IF NOT EXISTS items_expires ON items (expires)")
+                conn.execute("CREATE INDEX IF NOT EXISTS items_last_access ON items (last_access)")
+                if created:
+                    self._index_existing(conn)
+                self._schema_ready = True
+        self._local.conn = conn
+        return conn
+
+    def _index_existing(self, conn):
+        # one full scan when the index is first created, so folders from before it existed still expire
+        with conn:
+            for entry in os.scandir(self.media_dir):
+                if entry.is_dir() and not entry.name.startswith('.'):
+                    last_access = max((os.lstat(os.path.join(root, name)).st_mtime
+                                       for root, _, files in os.walk(entry.path) for name in files),
+                                      default=entry.stat().st_mtime)
+                    conn.execute("INSERT OR IGNORE INTO items VALUES (?, ?, ?, ?)",
+                                 (entry.name, dir_size(entry.path), last_access, last_access + self.age_seconds))
+
+    def record(self, fileID):
+        # (re)measures a job folder after something was written to it and marks it as just used;
+        # anything but a plain job folder name is never indexed (and so never evicted)
+        dir_path = os.path.join(self.media_dir, fileID)
+        if not valid_file_id(fileID) or not os.path.isdir(dir_path):
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?)",
+                         (fileID, dir_size(dir_path), now, now + self.age_seconds))
+
+    def touch(self, fileID):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("UPDATE items SET last_access = ?, expires = ? WHERE fileID = ?",
+                         (now, now + self.age_seconds, fileID))
+
+    def forget(self, fileID):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM items WHERE fileID = ?", (fileID,))
+
+    def total_size(self):
+        return self._connect().execute("SELECT COALESCE(SUM(size), 0) FROM items").fetchone()[0]
+
+    def sweep(self, now=None):
+        # evicts everything past its expiry, then least recently used folders while over the quota
+        now = time.time() if now is None else now
+        evicted = []
+        conn = self._connect()
+        for fileID, in conn.execute("SELECT fileID FROM items WHERE expires < ? ORDER BY expires",
+                                    (now,)).fetchall():
+            self._evict(conn, fileID)
+            evicted.append(fileID)
+        if self.quota_bytes:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM items").fetchone()[0]
+            rows = conn.execute("SELECT fileID, size FROM items ORDER BY last_access")
+            for fileID, size in rows.fetchall():
+                if total <= self.quota_bytes:
+                    break
+                self._evict(conn, fileID)
+                evicted.append(fileID)
+                total -= size
+        return evicted
+
+    def _evict(self, conn, fileID):
+        remove_media_dir(self.media_dir, fileID, ignore_errors=True)
+        with conn:
+            conn.execute("DELETE FROM items WHERE fileID = ?", (fileID,))
+        logger.info("Evicted media folder", extra={"fileID": fileID})
+
+
+async def retention_loop(index, interval=RETENTION_INTERVAL):
+    while True:
+        try:
+            await asyncio.to_thread(index.sweep)
+        except Exception as e:
+            logger.exception("Error evicting media: %s", e)
+        await asyncio.sleep(interval)
+
+
+retention = RetentionIndex('./media', RETENTION_HOURS * 3600, RETENTION_QUOTA_MB * 1024 * 1024)
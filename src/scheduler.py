@@ -0,0 +1,100 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from src.config import TRANSCRIBE_WORKERS_PER_MODEL, TRANSCRIBE_QUEUE_SIZE
+from src.metrics import queue_wait_seconds, transcriptions_queued
+
+
+class SchedulerBusy(Exception):
+    pass
+
+
+class _ModelPool:
+    def __init__(self, key, workers):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{key[0]}-{key[1]}")
+        self.workers = workers
+        self.running = 0
+        self.waiting: deque = deque()  # one future per queued job, resolved when it gets a worker
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        # wake every queued job so it can report its new position
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class JobScheduler:
+    def __init__(self, workers_per_model, max_queue):
+        self.workers_per_model = workers_per_model
+        self.max_queue = max_queue
+        self._pools = {}
+
+    def _pool(self, key):
+        if key not in self._pools:
+            self._pools[key] = _ModelPool(key, self.workers_per_model)
+        return self._pools[key]
+
+    def queued(self):
+        return sum(len(pool.waiting) for pool in self._pools.values())
+
+    def running(self):
+        return sum(pool.running for pool in self._pools.values())
+
+    @asynccontextmanager
+    async def acquire(self, key, on_queued=None):
+        # yields the executor of the pool serving `key` once one of its workers is free;
+        # on_queued(position) is awaited every time the job's place in the queue changes
+        pool = self._pool(key)
+        waited = time.perf_counter()
+        if pool.running < pool.workers and not pool.waiting:
+            pool.running += 1
+        else:
+            if self.queued() >= self.max_queue:
+                raise SchedulerBusy("Server busy: transcription queue is full, try again later")
+            turn = asyncio.get_running_loop().create_future()
+            pool.waiting.append(turn)
+            try:
+                await self._wait_turn(pool, turn, on_queued)
+            except BaseException:
+                if turn in pool.waiting:
+                    pool.waiting.remove(turn)
+                    pool.notify()
+                elif turn.done():
+                    # a worker was handed over just before we were cancelled
+                    self._release(pool)
+                raise
+        queue_wait_seconds.observe(time.perf_counter() - waited, queue="transcription")
+        try:
+            yield pool.executor
+        finally:
+            self._release(pool)
+
+    async def _wait_turn(self, pool, turn, on_queued):
+        last_position = None
+        while not turn.done():
+            changed = pool.changed
+            position = pool.waiting.index(turn) + 1
+            if on_queued is not None and position != last_position:
+                last_position = position
+                await on_queued(position)
+            if not turn.done():
+                await changed.wait()
+
+    def _release(self, pool):
+        pool.running -= 1
+        if pool.waiting:
+            pool.running += 1
+            pool.waiting.popleft().set_result(None)
+        pool.notify()
+
+    def shutdown(self):
+        for pool in self._pools.values():
+            pool.executor.shutdown(wait=False, cancel_futures=True)
+        self._pools.clear()
+
+
+transcription_scheduler = JobScheduler(TRANSCRIBE_WORKERS_PER_MODEL, TRANSCRIBE_QUEUE_SIZE)
+transcriptions_queued.set_function(transcription_scheduler.queued)
@@ -1,35 +1,25 @@
 import os
-import time
 from pathlib import Path
 import cronitor
 from dotenv import load_dotenv
 
+from src.config import RETENTION_HOURS, RETENTION_QUOTA_MB
+from src.logs import setup_logging
+from src.retention import RetentionIndex, collect_garbage
+
 MEDIA_DIR = Path(__file__).parent.parent.parent / 'media'
-AGE_LIMIT_SECONDS = 12 * 60 * 60  # 12 hours
+AGE_LIMIT_SECONDS = RETENTION_HOURS * 60 * 60  # 12 hours by default
 
 load_dotenv()
 cronitor.api_key = os.getenv('CRONITOR_API_KEY')  # Set your Cronitor API key in environment variables
 
 @cronitor.job('jPqGYP')
 def cleanup_media_folder():
-    now = time.time()
-    for folder in MEDIA_DIR.iterdir():
-        if folder.is_dir():
-            for file in folder.iterdir():
-                if file.is_file():
-                    mtime = file.stat().st_mtime
-                    if now - mtime > AGE_LIMIT_SECONDS:
-                        try:
-                            file.unlink()
-                        except Exception as e:
-                            print(f"Failed to delete {file}: {e}")
-            # Remove folder if empty
-            if not any(folder.iterdir()):
-                try:
-                    folder.rmdir()
-                except Exception as e:
-                    print(f"Failed to remove folder {folder}: {e}")
+    # one pass over the retention index the API keeps up to date; only expired (or over-quota) folders are touched,
+    # then the one full scan of the store and cache for entries no folder links to any more
+    RetentionIndex(MEDIA_DIR, AGE_LIMIT_SECONDS, RETENTION_QUOTA_MB * 1024 * 1024).sweep()
+    collect_garbage(MEDIA_DIR)
 
 if __name__ == "__main__":
+    setup_logging()
     cleanup_media_folder()
-
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import shutil
+import uuid
+
+import ffmpeg
+
+from src.config import VIDEO_SEGMENT_SECONDS, FFMPEG_PROGRESS_RATE
+from src.encoding import PROFILES, codec_args, codec_options, ffmpeg_threads
+from src.supervisor import ffmpeg_supervisor, read_ffmpeg_progress
+
+
+def keyframe_times(path):
+    # packet flags mark the keyframes, so nothing has to be decoded to find them
+    probe = ffmpeg.probe(path, select_streams='v:0', show_entries='packet=pts_time,flags')
+    start_time = float(probe['format'].get('start_time', 0))
+    # -ss counts from the start of the file, not from timestamp zero
+    return sorted(float(packet['pts_time']) - start_time for packet in probe.get('packets', [])
+                  if 'K' in packet.get('flags', '') and packet.get('pts_time', 'N/A') != 'N/A')
+
+
+def split_at_keyframes(keyframes, duration, segment_seconds):
+    # (start, end) ranges of roughly segment_seconds that start on keyframes, so every segment decodes on its own;
+    # the last one runs to the end of the file (end None) and is never shorter than half a segment
+    cuts = [0.0]
+    for time in keyframes:
+        if time - cuts[-1] >= segment_seconds and duration - time >= segment_seconds / 2:
+            cuts.append(time)
+    return list(zip(cuts, cuts[1:] + [None]))
+
+
+def plan_segments(path, probe):
+    duration = float(probe['format']['duration'])
+    if duration < 2 * VIDEO_SEGMENT_SECONDS:
+        return [(0.0, None)]
+    return split_at_keyframes(keyframe_times(path), duration, VIDEO_SEGMENT_SECONDS)
+
+
+class _SegmentSocket:
+    # stands in for the websocket read_ffmpeg_progress reports one segment's progress to
+    def __init__(self, progress, index):
+        self.progress = progress
+        self.index = index
+
+    async def send_json(self, data):
+        await self.progress.update(self.index, data)
+
+
+class SegmentProgress:
+    # combines the progress of the segment encodes into one stream of messages for the client
+    def __init__(self, websocket, segments, duration):
+        self.websocket = websocket
+        self.lengths = [(end if end is not None else duration) - start for start, end in segments]
+        self.percents = [0.0] * len(segments)
+        self.finished = 0
+        self.last_sent = None
+
+    def segment(self, index):
+        return _SegmentSocket(self, index)
+
+    async def update(self, index, data):
+        self.percents[index] = float(data.get('progress_percent', self.percents[index]))
+        if data.get('progress') == 'end':
+            self.percents[index] = 100.0
+            self.finished += 1
+        loop = asyncio.get_running_loop()
+        interval = 1 / FFMPEG_PROGRESS_RATE if FFMPEG_PROGRESS_RATE > 0 else 0
+        if data.get('progress') != 'end' and self.last_sent is not None and loop.time() - self.last_sent < interval:
+            return
+        self.last_sent = loop.time()
+        done = sum(length * percent / 100 for length, percent in zip(self.lengths, self.percents))
+        await self.websocket.send_json(
+            {"status": "progress", "stage": "segments", "progress_percent": min(100, done / sum(self.lengths) * 100),
+             "segments_total": len(self.lengths), "segments_done": self.finished})
+
+
+async def transcode_in_segments(websocket, filepath, output_path, segments, duration, vcodec, acodec, profile):
+    # encodes the video of every segment in its own ffmpeg process (as many at once as the supervisor allows),
+    # then joins them with the concat demuxer and muxes the audio of the original back in without re-encoding video
+    work_dir = os.path.join(os.path.dirname(output_path), f".segments-{uuid.uuid4().hex}")
+    await asyncio.to_thread(os.mkdir, work_dir)
+    settings = PROFILES[profile]
+    threads = ffmpeg_threads.clamp(settings["threads"])
+    progress = SegmentProgress(websocket, segments, duration)
+
+    async def encode(index, start, end):
+        segment_path = os.path.join(work_dir, f"{index:05d}.mkv")
+        source = ffmpeg.input(filepath, ss=start, threads=threads)['v:0']
+        stream = (
+            source
+            .output(segment_path, vcodec=vcodec, threads=threads, **({'t': end - start} if end is not None else {}),
+                    **codec_options(profile, vcodec))
+            .global_args('-filter_threads', str(settings["filter_threads"]),
+                         '-progress', 'pipe:1', '-nostats', '-loglevel', 'error')
+        )
+        async with ffmpeg_supervisor.run(stream, [segment_path], threads) as process:
+            return await read_ffmpeg_progress(progress.segment(index), process, progress.lengths[index])
+
+    jobs = [asyncio.create_task(encode(index, start, end)) for index, (start, end) in enumerate(segments)]
+    try:
+        for job in asyncio.as_completed(jobs):
+            returncode = await job
+            if returncode != 0:
+                # one failed segment fails the whole file
+                return returncode
+
+        list_path = os.path.join(work_dir, "segments.txt")
+        with open(list_path, 'w') as f:
+            f.writelines(f"file '{index:05d}.mkv'\n" for index in range(len(segments)))
+        video = ffmpeg.input(list_path, f='concat', safe=0)['v']
+        audio = ffmpeg.input(filepath)['a?']
+        stream = (
+            ffmpeg
+            .output(video, *([audio] if acodec is not None else []), output_path, **codec_args('copy', acodec))
+            .global_args('-progress', 'pipe:1', '-nostats', '-loglevel', 'error')
+        )
+        async with ffmpeg_supervisor.run(stream, [output_path]) as process:
+            return await read_ffmpeg_progress(websocket, process, duration, {"stage": "concat"})
+    finally:
+        # stops the segment encodes still running after a failure or a cancelled job
+        for job in jobs:
+            job.cancel()
+        await asyncio.gather(*jobs, return_exceptions=True)
+        await asyncio.to_thread(shutil.rmtree, work_dir, True)
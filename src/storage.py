@@ -0,0 +1,317 @@
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from src.config import UPLOAD_CHUNK_SIZE, MAX_UPLOAD_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+def create_media_dir():
+    fileID = uuid.uuid4()
+    while os.path.exists(f'./media/{fileID}'):
+        fileID = uuid.uuid4()
+    os.mkdir(f'./media/{fileID}')
+    return str(fileID)
+
+
+def valid_file_id(fileID):
+    # fileIDs come from clients, only a plain job folder name may be used to build a path
+    return isinstance(fileID, str) and bool(fileID) and os.path.basename(fileID) == fileID and not fileID.startswith('.')
+
+
+def media_file_path(fileID, filename):
+    # path of a client-named file inside its job folder, None when either name would lead out of it
+    if not valid_file_id(fileID) or not isinstance(filename, str) or not filename:
+        return None
+    media_dir = os.path.normpath(f'./media/{fileID}')
+    filepath = os.path.normpath(os.path.join(media_dir, filename))
+    return filepath if filepath.startswith(media_dir + os.sep) else None
+
+
+class UploadWriter:
+    # writes an upload to a temp file in its job folder, hashing and enforcing the size limit on the way;
+    # commit() renames it into place, so the destination never holds a partial upload
+    def __init__(self, dir_path, max_size=MAX_UPLOAD_SIZE):
+        self.tmp_path = os.path.join(dir_path, f".upload.{uuid.uuid4().hex}.tmp")
+        self.max_size = max_size
+        self.size = 0
+        self.hasher = hashlib.sha256()
+        self.file = open(self.tmp_path, "wb")
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            raise UploadTooLarge(f"File exceeds the maximum upload size of {self.max_size // (1024 * 1024)} MB")
+        self.hasher.update(data)
+        self.file.write(data)
+
+    def commit(self, dest_path):
+        self.file.close()
+        os.replace(self.tmp_path, dest_path)
+        return self.size, self.hasher.hexdigest()
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def save_upload(source, dest_path, max_size=MAX_UPLOAD_SIZE):
+    # copies a file object to dest_path chunk by chunk, hashing in the same pass
+    writer = UploadWriter(os.path.dirname(dest_path), max_size)
+    try:
+        while chunk := source.read(UPLOAD_CHUNK_SIZE):
+            writer.write(chunk)
+        return writer.commit(dest_path)
+    except BaseException:
+        writer.discard()
+        raise
+
+
+class MultipartFileReader:
+    # incremental multipart/form-data parser for request bodies: the bytes of the first file in `field` collect
+    # in .data as they arrive, so the caller can write them out (and stop at the size limit) while the body streams
+    def __init__(self, content_type, field="file"):
+        mimetype, options = parse_options_header(content_type)
+        if mimetype != b"multipart/form-data" or not options.get(b"boundary"):
+            raise ValueError("Expected a multipart/form-data body")
+        self.field = field.encode()
+        self.filename = None
+        self.data = bytearray()
+        self._headers = {}
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._in_file = False
+        self._parser = MultipartParser(options[b"boundary"], callbacks={
+            "on_part_begin": self._part_begin,
+            "on_header_field": lambda data, start, end: self._header_field.extend(data[start:end]),
+            "on_header_value": lambda data, start, end: self._header_value.extend(data[start:end]),
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        })
+
+    def feed(self, chunk):
+        self._parser.write(chunk)
+
+    def finish(self):
+        self._parser.finalize()
+
+    def _part_begin(self):
+        self._headers = {}
+
+    def _header_end(self):
+        self._headers[bytes(self._header_field).lower()] = bytes(self._header_value)
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def _headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if self.filename is None and options.get(b"name") == self.field and b"filename" in options:
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+            self._in_file = True
+
+    def _part_data(self, data, start, end):
+        if self._in_file:
+            self.data += data[start:end]
+
+    def _part_end(self):
+        self._in_file = False
+
+
+class ResumableUpload:
+    # session state lives next to the data so any API process sharing ./media can accept chunks:
+    # .upload.json holds the metadata, .upload.part the preallocated file and .upload.chunks one byte per chunk
+    def __init__(self, fileID, filename, size, chunk_size):
+        self.fileID = fileID
+        self.filename = filename
+        self.size = size
+        self.chunk_size = chunk_size
+
+    @property
+    def dir_path(self):
+        return f'./media/{self.fileID}'
+
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    @classmethod
+    def create(cls, fileID, filename, size, chunk_size):
+        upload = cls(fileID, filename, size, chunk_size)
+        with open(f'{upload.dir_path}/.upload.part', 'wb') as f:
+            f.truncate(size)
+        with open(f'{upload.dir_path}/.upload.chunks', 'wb') as f:
+            f.write(bytes(upload.total_chunks))
+        with open(f'{upload.dir_path}/.upload.json', 'w') as f:
+            json.dump({"filename": filename, "size": size, "chunk_size": chunk_size}, f)
+        return upload
+
+    @classmethod
+    def load(cls, fileID):
+        try:
+            with open(f'./media/{fileID}/.upload.json') as f:
+                session = json.load(f)
+        except FileNotFoundError:
+            return None
+        return cls(fileID, session["filename"], session["size"], session["chunk_size"])
+
+    def chunk_range(self, index):
+        offset = index * self.chunk_size
+        return offset, min(self.chunk_size, self.size - offset)
+
+    def write(self, offset, data):
+        fd = os.open(f'{self.dir_path}/.upload.part', os.O_WRONLY)
+        try:
+            os.pwrite(fd, data, offset)
+        finally:
+            os.close(fd)
+
+    def mark_received(self, index):
+        fd = os.open(f'{self.dir_path}/.upload.chunks', os.O_WRONLY)
+        try:
+            os.pwrite(fd, b'\x01', index)
+        finally:
+            os.close(fd)
+
+    def received(self):
+        with open(f'{self.dir_path}/.upload.chunks', 'rb') as f:
+            bitmap = f.read()
+        return [i for i, flag in enumerate(bitmap) if flag]
+
+    def missing(self):
+        received = set(self.received())
+        return [i for i in range(self.total_chunks) if i not in received]
+
+    def finalize(self, expected_sha256=None):
+        part_path = f'{self.dir_path}/.upload.part'
+        hasher = hashlib.sha256()
+        with open(part_path, 'rb') as f:
+            while chunk := f.read(UPLOAD_CHUNK_SIZE):
+                hasher.update(chunk)
+        if expected_sha256 and hasher.hexdigest() != expected_sha256.lower():
+            raise ChecksumMismatch(f"Checksum mismatch: expected {expected_sha256}, got {hasher.hexdigest()}")
+        os.replace(part_path, f'{self.dir_path}/{self.filename}')
+        os.remove(f'{self.dir_path}/.upload.chunks')
+        os.remove(f'{self.dir_path}/.upload.json')
+        return self.size, hasher.hexdigest()
+
+
+# Content-addressed storage: every upload is hard linked to .store/<sha256>, so identical uploads share one
+# inode, and derived artifacts (conversions, transcripts) are hard linked to .cache/<key>. Nothing may be
+# rewritten in place once linked, which is why writers go through prepare_output() first.
+STORE_DIR = './media/.store'
+CACHE_DIR = './media/.cache'
+
+
+def meta_path(path):
+    dir_path, name = os.path.split(path)
+    return os.path.join(dir_path, f".{name}.meta.json")
+
+
+def read_meta(path):
+    try:
+        with open(meta_path(path)) as f:
+            meta = json.load(f)
+        stat = os.stat(path)
+    except (FileNotFoundError, ValueError):
+        return {}
+    # the sidecar only describes the inode it was written for
+    if meta.get("inode") != stat.st_ino or meta.get("size") != stat.st_size:
+        return {}
+    return meta
+
+
+def write_meta(path, **fields):
+    meta = read_meta(path)
+    stat = os.stat(path)
+    meta.update(fields, inode=stat.st_ino, size=stat.st_size)
+    tmp_path = f"{meta_path(path)}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path(path))
+    return meta
+
+
+def file_sha256(path):
+    meta = read_meta(path)
+    if "sha256" in meta:
+        return meta["sha256"]
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            hasher.update(chunk)
+    write_meta(path, sha256=hasher.hexdigest())
+    return hasher.hexdigest()
+
+
+def _link_replace(src, dest):
+    # atomically point dest at src's inode
+    tmp_path = os.path.join(os.path.dirname(dest), f".{uuid.uuid4().hex}.link")
+    os.link(src, tmp_path)
+    os.replace(tmp_path, dest)
+
+
+def store_content(path, sha256):
+    # dedupes path against earlier uploads with the same content; filesystems without hard links just skip it
+    blob = f"{STORE_DIR}/{sha256}"
+    try:
+        os.makedirs(STORE_DIR, exist_ok=True)
+        if os.path.exists(blob):
+            _link_replace(blob, path)
+            os.utime(blob)  # shared inode: keep the new upload from looking old to the cleanup job
+        else:
+            os.link(path, blob)
+    except OSError as e:
+        logger.warning("Could not deduplicate %s: %s", path, e)
+    write_meta(path, sha256=sha256)
+
+
+def derived_key(*parts):
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+def cache_fetch(key, dest_path):
+    cached = f"{CACHE_DIR}/{key}"
+    if not os.path.exists(cached):
+        return False
+    try:
+        _link_replace(cached, dest_path)
+        os.utime(cached)
+    except OSError as e:
+        logger.warning("Could not reuse cached artifact %s: %s", key, e)
+        return False
+    write_meta(dest_path, cache_key=key)  # lets retention drop the cache entry with its last job folder
+    return True
+
+
+def cache_put(key, path):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        _link_replace(path, f"{CACHE_DIR}/{key}")
+    except OSError as e:
+        logger.warning("Could not cache artifact %s: %s", path, e)
+        return
+    write_meta(path, cache_key=key)
+
+
+def prepare_output(path):
+    # unlink instead of truncating, the old file may share its inode with the store or cache
+    dir_path, name = os.path.split(path)
+    for stale in (path, meta_path(path), os.path.join(dir_path, f".{name}.pcm.npy")):
+        if os.path.exists(stale):
+            os.remove(stale)
@@ -0,0 +1,55 @@
+import os
+
+import ffmpeg
+
+from src.config import STREAM_SEGMENT_SECONDS, STREAM_LADDER, STREAM_AUDIO_BITRATE
+from src.encoding import PROFILES
+
+
+def select_rungs(source_height, ladder=STREAM_LADDER):
+    # never upscale: rungs taller than the source are dropped, a source below the whole ladder gets
+    # a single rung at its own height with the lowest bitrate
+    rungs = [(height, kbps) for height, kbps in ladder if height <= source_height]
+    if not rungs:
+        rungs = [(source_height - source_height % 2, ladder[-1][1])]
+    return rungs
+
+
+def rendition_names(rungs, has_audio):
+    return [f"{height}p" for height, _ in rungs] + (["audio"] if has_audio else [])
+
+
+def hls_stream(filepath, out_dir, rungs, has_audio, profile, threads):
+    # one decode split into every rung; keyframes are forced on segment boundaries so all renditions
+    # switch at the same points, and the audio is encoded once and shared by all of them (agroup)
+    source = ffmpeg.input(filepath)
+    video = source['v:0'].split()
+    streams = []
+    options = {}
+    variants = []
+    for index, (height, kbps) in enumerate(rungs):
+        streams.append(video[index].filter('scale', -2, height))
+        options[f'b:v:{index}'] = f'{kbps}k'
+        options[f'maxrate:v:{index}'] = f'{kbps * 107 // 100}k'
+        options[f'bufsize:v:{index}'] = f'{kbps * 2}k'
+        variants.append(f"v:{index},name:{height}p" + (",agroup:audio" if has_audio else ""))
+    if has_audio:
+        streams.append(source['a:0'])
+        options['b:a'] = STREAM_AUDIO_BITRATE
+        variants.append("a:0,name:audio,agroup:audio")
+    return ffmpeg.output(
+        *streams, os.path.join(out_dir, '%v', 'index.m3u8'),
+        f='hls', vcodec='libx264', acodec='aac', pix_fmt='yuv420p', preset=PROFILES[profile]['x264']['preset'],
+        threads=threads, force_key_frames=f'expr:gte(t,n_forced*{STREAM_SEGMENT_SECONDS})', sc_threshold=0,
+        hls_time=STREAM_SEGMENT_SECONDS, hls_playlist_type='vod', master_pl_name='master.m3u8',
+        hls_segment_filename=os.path.join(out_dir, '%v', 'segment_%05d.ts'), var_stream_map=' '.join(variants),
+        **options,
+    )
+
+
+def dash_stream(out_dir, names):
+    # repackages the HLS renditions without re-encoding them
+    inputs = [ffmpeg.input(os.path.join(out_dir, name, 'index.m3u8')) for name in names]
+    adaptation_sets = "id=0,streams=v" + (" id=1,streams=a" if "audio" in names else "")
+    return ffmpeg.output(*inputs, os.path.join(out_dir, 'dash', 'manifest.mpd'), f='dash', c='copy',
+                         seg_duration=STREAM_SEGMENT_SECONDS, adaptation_sets=adaptation_sets)
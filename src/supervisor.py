@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import signal
+import time
+from contextlib import asynccontextmanager
+
+import ffmpeg
+
+from src.config import FFMPEG_MAX_PROCESSES, FFMPEG_JOB_TIMEOUT, FFMPEG_JOB_CPU_SECONDS, FFMPEG_PROGRESS_RATE
+from src.encoding import ThreadBudget, ffmpeg_threads
+from src.metrics import queue_wait_seconds, ffmpeg_processes
+from src.storage import prepare_output
+
+try:
+    from resource import prlimit, RLIMIT_CPU
+except ImportError:  # prlimit(2) is Linux only, the CPU limit is skipped elsewhere
+    prlimit = None
+
+logger = logging.getLogger(__name__)
+
+
+class FFmpegLimitExceeded(Exception):
+    pass
+
+
+class FFmpegSupervisor:
+    # every ffmpeg child is started here: at most max_processes run at once and the rest wait in FIFO order,
+    # a child is killed as soon as its job ends early and gets a wall-clock and a CPU time limit
+    def __init__(self, max_processes, timeout, cpu_seconds):
+        self.slots = ThreadBudget(max_processes)  # a FIFO counting limit, one unit per process
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds if prlimit is not None else 0
+        self.processes = set()
+
+    def running(self):
+        return len(self.processes)
+
+    async def _spawn(self, stream_spec):
+        args = ffmpeg.compile(stream_spec, overwrite_output=True)
+        process = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.PIPE)
+        if self.cpu_seconds:
+            # set from the parent after the spawn, a preexec_fn is not safe in a process running thread pools;
+            # soft == hard, so the kernel sends SIGKILL right away instead of a SIGXCPU ffmpeg would handle
+            try:
+                prlimit(process.pid, RLIMIT_CPU, (self.cpu_seconds, self.cpu_seconds))
+            except ProcessLookupError:
+                pass  # already exited
+        return process
+
+    @asynccontextmanager
+    async def run(self, stream_spec, outputs, threads=1, on_wait=None):
+        # yields the started ffmpeg process; leaving the block early (error, cancelled job, closed socket)
+        # kills it, and whenever ffmpeg does not finish cleanly its partial outputs are removed
+        waited = time.perf_counter()
+        async with self.slots.reserve(1, on_wait), ffmpeg_threads.reserve(threads, on_wait):
+            queue_wait_seconds.observe(time.perf_counter() - waited, queue="ffmpeg")
+            process = await self._spawn(stream_spec)
+            self.processes.add(process)
+            timed_out = False
+
+            def expire():
+                nonlocal timed_out
+                if process.returncode is None:
+                    timed_out = True
+                    process.kill()
+
+            watchdog = asyncio.get_running_loop().call_later(self.timeout, expire) if self.timeout else None
+            try:
+                yield process
+            except BaseException:
+                await self._stop(process, outputs)
+                raise
+            finally:
+                if watchdog is not None:
+                    watchdog.cancel()
+                self.processes.discard(process)
+
+            if process.returncode != 0:
+                await self._stop(process, outputs)
+            if timed_out:
+                raise FFmpegLimitExceeded(f"ffmpeg exceeded the {self.timeout}s time limit")
+            if self.cpu_seconds and process.returncode == -signal.SIGKILL:
+                raise FFmpegLimitExceeded(f"ffmpeg exceeded the {self.cpu_seconds}s CPU time limit")
+
+    async def _stop(self, process, outputs):
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        for output in outputs:
+            prepare_output(output)
+
+    def shutdown(self):
+        for process in list(self.processes):
+            if process.returncode is None:
+                process.kill()
+
+
+async def read_ffmpeg_progress(websocket, process, duration=None, extra=None):
+    # forwards ffmpeg's -progress pipe:1 blocks to the client at most FFMPEG_PROGRESS_RATE times a second,
+    # stderr is drained alongside so a chatty ffmpeg never blocks on a full pipe; returns the exit code
+    loop = asyncio.get_running_loop()
+    stderr = asyncio.create_task(process.stderr.read())
+    progress = {"status": "progress", **(extra or {})}
+    interval = 1 / FFMPEG_PROGRESS_RATE if FFMPEG_PROGRESS_RATE > 0 else 0
+    last_sent = None
+    try:
+        async for output in process.stdout:
+            try:
+                decoded = output.decode(errors='ignore').strip()
+                if '=' not in decoded:
+                    continue
+                key, value = decoded.split('=', 1)
+                progress[key] = value
+                # Calculate progress percentage using out_time (in format HH:MM:SS.microseconds)
+                if key == 'out_time' and duration and value != 'N/A':
+                    h, m, s = value.split(':')
+                    sec = float(h) * 3600 + float(m) * 60 + float(s)
+                    progress['progress_percent'] = min(100, (sec / duration) * 100)
+                # every block ends with a 'progress' key; the last one ('end') is always delivered
+                if key == 'progress' and (value == 'end' or last_sent is None or loop.time() - last_sent >= interval):
+                    last_sent = loop.time()
+                    logger.debug("ffmpeg progress %s", progress.get('progress_percent', progress.get('out_time')),
+                                 extra={"sample": "ffmpeg"})
+                    await websocket.send_json(progress)
+            except ValueError as e:
+                logger.debug("Error parsing ffmpeg output: %s", e)
+                continue
+        returncode = await process.wait()
+        stderr_output = await stderr
+    finally:
+        stderr.cancel()
+    # one record per run, ffmpeg only writes errors to stderr (-loglevel error)
+    errors = stderr_output.decode(errors='ignore').strip()
+    if returncode != 0 or errors:
+        logger.warning("ffmpeg exited with code %s", returncode, extra={"stderr": errors})
+    else:
+        logger.debug("ffmpeg exited with code 0")
+    return returncode
+
+
+ffmpeg_supervisor = FFmpegSupervisor(FFMPEG_MAX_PROCESSES, FFMPEG_JOB_TIMEOUT, FFMPEG_JOB_CPU_SECONDS)
+ffmpeg_processes.set_function(ffmpeg_supervisor.running)
@@ -0,0 +1,63 @@
+import json
+import os
+import uuid
+
+import pysubs2 as pysubs
+import whisper.utils
+
+WHISPER_FORMATS = ['txt', 'vtt', 'srt', 'tsv', 'json']
+# pysubs2 formats it can write without extra information such as a frame rate
+PYSUBS_FORMATS = ['srt', 'vtt', 'txt', 'json', 'ass', 'ssa', 'ttml']
+RENDER_FORMATS = sorted(set(WHISPER_FORMATS) | set(PYSUBS_FORMATS))
+
+
+def transcript_path(filepath):
+    # keyed on the whole file name like the meta sidecars, bunny.mp4 and bunny.mkv each keep their own transcript
+    dir_path, name = os.path.split(filepath)
+    return os.path.join(dir_path, f".{name}.transcript.json")
+
+
+def word_dict(word):
+    return {"start": word.start, "end": word.end, "word": word.word, "probability": word.probability}
+
+
+def build_transcript(engine, model, language, segments):
+    # engine independent document every subtitle format is rendered from
+    segments = [{"id": i, "start": s["start"], "end": s["end"], "text": s["text"],
+                 "words": [{"start": w["start"], "end": w["end"], "word": w["word"],
+                            "probability": w.get("probability")} for w in s.get("words") or []]}
+                for i, s in enumerate(segments)]
+    return {"engine": engine, "model": model, "language": language,
+            "text": "".join(s["text"] for s in segments), "segments": segments}
+
+
+def save_transcript(filepath, document):
+    path = transcript_path(filepath)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(document, f)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_transcript(filepath):
+    try:
+        with open(transcript_path(filepath)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def render_transcript(document, output_path):
+    output_format = output_path.rsplit('.', 1)[-1]
+    if output_format not in RENDER_FORMATS:
+        raise ValueError(f"Unsupported subtitle format: {output_format}. Supported formats are: "
+                         f"{', '.join(RENDER_FORMATS)}")
+    # word timings would switch the whisper writers to word level cues, keep segment level output
+    segments = [{k: v for k, v in s.items() if k != "words"} for s in document["segments"]]
+    # each engine keeps the writer it always used, whisper's tsv is available to both
+    if output_format not in PYSUBS_FORMATS or (document["engine"] == 'whisper' and output_format in WHISPER_FORMATS):
+        writer = whisper.utils.get_writer(output_format, os.path.dirname(output_path) or '.')
+        writer({"text": document["text"], "segments": segments, "language": document["language"]}, output_path)
+    else:
+        pysubs.load_from_whisper(segments).save(output_path)
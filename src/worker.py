@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+from contextlib import suppress
+
+from src.config import JOB_WORKER_CONCURRENCY, JOB_POLL_INTERVAL, RETENTION_HOURS, METRICS_PORT
+from src.handlers import JOB_HANDLERS
+from src.images import shutdown_image_pool
+from src.jobs import job_queue, CANCELLED
+from src.logs import setup_logging, log_context
+from src.metrics import queue_wait_seconds, serve_metrics
+from src.model_cache import warm_up_models
+from src.parallel_transcription import shutdown_transcription_pool
+from src.scheduler import transcription_scheduler
+from src.supervisor import ffmpeg_supervisor
+
+logger = logging.getLogger(__name__)
+
+
+class JobSocket:
+    # stands in for the client socket of a queued job: messages go to the job's event log, and the last
+    # success or error message becomes the job's result
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+        self.result = None
+
+    async def send_json(self, data):
+        if data.get("status") in ("success", "error"):
+            self.result = data
+        await asyncio.to_thread(self.queue.publish, self.job_id, data)
+
+
+async def run_job(queue, job):
+    # runs one claimed job, renewing its lease while it runs; a cancel request stops it (and its ffmpeg children),
+    # and a worker that is shut down hands the job back to the queue
+    queue_wait_seconds.observe(time.time() - job["created"], queue="jobs")
+    websocket = JobSocket(queue, job["id"])
+    task = asyncio.create_task(JOB_HANDLERS[job["kind"]](websocket, job["payload"]))
+    cancelled = False
+    try:
+        while not (await asyncio.wait({task}, timeout=queue.lease_seconds / 3))[0]:
+            if await asyncio.to_thread(queue.heartbeat, job["id"]):
+                cancelled = True
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+    except asyncio.CancelledError:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.to_thread(queue.requeue, job["id"])
+        raise
+
+    if cancelled:
+        await websocket.send_json(CANCELLED)
+        result = CANCELLED
+    elif task.exception() is not None:
+        logger.error("Job failed: %s", task.exception(), exc_info=task.exception())
+        result = {"status": "error", "message": str(task.exception())}
+        await websocket.send_json(result)
+    else:
+        result = websocket.result or {"status": "error", "message": "Job finished without a result"}
+    await asyncio.to_thread(queue.finish, job["id"], result["status"], result)
+
+
+async def work(queue, worker, concurrency=JOB_WORKER_CONCURRENCY):
+    # claims jobs while fewer than `concurrency` run; the handlers still go through the ffmpeg supervisor and the
+    # transcription scheduler, so those limits apply per worker process
+    running = set()
+    last_purge = 0
+    try:
+        while True:
+            while len(running) < concurrency and (job := await asyncio.to_thread(queue.claim, worker)):
+                with log_context(jobID=job["id"]):
+                    logger.info("Running %s job", job["kind"], extra={"worker": worker})
+                    running.add(asyncio.create_task(run_job(queue, job)))
+            if running:
+                done, running = await asyncio.wait(running, timeout=JOB_POLL_INTERVAL,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    if finished.exception() is not None:
+                        logger.error("Error finishing job: %s", finished.exception())
+            else:
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+            if time.time() - last_purge > 3600:
+                # results are kept as long as the media they point to
+                last_purge = time.time()
+                await asyncio.to_thread(queue.purge, last_purge - RETENTION_HOURS * 3600)
+    finally:
+        for job in running:
+            job.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+
+async def serve():
+    setup_logging()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    warm_up = asyncio.create_task(asyncio.to_thread(warm_up_models))
+    exporter = asyncio.create_task(serve_metrics(METRICS_PORT)) if METRICS_PORT else None
+    try:
+        await work(job_queue, f"{socket.gethostname()}-{os.getpid()}")
+    finally:
+        warm_up.cancel()
+        if exporter is not None:
+            exporter.cancel()
+        transcription_scheduler.shutdown()
+        ffmpeg_supervisor.shutdown()
+        shutdown_image_pool()
+        shutdown_transcription_pool()
+
+
+if __name__ == "__main__":
+    with suppress(KeyboardInterrupt, asyncio.CancelledError):
+        asyncio.run(serve())
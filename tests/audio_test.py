@@ -0,0 +1,39 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from src import audio as audio_module
+from src.audio import load_pcm, pcm_path, SAMPLE_RATE
+from src.storage import prepare_output
+
+
+@pytest.fixture
+def media_file(tmp_path):
+    path = tmp_path / "obama.mp3"
+    shutil.copy("tests/test_media/obama.mp3", path)
+    return str(path)
+
+
+def test_pcm_is_decoded_once(media_file, monkeypatch):
+    first = load_pcm(media_file)
+    assert first.dtype == np.float32
+    assert first.ndim == 1
+    assert len(first) > 60 * SAMPLE_RATE
+
+    def fail(*args, **kwargs):
+        raise AssertionError("audio decoded twice")
+
+    monkeypatch.setattr(audio_module.faster_whisper, 'decode_audio', fail)
+    second = load_pcm(media_file)
+    assert isinstance(second, np.memmap)
+    assert np.array_equal(first, second)
+
+
+def test_replaced_file_is_decoded_again(media_file, tmp_path):
+    load_pcm(media_file)
+    prepare_output(media_file)
+    assert not (tmp_path / ".obama.mp3.pcm.npy").exists()
+    shutil.copy("tests/test_media/obama.mp3", media_file)
+    assert len(load_pcm(media_file)) > 0
+    assert pcm_path(media_file).endswith(".obama.mp3.pcm.npy")
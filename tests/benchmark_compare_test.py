@@ -0,0 +1,24 @@
+from benchmarks.compare import compare
+
+
+def report(results):
+    return {"environment": {}, "results": results}
+
+
+def test_regressions_respect_direction():
+    baseline = report({
+        "convert.video.mp4-webm": {"unit": "s", "better": "lower", "median": 2.0},
+        "upload.video": {"unit": "MB/s", "better": "higher", "median": 100.0},
+        "transcribe.whisper.tiny.rtf": {"unit": "x realtime", "better": "lower", "median": 0.5},
+    })
+    current = report({
+        "convert.video.mp4-webm": {"unit": "s", "better": "lower", "median": 2.5},
+        "upload.video": {"unit": "MB/s", "better": "higher", "median": 120.0},
+        "transcribe.whisper.tiny.rtf": {"unit": "x realtime", "better": "lower", "median": 0.52},
+        "concurrency.convert.4_clients": {"unit": "jobs/s", "better": "higher", "median": 1.0},
+    })
+    rows = {name: (change, regressed) for name, _, _, change, regressed in compare(baseline, current, 0.1)}
+    assert rows["convert.video.mp4-webm"] == (0.25, True)
+    assert rows["upload.video"][1] is False and rows["upload.video"][0] < 0
+    assert rows["transcribe.whisper.tiny.rtf"][1] is False
+    assert "concurrency.convert.4_clients" not in rows
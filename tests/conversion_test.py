@@ -1,6 +1,15 @@
+import asyncio
+import os
+import shutil
+import uuid
+
 import pytest
+from PIL import Image
 from fastapi.testclient import TestClient
+from src import storage
+from src.jobs import JobQueue
 from src.main import app
+from src.worker import run_job
 
 client = TestClient(app)
 
@@ -152,3 +161,330 @@ class TestAudioConversionClass:
             assert final_response["status"] == "success"
             assert final_response["output_format"] == output_type
             assert final_response["fileID"] == self.file_ID
+
+
+class TestBatchConversionClass:
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_files(self, request):
+        with open("tests/test_media/car.jpg", "rb") as file:
+            request.cls.image_ID = client.post("/uploadmedia", files={"file": file}).json()["fileID"]
+        with open("tests/test_media/bunny.mp4", "rb") as file:
+            request.cls.video_ID = client.post("/uploadmedia", files={"file": file}).json()["fileID"]
+        yield
+        print("Cleaning up uploaded files...")
+        client.post(f"/deletemedia?fileID={request.cls.image_ID}")
+        client.post(f"/deletemedia?fileID={request.cls.video_ID}")
+
+    def receive_final(self, websocket):
+        while True:
+            response = websocket.receive_json()
+            print(response)
+            if response["status"] != "progress":
+                return response
+
+    def test_batch_image_conversion(self):
+        data = {
+            "filename": "car.jpg",
+            "fileID": self.image_ID,
+            "outputs": [{"output_format": "png"}, {"output_format": "webp"}, {"output_format": "bmp"}]
+        }
+        with client.websocket_connect("/changeformat") as websocket:
+            websocket.send_json(data)
+            final_response = self.receive_final(websocket)
+        assert final_response["status"] == "success"
+        assert [o["output_format"] for o in final_response["outputs"]] == ["png", "webp", "bmp"]
+
+    def test_batch_video_conversion(self):
+        data = {
+            "filename": "bunny.mp4",
+            "fileID": self.video_ID,
+            "outputs": [
+                {"output_format": "mkv"},
+                {"output_format": "webm", "video_codec": "libvpx-vp9", "audio_codec": "libvorbis"},
+                {"output_format": "m4a", "audio_codec": "aac"},
+            ]
+        }
+        with client.websocket_connect("/changeformat") as websocket:
+            websocket.send_json(data)
+            final_response = self.receive_final(websocket)
+        assert final_response["status"] == "success"
+        assert sorted(o["filename"] for o in final_response["outputs"]) == ["bunny.m4a", "bunny.mkv", "bunny.webm"]
+
+    def test_duplicate_formats_are_rejected(self):
+        data = {"filename": "car.jpg", "fileID": self.image_ID,
+                "outputs": [{"output_format": "png"}, {"output_format": "png"}]}
+        with client.websocket_connect("/changeformat") as websocket:
+            websocket.send_json(data)
+            assert websocket.receive_json()["status"] == "error"
+
+
+class TestEncodingProfileClass:
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_files(self, request):
+        with open("tests/test_media/bunny.mp4", "rb") as file:
+            request.cls.video_ID = client.post("/uploadmedia", files={"file": file}).json()["fileID"]
+        yield
+        client.post(f"/deletemedia?fileID={request.cls.video_ID}")
+
+    def receive_final(self, websocket):
+        while True:
+            response = websocket.receive_json()
+            if response["status"] != "progress":
+                return response
+
+    @pytest.mark.parametrize("profile", ["fast", "balanced", "archive"])
+    def test_video_profile(self, profile):
+        data = {"filename": "bunny.mp4", "fileID": self.video_ID, "output_format": "mkv",
+                "video_codec": "libx264", "audio_codec": "copy", "profile": profile}
+        with client.websocket_connect("/changeformat") as websocket:
+            websocket.send_json(data)
+            final_response = self.receive_final(websocket)
+        assert final_response["status"] == "success"
+
+    def test_unknown_profile(self):
+        data = {"filename": "bunny.mp4", "fileID": self.video_ID, "output_format": "mkv",
+                "video_codec": "libx264", "profile": "ludicrous"}
+        with client.websocket_connect("/changeformat") as websocket:
+            websocket.send_json(data)
+            final_response = self.receive_final(websocket)
+        assert final_response["status"] == "error"
+        assert "ludicrous" in final_response["message"]
+
+    def test_batch_profiles(self):
+        data = {
+            "filename": "bunny.mp4",
+            "fileID": self.video_ID,
+            "profile": "fast",
+            "outputs": [
+                {"output_format": "mkv", "video_codec": "libx265", "audio_codec": "copy"},
+                {"output_format": "webm", "video_codec": "libvpx-vp9", "audio_codec": "libvorbis",
+                 "profile": "balanced"},
+            ]
+        }
+        with client.websocket_connect("/changeformat") as websocket:
+            websocket.send_json(data)
+            final_response = self.receive_final(websocket)
+        assert final_response["status"] == "success"
+
+
+class TestRemuxClass:
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_files(self, request):
+        with open("tests/test_media/bunny.mp4", "rb") as file:
+            request.cls.video_ID = client.post("/uploadmedia", files={"file": file}).json()["fileID"]
+        yield
+        client.post(f"/deletemedia?fileID={request.cls.video_ID}")
+
+    @pytest.fixture(autouse=True)
+    def empty_cache(self, monkeypatch):
+        # outputs cached by other tests must not decide which reply these tests see
+        cache_dir = f"./media/.cache-{uuid.uuid4().hex}"
+        monkeypatch.setattr(storage, 'CACHE_DIR', cache_dir)
+        yield
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def convert(self, data):
+        with client.websocket_connect("/changeformat") as websocket:
+            websocket.send_json({"fileID": self.video_ID, **data})
+            while (response := websocket.receive_json())["status"] == "progress":
+                pass
+        return response
+
+    def test_remux_round_trip(self):
+        response = self.convert({"filename": "bunny.mp4", "output_format": "mkv"})
+        assert response["status"] == "success"
+        assert response["video_codec"] == response["audio_codec"] == "copy"
+        response = self.convert({"filename": "bunny.mkv", "output_format": "mov"})
+        assert response["status"] == "success"
+        assert response["video_codec"] == "copy"
+
+    def test_cached_reply_names_codecs(self):
+        first = self.convert({"filename": "bunny.mp4", "output_format": "avi"})
+        second = self.convert({"filename": "bunny.mp4", "output_format": "avi"})
+        assert "cached" not in first and second["cached"]
+        assert (second["video_codec"], second["audio_codec"]) == (first["video_codec"], first["audio_codec"])
+
+    def test_only_incompatible_streams_are_encoded(self):
+        response = self.convert({"filename": "bunny.mp4", "output_format": "avi"})
+        assert response["status"] == "success"
+        assert response["video_codec"] == "copy"
+        assert response["audio_codec"] == "libmp3lame"
+
+    def test_copy_into_incompatible_container(self):
+        response = self.convert({"filename": "bunny.mp4", "output_format": "webm", "video_codec": "copy"})
+        assert response["status"] == "error"
+        assert "remux" in response["message"]
+
+
+class TestCancelClass:
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_files(self, request):
+        with open("tests/test_media/bunny.mp4", "rb") as file:
+            request.cls.video_ID = client.post("/uploadmedia", files={"file": file}).json()["fileID"]
+        yield
+        client.post(f"/deletemedia?fileID={request.cls.video_ID}")
+
+    def test_cancel_conversion(self):
+        data = {"filename": "bunny.mp4", "fileID": self.video_ID, "output_format": "mov",
+                "video_codec": "libx264", "audio_codec": "copy", "profile": "archive"}
+        with client.websocket_connect("/changeformat") as websocket:
+            websocket.send_json(data)
+            websocket.send_json({"action": "cancel"})
+            while (response := websocket.receive_json())["status"] == "progress":
+                pass
+        assert response["status"] == "cancelled"
+        assert not os.path.exists(f"./media/{self.video_ID}/bunny.mov")
+
+    def test_cancel_without_job(self):
+        with client.websocket_connect("/changeformat") as websocket:
+            websocket.send_json({"action": "cancel"})
+            response = websocket.receive_json()
+        assert response["status"] == "error"
+
+
+class TestThumbnailClass:
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_files(self, request):
+        with open("tests/test_media/car.jpg", "rb") as file:
+            request.cls.file_ID = client.post("/uploadmedia", files={"file": file}).json()["fileID"]
+        yield
+        print("Cleaning up uploaded files...")
+        client.post(f"/deletemedia?fileID={request.cls.file_ID}")
+
+    @pytest.mark.parametrize("output_type", ["jpg", "png", "webp"])
+    def test_thumbnail(self, output_type):
+        data = {"filename": "car.jpg", "fileID": self.file_ID, "output_format": output_type, "width": 64}
+        with client.websocket_connect("/changeformat") as websocket:
+            websocket.send_json(data)
+            response = websocket.receive_json()
+        print(response)
+        assert response["status"] == "success"
+        assert response["filename"] == f"car_64w.{output_type}"
+        with Image.open(f"./media/{self.file_ID}/car_64w.{output_type}") as image:
+            assert image.width == 64
+
+    def test_batch_thumbnails(self):
+        data = {"filename": "car.jpg", "fileID": self.file_ID,
+                "outputs": [{"output_format": "png", "width": 32, "height": 32},
+                            {"output_format": "png", "width": 128, "height": 128}]}
+        with client.websocket_connect("/changeformat") as websocket:
+            websocket.send_json(data)
+            response = websocket.receive_json()
+        assert response["status"] == "success"
+        for size in (32, 128):
+            with Image.open(f"./media/{self.file_ID}/car_{size}x{size}.png") as image:
+                assert max(image.size) == size
+
+
+class TestVideoPreviewClass:
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_files(self, request):
+        with open("tests/test_media/bunny.mp4", "rb") as file:
+            request.cls.file_ID = client.post("/uploadmedia", files={"file": file}).json()["fileID"]
+        yield
+        print("Cleaning up uploaded files...")
+        client.post(f"/deletemedia?fileID={request.cls.file_ID}")
+
+    def test_video_previews(self):
+        data = {"filename": "bunny.mp4", "fileID": self.file_ID, "mode": "thumbnails", "interval": 1, "width": 160,
+                "columns": 3}
+        with client.websocket_connect("/changeformat") as websocket:
+            websocket.send_json(data)
+            while True:
+                response = websocket.receive_json()
+                if response["status"] != "progress":
+                    break
+        print(response)
+        assert response["status"] == "success"
+        with Image.open(f"./media/{self.file_ID}/{response['sprite']}") as sprite:
+            assert sprite.size == (3 * 160, 2 * 90)
+        assert os.path.getsize(f"./media/{self.file_ID}/{response['poster']}") > 0
+        with open(f"./media/{self.file_ID}/{response['thumbnails']}") as f:
+            vtt = f.read()
+        assert vtt.startswith("WEBVTT")
+        assert "00:00:05.000 --> 00:00:05.312" in vtt
+        assert "bunny_sprite.jpg#xywh=160,90,160,90" in vtt
+
+
+class TestAdaptiveStreamClass:
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_files(self, request):
+        with open("tests/test_media/bunny.mp4", "rb") as file:
+            request.cls.file_ID = client.post("/uploadmedia", files={"file": file}).json()["fileID"]
+        yield
+        client.post(f"/deletemedia?fileID={request.cls.file_ID}")
+
+    def test_hls_and_dash_ladder(self):
+        data = {"filename": "bunny.mp4", "fileID": self.file_ID, "mode": "stream", "dash": True, "profile": "fast"}
+        with client.websocket_connect("/changeformat") as websocket:
+            websocket.send_json(data)
+            while (response := websocket.receive_json())["status"] == "progress":
+                pass
+        print(response)
+        assert response["status"] == "success"
+        assert response["renditions"][-1] == "audio"
+
+        master = client.get(f"/stream/{self.file_ID}/{response['hls']}")
+        assert master.status_code == 200
+        assert "#EXT-X-STREAM-INF" in master.text
+        variant = client.get(f"/stream/{self.file_ID}/bunny_stream/{response['renditions'][0]}/index.m3u8")
+        assert variant.status_code == 200
+        assert "#EXT-X-ENDLIST" in variant.text
+        manifest = client.get(f"/stream/{self.file_ID}/{response['dash']}")
+        assert manifest.status_code == 200
+        assert "<MPD" in manifest.text
+
+    def test_stream_route_stays_in_media_dir(self):
+        response = client.get(f"/stream/{self.file_ID}/..%2F..%2Fpyproject.toml")
+        assert response.status_code == 404
+
+
+class TestJobQueueClass:
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_files(self, request):
+        with open("tests/test_media/car.jpg", "rb") as file:
+            request.cls.file_ID = client.post("/uploadmedia", files={"file": file}).json()["fileID"]
+        yield
+        client.post(f"/deletemedia?fileID={request.cls.file_ID}")
+
+    @pytest.fixture(autouse=True)
+    def queue(self, tmp_path, monkeypatch):
+        # a queue of its own, jobs left over from other runs would be claimed first
+        queue = JobQueue(str(tmp_path / "jobs.db"))
+        monkeypatch.setattr('src.main.job_queue', queue)
+        return queue
+
+    def test_queued_conversion(self, queue):
+        response = client.post("/jobs", json={"type": "changeformat", "filename": "car.jpg", "fileID": self.file_ID,
+                                              "output_format": "png"})
+        assert response.status_code == 202
+        job_ID = response.json()["jobID"]
+        assert client.get(f"/jobs/{job_ID}").json()["status"] == "queued"
+
+        # what a worker process does with the job
+        asyncio.run(run_job(queue, queue.claim("test-worker")))
+
+        job = client.get(f"/jobs/{job_ID}").json()
+        assert job["status"] == "success"
+        assert job["result"]["output_format"] == "png"
+        # a client connecting after the fact still gets every message
+        with client.websocket_connect(f"/jobs/{job_ID}/events") as websocket:
+            while (message := websocket.receive_json())["status"] == "progress":
+                pass
+        assert message == {**job["result"], "jobID": job_ID, "seq": message["seq"]}
+        assert client.post(f"/jobs/{job_ID}/cancel").status_code == 409
+
+    def test_cancel_queued_job(self):
+        response = client.post("/jobs", json={"type": "transcribe", "filename": "car.jpg", "fileID": self.file_ID})
+        job_ID = response.json()["jobID"]
+        assert client.post(f"/jobs/{job_ID}/cancel").json()["status"] == "cancelled"
+        assert client.get(f"/jobs/{job_ID}").json()["result"]["status"] == "cancelled"
+
+    def test_invalid_jobs(self):
+        assert client.post("/jobs", json={"type": "resize", "filename": "car.jpg", "fileID": self.file_ID}
+                           ).status_code == 400
+        assert client.post("/jobs", json={"type": "changeformat", "filename": "nope.jpg", "fileID": self.file_ID}
+                           ).status_code == 404
+        assert client.post("/jobs", json={"type": "changeformat", "filename": "car.jpg",
+                                          "fileID": "../tests/test_media", "output_format": "png"}).status_code == 404
+        assert client.get("/jobs/missing").status_code == 404
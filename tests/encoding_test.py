@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from src.encoding import ThreadBudget, get_profile, codec_options, codec_args, resolve_codec, stream_codecs
+from src.streaming import select_rungs
+
+
+def test_profile_lookup():
+    name, settings = get_profile("fast")
+    assert name == "fast"
+    assert settings["threads"] > 0
+    with pytest.raises(ValueError):
+        get_profile("ludicrous")
+
+
+def test_codec_options_by_family():
+    assert codec_options("archive", "libx264") == {"preset": "slow", "crf": 18}
+    assert codec_options("fast", "libvpx-vp9")["deadline"] == "realtime"
+    assert codec_options("balanced", "copy") == {}
+    assert codec_options("balanced", "mpeg4") == {}
+
+
+def test_auto_copies_compatible_streams():
+    assert resolve_codec("video", "auto", "mp4", ["h264"]) == "copy"
+    assert resolve_codec("audio", "auto", "MP4", ["aac"]) == "copy"
+    assert resolve_codec("video", "auto", "mkv", ["theora"]) == "copy"
+
+
+def test_auto_encodes_only_incompatible_streams():
+    assert resolve_codec("video", "auto", "webm", ["h264"]) == "libvpx-vp9"
+    assert resolve_codec("audio", "auto", "webm", ["opus"]) == "copy"
+    assert resolve_codec("audio", "auto", "mp3", ["aac"]) == "libmp3lame"
+
+
+def test_copy_is_remux_only():
+    with pytest.raises(ValueError):
+        resolve_codec("video", "copy", "webm", ["h264"])
+    assert resolve_codec("video", "copy", "mov", ["h264"]) == "copy"
+
+
+def test_streams_the_container_cannot_hold_are_dropped():
+    assert resolve_codec("video", "auto", "mp3", ["h264"]) is None
+    assert codec_args(None, "copy") == {"vn": None, "acodec": "copy"}
+    assert resolve_codec("video", "libx265", "mp4", ["h264"]) == "libx265"
+
+
+def test_cover_art_is_not_a_video_stream():
+    probe = {"streams": [{"codec_type": "audio", "codec_name": "mp3"},
+                         {"codec_type": "video", "codec_name": "mjpeg", "disposition": {"attached_pic": 1}}]}
+    assert stream_codecs(probe, "video") == []
+    assert stream_codecs(probe, "audio") == ["mp3"]
+
+
+async def hold(budget, threads, started, release, reserved=None):
+    async with budget.reserve(threads) as granted:
+        if reserved is not None:
+            reserved.append(granted)
+        started.set()
+        await release.wait()
+
+
+def test_budget_caps_concurrent_threads():
+    async def scenario():
+        budget = ThreadBudget(8)
+        release = asyncio.Event()
+        started = [asyncio.Event() for _ in range(3)]
+        jobs = [asyncio.create_task(hold(budget, 4, s, release)) for s in started]
+        await asyncio.sleep(0.05)
+        assert [s.is_set() for s in started] == [True, True, False]
+        assert budget.used == 8
+        release.set()
+        await asyncio.gather(*jobs)
+        assert budget.used == 0
+
+    asyncio.run(scenario())
+
+
+def test_oversized_request_is_clamped():
+    async def scenario():
+        budget = ThreadBudget(4)
+        release = asyncio.Event()
+        release.set()
+        reserved = []
+        await hold(budget, 16, asyncio.Event(), release, reserved)
+        return reserved
+
+    assert asyncio.run(scenario()) == [4]
+
+
+def test_waiting_jobs_run_in_order():
+    async def scenario():
+        budget = ThreadBudget(4)
+        release = asyncio.Event()
+        first = asyncio.create_task(hold(budget, 3, asyncio.Event(), release))
+        await asyncio.sleep(0)
+        big_started, small_started = asyncio.Event(), asyncio.Event()
+        big = asyncio.create_task(hold(budget, 4, big_started, asyncio.Event()))
+        await asyncio.sleep(0)
+        small = asyncio.create_task(hold(budget, 1, small_started, release))
+        await asyncio.sleep(0.05)
+        # the small job would fit, but it does not jump ahead of the big one
+        assert not big_started.is_set() and not small_started.is_set()
+        big.cancel()
+        await asyncio.sleep(0.05)
+        assert small_started.is_set()
+        release.set()
+        await asyncio.gather(first, small)
+        assert budget.used == 0 and not budget.waiting
+
+    asyncio.run(scenario())
+
+
+def test_ladder_never_upscales():
+    ladder = [(1080, 5000), (720, 2800), (480, 1400)]
+    assert select_rungs(720, ladder) == [(720, 2800), (480, 1400)]
+    assert select_rungs(241, ladder) == [(240, 1400)]
@@ -1,7 +1,12 @@
+import hashlib
+import io
+import os
+
 import pytest
 from fastapi.testclient import TestClient
 
 from src.main import app
+from src.storage import save_upload, MultipartFileReader, UploadTooLarge
 
 image_ID, video_ID, audio_ID = None, None, None
 
@@ -97,3 +102,169 @@ class TestDeleteClass:
         data = response.json()
         assert data["status"] == "success"
         assert data["message"] == "File deleted successfully"
+
+    def test_delete_removes_unshared_blob(self):
+        content = os.urandom(4096)
+        response = client.post("/uploadmedia", files={"file": ("random.bin", io.BytesIO(content))})
+        assert response.status_code == 200
+        blob = f"./media/.store/{hashlib.sha256(content).hexdigest()}"
+        assert os.path.exists(blob)
+        response = client.post(f"/deletemedia?fileID={response.json()['fileID']}")
+        assert response.status_code == 200
+        assert not os.path.exists(blob)
+
+class TestUploadLimitsClass:
+    def test_upload_returns_sha256(self):
+        with open("tests/test_media/car.jpg", "rb") as file:
+            content = file.read()
+            file.seek(0)
+            response = client.post("/uploadmedia", files={"file": file})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["sha256"] == hashlib.sha256(content).hexdigest()
+        assert data["size"] == len(content)
+        client.post(f"/deletemedia?fileID={data['fileID']}")
+
+    def test_upload_too_large(self, monkeypatch):
+        monkeypatch.setattr('src.main.MAX_UPLOAD_SIZE', 1024)
+        with open("tests/test_media/car.jpg", "rb") as file:
+            response = client.post("/uploadmedia", files={"file": file})
+        assert response.status_code == 413
+
+    def test_upload_over_limit_without_content_length(self, monkeypatch):
+        monkeypatch.setattr('src.main.MAX_UPLOAD_SIZE', 1024)
+        monkeypatch.setattr('src.main.UPLOAD_CHUNK_SIZE', 256)
+
+        def body():
+            yield b'--b\r\nContent-Disposition: form-data; name="file"; filename="big.bin"\r\n\r\n'
+            for _ in range(16):
+                yield b"x" * 256
+            yield b'\r\n--b--\r\n'
+
+        folders = {name for name in os.listdir("./media") if not name.startswith(".")}
+        response = client.post("/uploadmedia", content=body(),
+                               headers={"content-type": "multipart/form-data; boundary=b"})
+        assert response.status_code == 413
+        assert {name for name in os.listdir("./media") if not name.startswith(".")} == folders
+
+    def test_multipart_reader_streams_file_part(self):
+        body = (b'--b\r\nContent-Disposition: form-data; name="note"\r\n\r\nhello\r\n'
+                b'--b\r\nContent-Disposition: form-data; name="file"; filename="a.bin"\r\n'
+                b'Content-Type: application/octet-stream\r\n\r\n' + b"x" * 100 + b'\r\n--b--\r\n')
+        reader = MultipartFileReader("multipart/form-data; boundary=b")
+        for start in range(0, len(body), 7):
+            reader.feed(body[start:start + 7])
+        reader.finish()
+        assert reader.filename == "a.bin"
+        assert reader.data == b"x" * 100
+
+    def test_streamed_upload_too_large(self, tmp_path):
+        with pytest.raises(UploadTooLarge):
+            save_upload(io.BytesIO(b"x" * 4096), str(tmp_path / "big.bin"), max_size=1024)
+        assert list(tmp_path.iterdir()) == []
+
+class TestConditionalDownloadClass:
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_files(self, request):
+        with open("tests/test_media/bunny.mp4", "rb") as file:
+            request.cls.content = file.read()
+            file.seek(0)
+            request.cls.file_ID = client.post("/uploadmedia", files={"file": file}).json()["fileID"]
+        yield
+        client.post(f"/deletemedia?fileID={request.cls.file_ID}")
+
+    def test_strong_etag_from_content_hash(self):
+        response = client.get(f"/downloadmedia?fileID={self.file_ID}&filename=bunny.mp4")
+        assert response.headers["etag"] == f'"{hashlib.sha256(self.content).hexdigest()}"'
+        assert response.headers["cache-control"] == "no-cache"
+        assert response.headers["accept-ranges"] == "bytes"
+
+    def test_if_none_match(self):
+        etag = f'"{hashlib.sha256(self.content).hexdigest()}"'
+        response = client.get(f"/downloadmedia?fileID={self.file_ID}&filename=bunny.mp4",
+                              headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+
+    def test_range_request(self):
+        response = client.get(f"/downloadmedia?fileID={self.file_ID}&filename=bunny.mp4",
+                              headers={"Range": "bytes=100-199"})
+        assert response.status_code == 206
+        assert response.content == self.content[100:200]
+
+    def test_stale_if_range_returns_full_file(self):
+        response = client.get(f"/downloadmedia?fileID={self.file_ID}&filename=bunny.mp4",
+                              headers={"Range": "bytes=100-199", "If-Range": '"stale"'})
+        assert response.status_code == 200
+        assert response.content == self.content
+
+    def test_hash_pinned_url_is_immutable(self):
+        digest = hashlib.sha256(self.content).hexdigest()
+        response = client.get(f"/downloadmedia?fileID={self.file_ID}&filename=bunny.mp4&hash={digest}")
+        assert "immutable" in response.headers["cache-control"]
+
+    def test_missing_file(self):
+        response = client.get(f"/downloadmedia?fileID={self.file_ID}&filename=missing.mp4")
+        assert response.status_code == 404
+
+    @pytest.mark.parametrize("method, path", [("get", "/downloadmedia"), ("get", "/mediainfo"),
+                                              ("post", "/rendertranscript")])
+    @pytest.mark.parametrize("fileID, filename", [("..", "src/main.py"), (None, "../../src/main.py")])
+    def test_paths_outside_media_are_rejected(self, method, path, fileID, filename):
+        params = {"fileID": fileID or self.file_ID, "filename": filename, "output_format": "txt"}
+        response = getattr(client, method)(path, params=params)
+        assert response.status_code == 404
+        assert not os.path.exists("src/.main.py.meta.json")
+        assert not os.path.exists("src/main.txt")
+
+
+class TestMediaInfoClass:
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_files(self, request):
+        with open("tests/test_media/bunny.mp4", "rb") as file:
+            request.cls.video_ID = client.post("/uploadmedia", files={"file": file}).json()["fileID"]
+        with open("tests/test_media/obama.mp3", "rb") as file:
+            # content decides the media type, not the extension
+            request.cls.audio_ID = client.post("/uploadmedia", files={"file": ("speech.bin", file)}).json()["fileID"]
+        yield
+        client.post(f"/deletemedia?fileID={request.cls.video_ID}")
+        client.post(f"/deletemedia?fileID={request.cls.audio_ID}")
+
+    def test_video_info(self):
+        response = client.get(f"/mediainfo?fileID={self.video_ID}&filename=bunny.mp4")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["media_type"] == "video"
+        assert data["duration"] > 0
+        video = next(s for s in data["streams"] if s["type"] == "video")
+        assert video["codec"] == "h264"
+        assert video["width"] > 0 and video["height"] > 0
+
+    def test_sniffed_audio(self):
+        response = client.get(f"/mediainfo?fileID={self.audio_ID}&filename=speech.bin")
+        assert response.status_code == 200
+        assert response.json()["media_type"] == "audio"
+
+    def test_probe_is_cached_at_upload(self, monkeypatch):
+        def fail(*args, **kwargs):
+            raise AssertionError("ffprobe should not run again")
+
+        monkeypatch.setattr("src.mediainfo.ffmpeg.probe", fail)
+        response = client.get(f"/mediainfo?fileID={self.video_ID}&filename=bunny.mp4")
+        assert response.status_code == 200
+
+    def test_missing_file(self):
+        response = client.get(f"/mediainfo?fileID={self.video_ID}&filename=missing.mp4")
+        assert response.status_code == 404
+
+
+class TestMetricsClass:
+    def test_metrics_after_upload(self):
+        with open("tests/test_media/car.jpg", "rb") as file:
+            file_ID = client.post("/uploadmedia", files={"file": file}).json()["fileID"]
+        client.post(f"/deletemedia?fileID={file_ID}")
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert 'media_upload_throughput_bytes_per_second_count{kind="upload"}' in response.text
+        assert "# TYPE ffmpeg_processes_active gauge" in response.text
@@ -0,0 +1,20 @@
+from PIL import Image, JpegImagePlugin
+
+from src.images import convert_image
+
+
+def test_single_dimension_thumbnail_decodes_at_reduced_scale(tmp_path, monkeypatch):
+    source = str(tmp_path / "big.jpg")
+    Image.new("RGB", (1600, 1200), "red").save(source)
+    requested = []
+    draft = JpegImagePlugin.JpegImageFile.draft
+
+    def record_draft(self, mode, size):
+        requested.append(size)
+        return draft(self, mode, size)
+
+    monkeypatch.setattr(JpegImagePlugin.JpegImageFile, "draft", record_draft)
+    convert_image(source, [(str(tmp_path / "small_200w.png"), "png", 200, None)])
+    assert requested == [(200, 150)]
+    with Image.open(tmp_path / "small_200w.png") as image:
+        assert image.size == (200, 150)
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import time
+
+from src.handlers import JOB_HANDLERS
+from src.jobs import JobQueue
+from src.worker import run_job
+
+
+def test_jobs_are_claimed_in_order(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    first = queue.submit("changeformat", {"fileID": "a"})
+    second = queue.submit("transcribe", {"fileID": "b"})
+    assert queue.get(second)["queue_position"] == 2
+    assert queue.claim("w1")["id"] == first
+    job = queue.claim("w2")
+    assert (job["id"], job["kind"], job["payload"]) == (second, "transcribe", {"fileID": "b"})
+    assert queue.claim("w3") is None
+    assert queue.get(first)["status"] == "running"
+
+
+def test_cancel_queued_job(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    job_id = queue.submit("changeformat", {})
+    assert queue.cancel(job_id) == "cancelled"
+    assert queue.claim("w1") is None
+    assert queue.events(job_id)[-1][1]["status"] == "cancelled"
+    assert queue.cancel("missing") is None
+
+
+def test_jobs_of_a_dead_worker_are_retried_then_failed(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), lease_seconds=0, max_attempts=2)
+    job_id = queue.submit("changeformat", {})
+    assert queue.claim("w1")["id"] == job_id
+    time.sleep(0.01)
+    assert queue.claim("w2")["id"] == job_id
+    time.sleep(0.01)
+    assert queue.claim("w3") is None
+    job = queue.get(job_id)
+    assert job["status"] == "error"
+    assert job["attempts"] == 2
+
+
+def test_run_job_records_messages_and_result(tmp_path, monkeypatch):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+
+    async def handler(websocket, data):
+        await websocket.send_json({"status": "progress", "progress": 50.0})
+        await websocket.send_json({"status": "success", "filename": data["filename"]})
+
+    monkeypatch.setitem(JOB_HANDLERS, "changeformat", handler)
+    job_id = queue.submit("changeformat", {"filename": "car.png"})
+    asyncio.run(run_job(queue, queue.claim("w1")))
+    job = queue.get(job_id)
+    assert job["status"] == "success"
+    assert job["result"] == {"status": "success", "filename": "car.png"}
+    assert job["progress"]["progress"] == 50.0
+    assert [data["status"] for _, data in queue.events(job_id)] == ["progress", "success"]
+    assert queue.events(job_id, after=queue.events(job_id)[0][0]) == queue.events(job_id)[1:]
+
+
+def test_cancel_running_job(tmp_path, monkeypatch):
+    queue = JobQueue(str(tmp_path / "jobs.db"), lease_seconds=0.3)
+
+    async def handler(websocket, data):
+        await asyncio.sleep(60)
+
+    monkeypatch.setitem(JOB_HANDLERS, "transcribe", handler)
+    job_id = queue.submit("transcribe", {})
+    job = queue.claim("w1")
+    assert queue.cancel(job_id) == "running"
+    asyncio.run(asyncio.wait_for(run_job(queue, job), 5))
+    assert queue.get(job_id)["status"] == "cancelled"
+
+
+def test_jobs_outside_media_are_refused(tmp_path):
+    # workers repeat the API's path check, a queued job must not write next to files outside ./media
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    job_id = queue.submit("changeformat", {"fileID": "../tests/test_media", "filename": "car.jpg",
+                                           "output_format": "png"})
+    asyncio.run(run_job(queue, queue.claim("w1")))
+    assert queue.get(job_id)["result"]["status"] == "error"
+    assert not os.path.exists("tests/test_media/car.png")
+    assert not os.path.exists("tests/test_media/.car.jpg.meta.json")
@@ -0,0 +1,50 @@
+import json
+import logging
+
+from src.logs import ContextFilter, SampleFilter, JsonFormatter, log_context
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def make_logger(name, *filters):
+    logger = logging.getLogger(name)
+    handler = ListHandler()
+    for log_filter in filters:
+        handler.addFilter(log_filter)
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    return logger, handler
+
+
+def test_context_fields_are_attached():
+    logger, handler = make_logger("test.logs.context", ContextFilter())
+    with log_context(fileID="abc"):
+        with log_context(jobID="42"):
+            logger.info("converting %s", "car.jpg", extra={"output_format": "png"})
+        logger.info("done")
+    logger.info("outside")
+    entry = json.loads(JsonFormatter().format(handler.records[0]))
+    assert entry["message"] == "converting car.jpg"
+    assert (entry["fileID"], entry["jobID"], entry["output_format"]) == ("abc", "42", "png")
+    assert not hasattr(handler.records[1], "jobID")
+    assert not hasattr(handler.records[2], "fileID")
+
+
+def test_sampled_records_are_rate_limited_per_file():
+    logger, handler = make_logger("test.logs.sampling", ContextFilter(), SampleFilter(60))
+    for fileID in ("a", "b"):
+        with log_context(fileID=fileID):
+            for progress in range(10):
+                logger.debug("progress %d", progress, extra={"sample": "ffmpeg"})
+    logger.info("not sampled")
+    logger.info("not sampled")
+    assert [record.getMessage() for record in handler.records] == ["progress 0", "progress 0", "not sampled",
+                                                                  "not sampled"]
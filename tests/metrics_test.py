@@ -0,0 +1,34 @@
+from src.metrics import Histogram, Gauge
+
+
+def test_histogram_exposition():
+    histogram = Histogram("test_seconds", "Test histogram", ("stage",), buckets=(1, 5))
+    histogram.observe(0.5, stage="probe")
+    histogram.observe(3, stage="probe")
+    histogram.observe(10, stage='say "hi"')
+    lines = histogram.render()
+    assert lines[:2] == ["# HELP test_seconds Test histogram", "# TYPE test_seconds histogram"]
+    assert 'test_seconds_bucket{stage="probe",le="1"} 1' in lines
+    assert 'test_seconds_bucket{stage="probe",le="5"} 2' in lines
+    assert 'test_seconds_bucket{stage="probe",le="+Inf"} 2' in lines
+    assert 'test_seconds_sum{stage="probe"} 3.5' in lines
+    assert 'test_seconds_count{stage="say \\"hi\\""} 1' in lines
+
+
+def test_histogram_timer_skips_failures():
+    histogram = Histogram("test_timer_seconds", "Test timer")
+    with histogram.time():
+        pass
+    try:
+        with histogram.time():
+            raise ValueError
+    except ValueError:
+        pass
+    assert "test_timer_seconds_count 1" in histogram.render()
+
+
+def test_gauge_reads_callback():
+    gauge = Gauge("test_active", "Test gauge")
+    assert gauge.render() == ["# HELP test_active Test gauge", "# TYPE test_active gauge"]
+    gauge.set_function(lambda: 3)
+    assert gauge.render()[-1] == "test_active 3.0"
@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+from src import model_cache as mc
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def fake_loader(monkeypatch):
+    loads = []
+
+    def load(engine, name, compute_type):
+        if engine not in ('whisper', 'faster-whisper'):
+            raise ValueError(f"Unknown transcription engine: {engine}")
+        loads.append((engine, name, compute_type))
+        return object()
+
+    monkeypatch.setattr(mc, '_load_model', load)
+    monkeypatch.setattr(mc, '_model_size', lambda engine, name, compute_type, model: 100 * MB)
+    return loads
+
+
+def test_cached_model_is_reused(fake_loader):
+    cache = mc.ModelCache(1024 * MB)
+    first = cache.get('whisper', 'base')
+    second = cache.get('whisper', 'base')
+    assert first is second
+    assert fake_loader == [('whisper', 'base', None)]
+
+
+def test_key_includes_engine_and_compute_type(fake_loader):
+    cache = mc.ModelCache(1024 * MB)
+    cache.get('whisper', 'base')
+    cache.get('faster-whisper', 'base', 'int8')
+    cache.get('faster-whisper', 'base', 'float32')
+    assert len(fake_loader) == 3
+
+
+def test_least_recently_used_model_is_evicted(fake_loader):
+    cache = mc.ModelCache(250 * MB)
+    cache.get('whisper', 'tiny')
+    cache.get('whisper', 'base')
+    cache.get('whisper', 'tiny')  # base is now the least recently used
+    cache.get('whisper', 'small')
+    assert cache.keys() == [('whisper', 'tiny', None), ('whisper', 'small', None)]
+
+
+def test_concurrent_requests_load_once(fake_loader):
+    cache = mc.ModelCache(1024 * MB)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('whisper', 'base'))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(fake_loader) == 1
+    assert all(r is results[0] for r in results)
+
+
+def test_warm_up_ignores_bad_specs(fake_loader, monkeypatch):
+    cache = mc.ModelCache(1024 * MB)
+    monkeypatch.setattr(mc, 'model_cache', cache)
+    mc.warm_up_models(['whisper:base.en', 'bogus:tiny'])
+    assert cache.keys() == [('whisper', 'base.en', None)]
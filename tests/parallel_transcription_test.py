@@ -0,0 +1,43 @@
+import shutil
+import types
+
+import faster_whisper
+import pytest
+
+from src import model_cache as mc
+from src.parallel_transcription import split_on_silence, transcribe_chunk, SAMPLE_RATE
+
+
+@pytest.fixture(scope="module")
+def audio():
+    return faster_whisper.decode_audio("tests/test_media/obama.mp3", sampling_rate=SAMPLE_RATE)
+
+
+def test_short_audio_is_one_chunk(audio):
+    assert split_on_silence(audio[:SAMPLE_RATE * 10], max_chunk_seconds=30) == [(0, SAMPLE_RATE * 10)]
+
+
+def test_chunks_cover_audio_without_gaps(audio):
+    chunks = split_on_silence(audio, max_chunk_seconds=30)
+    assert len(chunks) > 1
+    assert chunks[0][0] == 0
+    assert chunks[-1][1] == len(audio)
+    for (_, end), (start, _) in zip(chunks, chunks[1:]):
+        assert end == start
+    assert all(end - start <= 30 * SAMPLE_RATE for start, end in chunks[:-1])
+
+
+def test_chunk_timestamps_are_offset(monkeypatch, tmp_path):
+    class FakeModel:
+        def transcribe(self, audio, **kwargs):
+            assert len(audio) == SAMPLE_RATE  # only the chunk's samples are read from the PCM sidecar
+            word = types.SimpleNamespace(start=1.5, end=2.0, word=" hello", probability=0.9)
+            segment = types.SimpleNamespace(start=1.0, end=2.5, text=" hello", words=[word])
+            return iter([segment]), None
+
+    path = tmp_path / "obama.mp3"
+    shutil.copy("tests/test_media/obama.mp3", path)
+    monkeypatch.setattr(mc.model_cache, 'get', lambda engine, name: mc.CachedModel(FakeModel(), 0))
+    segments = transcribe_chunk('faster-whisper', 'tiny', None, str(path), 60 * SAMPLE_RATE, 61 * SAMPLE_RATE)
+    assert segments == [{"start": 61.0, "end": 62.5, "text": " hello",
+                         "words": [{"start": 61.5, "end": 62.0, "word": " hello", "probability": 0.9}]}]
@@ -0,0 +1,73 @@
+import hashlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.main import app
+
+client = TestClient(app)
+CHUNK_SIZE = 64 * 1024
+
+
+class TestResumableUploadClass:
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_files(self, request):
+        with open("tests/test_media/bunny.mp4", "rb") as file:
+            request.cls.content = file.read()
+        response = client.post(f"/uploadmedia/init?filename=bunny.mp4&size={len(request.cls.content)}"
+                               f"&chunk_size={CHUNK_SIZE}")
+        assert response.status_code == 200
+        request.cls.upload = response.json()
+        yield
+        client.post(f"/deletemedia?fileID={request.cls.upload['fileID']}")
+
+    def chunk(self, index):
+        return self.content[index * CHUNK_SIZE:(index + 1) * CHUNK_SIZE]
+
+    def test_init(self):
+        assert self.upload["total_chunks"] == -(-len(self.content) // CHUNK_SIZE)
+        assert self.upload["chunk_size"] == CHUNK_SIZE
+
+    def test_chunk_with_wrong_length_is_rejected(self):
+        response = client.put(f"/uploadmedia/chunk?fileID={self.upload['fileID']}&index=0", content=b"short")
+        assert response.status_code == 400
+
+    def test_chunk_with_bad_checksum_is_rejected(self):
+        response = client.put(f"/uploadmedia/chunk?fileID={self.upload['fileID']}&index=0&sha256={'0' * 64}",
+                              content=self.chunk(0))
+        assert response.status_code == 400
+
+    def test_upload_out_of_order_and_finalize(self):
+        fileID = self.upload["fileID"]
+        indices = list(range(self.upload["total_chunks"]))
+        for index in reversed(indices[1:]):
+            response = client.put(f"/uploadmedia/chunk?fileID={fileID}&index={index}", content=self.chunk(index))
+            assert response.status_code == 200
+
+        status = client.get(f"/uploadmedia/status?fileID={fileID}").json()
+        assert status["missing"] == [0]
+        assert client.post(f"/uploadmedia/finalize?fileID={fileID}").status_code == 409
+
+        digest = hashlib.sha256(self.chunk(0)).hexdigest()
+        response = client.put(f"/uploadmedia/chunk?fileID={fileID}&index=0&sha256={digest}", content=self.chunk(0))
+        assert response.status_code == 200
+
+        response = client.post(f"/uploadmedia/finalize?fileID={fileID}"
+                               f"&sha256={hashlib.sha256(self.content).hexdigest()}")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["filename"] == "bunny.mp4"
+        assert data["size"] == len(self.content)
+
+        download = client.get(f"/downloadmedia?fileID={fileID}&filename=bunny.mp4")
+        assert download.content == self.content
+
+    def test_reserved_filename_is_rejected(self):
+        response = client.post("/uploadmedia/init?filename=.upload.json&size=10")
+        assert response.status_code == 400
+
+    @pytest.mark.parametrize("fileID", ["..", ".store", "../media"])
+    def test_invalid_file_ids_are_not_found(self, fileID):
+        assert client.get("/uploadmedia/status", params={"fileID": fileID}).status_code == 404
+        assert client.post("/uploadmedia/finalize", params={"fileID": fileID}).status_code == 404
+        assert client.put("/uploadmedia/chunk", params={"fileID": fileID, "index": 0}, content=b"x").status_code == 404
@@ -0,0 +1,81 @@
+import os
+import time
+
+from src.retention import RetentionIndex, collect_garbage
+from src.storage import write_meta
+
+
+def make_job(media_dir, fileID, size=10):
+    os.mkdir(media_dir / fileID)
+    path = media_dir / fileID / 'file.bin'
+    path.write_bytes(b'x' * size)
+    return path
+
+
+def test_expired_folders_are_evicted(tmp_path):
+    index = RetentionIndex(tmp_path, 60)
+    make_job(tmp_path, 'old')
+    make_job(tmp_path, 'new')
+    index.record('old')
+    index.record('new')
+    index.touch('new')
+    assert index.sweep(time.time() + 30) == []
+    index.touch('new')
+    assert index.sweep(time.time() + 61) == ['old', 'new']
+    assert not (tmp_path / 'old').exists()
+    assert index.total_size() == 0
+
+
+def test_quota_evicts_least_recently_used(tmp_path):
+    index = RetentionIndex(tmp_path, 3600, quota_bytes=25)
+    for fileID in ('a', 'b', 'c'):
+        make_job(tmp_path, fileID)
+        index.record(fileID)
+    index.touch('a')
+    assert index.sweep() == ['b']
+    assert (tmp_path / 'a').exists() and (tmp_path / 'c').exists()
+    assert index.total_size() == 20
+
+
+def test_existing_folders_are_indexed_once(tmp_path):
+    path = make_job(tmp_path, 'legacy')
+    old_time = time.time() - 7200
+    os.utime(path, (old_time, old_time))
+    assert RetentionIndex(tmp_path, 3600).sweep() == ['legacy']
+
+
+def test_unshared_store_blobs_are_removed_with_their_folder(tmp_path):
+    os.mkdir(tmp_path / '.store')
+    index = RetentionIndex(tmp_path, 60)
+    for fileID in ('a', 'b'):
+        path = make_job(tmp_path, fileID)
+        os.link(path, tmp_path / '.store' / fileID)
+        write_meta(str(path), sha256=fileID)
+        index.record(fileID)
+    make_job(tmp_path, 'c')
+    os.link(tmp_path / '.store' / 'b', tmp_path / 'c' / 'copy.bin')  # 'c' still uses b's content
+    index.sweep(time.time() + 61)
+    assert not (tmp_path / '.store' / 'a').exists()
+    assert (tmp_path / '.store' / 'b').exists()
+
+
+def test_unsafe_file_ids_are_ignored(tmp_path):
+    index = RetentionIndex(tmp_path / 'media', 60)
+    os.mkdir(tmp_path / 'media')
+    for fileID in ('..', '.store', '../media'):
+        index.record(fileID)
+    assert index.sweep(time.time() + 61) == []
+    assert tmp_path.exists()
+
+
+def test_orphaned_store_and_cache_entries_are_collected(tmp_path):
+    os.makedirs(tmp_path / '.store')
+    os.makedirs(tmp_path / '.cache')
+    (tmp_path / '.store' / 'orphan').write_bytes(b'x')
+    (tmp_path / '.cache' / 'orphan').write_bytes(b'x')
+    path = make_job(tmp_path, 'kept')
+    os.link(path, tmp_path / '.cache' / 'used')
+    collect_garbage(tmp_path)
+    assert not (tmp_path / '.store' / 'orphan').exists()
+    assert not (tmp_path / '.cache' / 'orphan').exists()
+    assert (tmp_path / '.cache' / 'used').exists()
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from src.scheduler import JobScheduler, SchedulerBusy
+
+
+async def hold_worker(scheduler, key, started, release, positions=None):
+    async def on_queued(position):
+        positions.append(position)
+
+    async with scheduler.acquire(key, on_queued if positions is not None else None) as executor:
+        started.set()
+        await release.wait()
+        return await asyncio.get_running_loop().run_in_executor(executor, lambda: 42)
+
+
+def test_jobs_run_up_to_worker_limit():
+    async def scenario():
+        scheduler = JobScheduler(workers_per_model=2, max_queue=4)
+        release = asyncio.Event()
+        started = [asyncio.Event() for _ in range(3)]
+        jobs = [asyncio.create_task(hold_worker(scheduler, ('whisper', 'base'), s, release)) for s in started]
+        await asyncio.sleep(0.05)
+        assert [s.is_set() for s in started] == [True, True, False]
+        assert scheduler.queued() == 1
+        release.set()
+        results = await asyncio.gather(*jobs)
+        scheduler.shutdown()
+        return results
+
+    assert asyncio.run(scenario()) == [42, 42, 42]
+
+
+def test_queue_positions_are_reported():
+    async def scenario():
+        scheduler = JobScheduler(workers_per_model=1, max_queue=4)
+        release = asyncio.Event()
+        first = asyncio.create_task(hold_worker(scheduler, ('whisper', 'base'), asyncio.Event(), release))
+        await asyncio.sleep(0)
+        second_positions, third_positions = [], []
+        second = asyncio.create_task(
+            hold_worker(scheduler, ('whisper', 'base'), asyncio.Event(), release, second_positions))
+        await asyncio.sleep(0)
+        third = asyncio.create_task(
+            hold_worker(scheduler, ('whisper', 'base'), asyncio.Event(), release, third_positions))
+        await asyncio.sleep(0.05)
+        release.set()
+        await asyncio.gather(first, second, third)
+        scheduler.shutdown()
+        return second_positions, third_positions
+
+    second_positions, third_positions = asyncio.run(scenario())
+    assert second_positions == [1]
+    assert third_positions == [2, 1]
+
+
+def test_full_queue_is_rejected():
+    async def scenario():
+        scheduler = JobScheduler(workers_per_model=1, max_queue=1)
+        release = asyncio.Event()
+        first = asyncio.create_task(hold_worker(scheduler, ('faster-whisper', 'tiny'), asyncio.Event(), release))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(hold_worker(scheduler, ('faster-whisper', 'tiny'), asyncio.Event(), release))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerBusy):
+            async with scheduler.acquire(('faster-whisper', 'tiny')):
+                pass
+        release.set()
+        await asyncio.gather(first, second)
+        scheduler.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_job_leaves_queue():
+    async def scenario():
+        scheduler = JobScheduler(workers_per_model=1, max_queue=2)
+        release = asyncio.Event()
+        first = asyncio.create_task(hold_worker(scheduler, ('whisper', 'tiny'), asyncio.Event(), release))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(hold_worker(scheduler, ('whisper', 'tiny'), asyncio.Event(), release))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.sleep(0)
+        assert scheduler.queued() == 0
+        release.set()
+        await first
+        assert scheduler.running() == 0
+        scheduler.shutdown()
+
+    asyncio.run(scenario())
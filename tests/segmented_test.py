@@ -0,0 +1,57 @@
+import asyncio
+
+import ffmpeg
+import pytest
+
+from src.segmented import split_at_keyframes, plan_segments, transcode_in_segments
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, data):
+        self.sent.append(dict(data))
+
+
+def test_segments_start_on_keyframes():
+    keyframes = [0.0, 2.5, 5.0, 7.5, 10.0, 12.5, 15.0, 17.5]
+    assert split_at_keyframes(keyframes, 20.0, 5) == [(0.0, 5.0), (5.0, 10.0), (10.0, 15.0), (15.0, None)]
+
+
+def test_short_tail_is_merged_into_the_last_segment():
+    assert split_at_keyframes([0.0, 4.0, 8.0, 9.0], 9.5, 4) == [(0.0, 4.0), (4.0, None)]
+
+
+def test_short_input_is_one_segment():
+    assert split_at_keyframes([0.0, 1.0], 2.0, 60) == [(0.0, None)]
+
+
+@pytest.fixture
+def long_video(tmp_path):
+    path = str(tmp_path / "input.mp4")
+    video = ffmpeg.input('testsrc=size=160x120:rate=25', f='lavfi', t=12)
+    audio = ffmpeg.input('sine=frequency=440', f='lavfi', t=12)
+    ffmpeg.output(video, audio, path, vcodec='libx264', acodec='aac', g=50).run(quiet=True, overwrite_output=True)
+    return path
+
+
+def test_segmented_transcode(long_video, tmp_path, monkeypatch):
+    monkeypatch.setattr("src.segmented.VIDEO_SEGMENT_SECONDS", 4)
+    probe = ffmpeg.probe(long_video)
+    segments = plan_segments(long_video, probe)
+    assert len(segments) == 3
+    output = str(tmp_path / "output.mkv")
+    websocket = RecordingSocket()
+
+    returncode = asyncio.run(transcode_in_segments(websocket, long_video, output, segments, 12.0,
+                                                   'libx264', 'copy', 'fast'))
+    assert returncode == 0
+    result = ffmpeg.probe(output, count_frames=None)
+    video = next(s for s in result['streams'] if s['codec_type'] == 'video')
+    assert int(video['nb_read_frames']) == 300
+    assert any(s['codec_type'] == 'audio' for s in result['streams'])
+    segment_updates = [m for m in websocket.sent if m.get("stage") == "segments"]
+    assert segment_updates[-1]["segments_done"] == 3
+    assert segment_updates[-1]["progress_percent"] == pytest.approx(100)
+    assert [p.name for p in tmp_path.iterdir() if p.name.startswith(".segments")] == []
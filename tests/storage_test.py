@@ -0,0 +1,80 @@
+import hashlib
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src import storage
+from src.main import app
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'STORE_DIR', str(tmp_path / '.store'))
+    monkeypatch.setattr(storage, 'CACHE_DIR', str(tmp_path / '.cache'))
+    return tmp_path
+
+
+def write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_identical_uploads_share_storage(store):
+    digest = hashlib.sha256(b'same content').hexdigest()
+    first = write(store / 'a' / 'one.txt', b'same content')
+    second = write(store / 'b' / 'two.txt', b'same content')
+    storage.store_content(first, digest)
+    storage.store_content(second, digest)
+    assert os.stat(first).st_ino == os.stat(second).st_ino
+    assert storage.file_sha256(second) == digest
+
+
+def test_file_sha256_tracks_replaced_files(store):
+    path = write(store / 'a' / 'one.txt', b'first')
+    assert storage.file_sha256(path) == hashlib.sha256(b'first').hexdigest()
+    storage.prepare_output(path)
+    write(store / 'a' / 'one.txt', b'second!')
+    assert storage.file_sha256(path) == hashlib.sha256(b'second!').hexdigest()
+
+
+def test_cache_roundtrip_does_not_share_writes(store):
+    key = storage.derived_key('convert', 'abc', 'png', 'copy', 'copy')
+    output = write(store / 'a' / 'car.png', b'png bytes')
+    assert not storage.cache_fetch(key, str(store / 'b' / 'car.png'))
+    storage.cache_put(key, output)
+
+    (store / 'b').mkdir()
+    assert storage.cache_fetch(key, str(store / 'b' / 'car.png'))
+    assert (store / 'b' / 'car.png').read_bytes() == b'png bytes'
+
+    # rewriting one output must not leak into the cached copy
+    storage.prepare_output(output)
+    write(store / 'a' / 'car.png', b'other bytes')
+    assert (store / 'b' / 'car.png').read_bytes() == b'png bytes'
+
+
+class TestConversionCacheClass:
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_files(self, request):
+        file_IDs = []
+        for _ in range(2):
+            with open("tests/test_media/car.jpg", "rb") as file:
+                file_IDs.append(client.post("/uploadmedia", files={"file": file}).json()["fileID"])
+        request.cls.file_IDs = file_IDs
+        yield
+        for file_ID in file_IDs:
+            client.post(f"/deletemedia?fileID={file_ID}")
+
+    def test_repeated_conversion_is_cached(self):
+        responses = []
+        for file_ID in self.file_IDs:
+            with client.websocket_connect("/changeformat") as websocket:
+                websocket.send_json({"filename": "car.jpg", "fileID": file_ID, "output_format": "bmp"})
+                responses.append(websocket.receive_json())
+        assert all(response["status"] == "success" for response in responses)
+        assert responses[1].get("cached") is True
+        assert os.path.getsize(f"./media/{self.file_IDs[1]}/car.bmp") > 0
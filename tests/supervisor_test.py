@@ -0,0 +1,155 @@
+import asyncio
+import os
+import resource
+
+import ffmpeg
+import pytest
+
+from src.supervisor import FFmpegSupervisor, FFmpegLimitExceeded, read_ffmpeg_progress
+
+
+def endless_encode(path):
+    # a synthetic source long enough to still be running whenever a test stops it
+    source = ffmpeg.input('testsrc=size=320x240:rate=25', f='lavfi', t=3600)
+    return source.output(path).global_args('-loglevel', 'error')
+
+
+async def wait_exit(process):
+    return await process.wait()
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, data):
+        self.sent.append(dict(data))
+
+
+def test_cancelled_job_kills_ffmpeg_and_removes_output(tmp_path):
+    output = str(tmp_path / "out.mkv")
+
+    async def scenario():
+        supervisor = FFmpegSupervisor(max_processes=2, timeout=0, cpu_seconds=0)
+        started = asyncio.Event()
+        spawned = []
+
+        async def job():
+            async with supervisor.run(endless_encode(output), [output]) as process:
+                spawned.append(process)
+                started.set()
+                await wait_exit(process)
+
+        task = asyncio.create_task(job())
+        await started.wait()
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return supervisor, spawned[0]
+
+    supervisor, process = asyncio.run(scenario())
+    assert process.returncode is not None and process.returncode != 0
+    assert supervisor.running() == 0
+    assert not os.path.exists(output)
+
+
+def test_wall_clock_limit(tmp_path):
+    output = str(tmp_path / "out.mkv")
+
+    async def scenario():
+        supervisor = FFmpegSupervisor(max_processes=1, timeout=1, cpu_seconds=0)
+        async with supervisor.run(endless_encode(output), [output]) as process:
+            await wait_exit(process)
+
+    with pytest.raises(FFmpegLimitExceeded):
+        asyncio.run(scenario())
+    assert not os.path.exists(output)
+
+
+@pytest.mark.skipif(not hasattr(resource, 'prlimit'), reason="prlimit is Linux only")
+def test_cpu_limit(tmp_path):
+    output = str(tmp_path / "out.mkv")
+
+    async def scenario():
+        supervisor = FFmpegSupervisor(max_processes=1, timeout=0, cpu_seconds=1)
+        async with supervisor.run(endless_encode(output), [output]) as process:
+            assert resource.prlimit(process.pid, resource.RLIMIT_CPU) == (1, 1)
+            await wait_exit(process)
+
+    with pytest.raises(FFmpegLimitExceeded):
+        asyncio.run(scenario())
+    assert not os.path.exists(output)
+
+
+def test_process_limit_queues_jobs(tmp_path):
+    async def scenario():
+        supervisor = FFmpegSupervisor(max_processes=1, timeout=0, cpu_seconds=0)
+        release = asyncio.Event()
+        started = [asyncio.Event(), asyncio.Event()]
+
+        async def job(index):
+            output = str(tmp_path / f"out{index}.mkv")
+            async with supervisor.run(endless_encode(output), [output]):
+                started[index].set()
+                await release.wait()
+
+        jobs = [asyncio.create_task(job(i)) for i in range(2)]
+        await asyncio.sleep(0.2)
+        assert [s.is_set() for s in started] == [True, False]
+        assert supervisor.running() == 1
+        release.set()
+        await asyncio.gather(*jobs)
+        assert all(s.is_set() for s in started)
+        assert supervisor.running() == 0
+
+    asyncio.run(scenario())
+
+
+def test_successful_output_is_kept(tmp_path):
+    output = str(tmp_path / "out.mkv")
+
+    async def scenario():
+        supervisor = FFmpegSupervisor(max_processes=1, timeout=0, cpu_seconds=0)
+        stream = ffmpeg.input('testsrc=size=64x64:rate=5', f='lavfi', t=1).output(output)
+        async with supervisor.run(stream, [output]) as process:
+            return await wait_exit(process)
+
+    assert asyncio.run(scenario()) == 0
+    assert os.path.getsize(output) > 0
+
+
+def test_progress_is_coalesced(tmp_path, monkeypatch):
+    monkeypatch.setattr("src.supervisor.FFMPEG_PROGRESS_RATE", 2)
+    output = str(tmp_path / "out.mkv")
+    source = ffmpeg.input('testsrc=size=320x240:rate=25', f='lavfi', t=20)
+    stream = source.output(output).global_args('-progress', 'pipe:1', '-stats_period', '0.05', '-nostats')
+
+    async def scenario():
+        supervisor = FFmpegSupervisor(max_processes=1, timeout=0, cpu_seconds=0)
+        websocket = RecordingSocket()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        async with supervisor.run(stream, [output]) as process:
+            returncode = await read_ffmpeg_progress(websocket, process, 20)
+        return returncode, websocket.sent, loop.time() - started
+
+    returncode, sent, elapsed = asyncio.run(scenario())
+    assert returncode == 0
+    assert len(sent) <= elapsed * 2 + 2
+    assert sent[-1]["progress"] == "end"
+    assert sent[-1]["progress_percent"] == pytest.approx(100, abs=1)
+
+
+def test_large_stderr_does_not_block(tmp_path):
+    output = str(tmp_path / "out.mkv")
+    # debug logging writes far more than a pipe buffer holds to stderr
+    source = ffmpeg.input('testsrc=size=64x64:rate=25', f='lavfi', t=5)
+    stream = source.output(output).global_args('-progress', 'pipe:1', '-loglevel', 'debug')
+
+    async def scenario():
+        supervisor = FFmpegSupervisor(max_processes=1, timeout=60, cpu_seconds=0)
+        async with supervisor.run(stream, [output]) as process:
+            return await read_ffmpeg_progress(RecordingSocket(), process)
+
+    assert asyncio.run(scenario()) == 0
@@ -0,0 +1,88 @@
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.main import app
+from src.transcripts import build_transcript, save_transcript, load_transcript, render_transcript, RENDER_FORMATS
+
+client = TestClient(app)
+
+segments = [
+    {"start": 0.0, "end": 2.5, "text": " Hello there.",
+     "words": [{"start": 0.0, "end": 1.0, "word": " Hello", "probability": 0.9},
+               {"start": 1.1, "end": 2.5, "word": " there.", "probability": 0.8}]},
+    {"start": 3.0, "end": 5.0, "text": " General Kenobi.", "words": []},
+]
+
+
+@pytest.mark.parametrize("engine", ["whisper", "faster-whisper"])
+@pytest.mark.parametrize("output_format", RENDER_FORMATS)
+def test_render_formats(tmp_path, engine, output_format):
+    document = build_transcript(engine, "tiny", "en", segments)
+    output_path = str(tmp_path / f"speech.{output_format}")
+    render_transcript(document, output_path)
+    assert os.path.getsize(output_path) > 0
+    if output_format in ("srt", "vtt", "txt"):
+        with open(output_path) as f:
+            assert "General Kenobi." in f.read()
+
+
+def test_transcript_round_trip(tmp_path):
+    filepath = str(tmp_path / "speech.mp3")
+    document = build_transcript("whisper", "tiny", "en", segments)
+    path = save_transcript(filepath, document)
+    assert path.endswith(".speech.mp3.transcript.json")
+    loaded = load_transcript(filepath)
+    assert loaded["text"] == " Hello there. General Kenobi."
+    assert loaded["segments"][0]["words"][1]["word"] == " there."
+    assert [s["id"] for s in loaded["segments"]] == [0, 1]
+
+
+def test_transcripts_are_kept_per_file(tmp_path):
+    save_transcript(str(tmp_path / "speech.mp3"), build_transcript("whisper", "tiny", "en", segments))
+    save_transcript(str(tmp_path / "speech.wav"), build_transcript("whisper", "tiny", "en", segments[:1]))
+    assert len(load_transcript(str(tmp_path / "speech.mp3"))["segments"]) == 2
+    assert len(load_transcript(str(tmp_path / "speech.wav"))["segments"]) == 1
+
+
+def test_unsupported_format(tmp_path):
+    document = build_transcript("whisper", "tiny", "en", segments)
+    with pytest.raises(ValueError):
+        render_transcript(document, str(tmp_path / "speech.mp4"))
+
+
+class TestRenderTranscriptClass:
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_files(self, request):
+        with open("tests/test_media/obama.mp3", "rb") as file:
+            audio_response = client.post("/uploadmedia", files={"file": file})
+            request.cls.file_ID = audio_response.json()["fileID"]
+        yield
+        client.post(f"/deletemedia?fileID={request.cls.file_ID}")
+
+    def test_render_without_transcript(self):
+        response = client.post(f"/rendertranscript?fileID={self.file_ID}&filename=obama.mp3&output_format=srt")
+        assert response.status_code == 404
+
+    @pytest.mark.parametrize("output_format", ["srt", "vtt", "txt", "ass"])
+    def test_render_from_stored_transcript(self, output_format):
+        save_transcript(f"./media/{self.file_ID}/obama.mp3", build_transcript("faster-whisper", "base", "en", segments))
+        response = client.post(
+            f"/rendertranscript?fileID={self.file_ID}&filename=obama.mp3&output_format={output_format}")
+        assert response.status_code == 200
+        assert response.json()["filename"] == f"obama.{output_format}"
+        download = client.get(f"/downloadmedia?fileID={self.file_ID}&filename=obama.{output_format}")
+        assert download.status_code == 200
+        assert "Hello there." in download.text
+
+    def test_render_unsupported_format(self):
+        response = client.post(f"/rendertranscript?fileID={self.file_ID}&filename=obama.mp3&output_format=mp4")
+        assert response.status_code == 400
+
+    def test_transcript_is_downloadable(self):
+        save_transcript(f"./media/{self.file_ID}/obama.mp3", build_transcript("whisper", "base", "en", segments))
+        download = client.get(f"/downloadmedia?fileID={self.file_ID}&filename=.obama.mp3.transcript.json")
+        assert download.status_code == 200
+        assert json.loads(download.text)["segments"][0]["words"][0]["word"] == " Hello"
@@ -0,0 +1,120 @@
+import asyncio
+import shutil
+import threading
+import time
+import types
+import uuid
+import wave
+
+import pytest
+
+from src import helper, storage
+from src import model_cache as mc
+from src.scheduler import JobScheduler
+from src.storage import create_media_dir
+
+
+class FakeSocket:
+    def __init__(self):
+        self.messages = []
+
+    async def send_json(self, data):
+        self.messages.append(data)
+
+
+@pytest.fixture
+def media_file(monkeypatch):
+    # two seconds of silence in a job folder of its own, with an empty cache so nothing is served from earlier runs
+    fileID = create_media_dir()
+    with wave.open(f"./media/{fileID}/speech.wav", "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(bytes(2 * 16000 * 2))
+    cache_dir = f"./media/.cache-{uuid.uuid4().hex}"
+    monkeypatch.setattr(storage, 'CACHE_DIR', cache_dir)
+    yield fileID
+    shutil.rmtree(f"./media/{fileID}", ignore_errors=True)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = JobScheduler(workers_per_model=1, max_queue=4)
+    monkeypatch.setattr(helper, 'transcription_scheduler', scheduler)
+    yield scheduler
+    scheduler.shutdown()
+
+
+def test_failed_whisper_transcription_releases_its_worker(media_file, scheduler, monkeypatch):
+    class FailingModel:
+        def transcribe(self, audio, **kwargs):
+            raise RuntimeError("model failed")
+
+    monkeypatch.setattr(mc.model_cache, 'get', lambda engine, name: mc.CachedModel(FailingModel(), 0))
+    websocket = FakeSocket()
+    asyncio.run(asyncio.wait_for(
+        helper.transcribe_file(websocket, media_file, "speech.wav", "tiny", "en", "txt"), 10))
+    assert websocket.messages[-1] == {"status": "error", "message": "model failed"}
+    assert not any("timeout" in message.get("message", "") for message in websocket.messages)
+    assert scheduler.running() == 0
+
+
+def fake_segment(i):
+    return types.SimpleNamespace(start=float(i), end=i + 1.0, text=f" segment {i}", words=[])
+
+
+def test_fast_transcription_streams_segments(media_file, scheduler, monkeypatch):
+    class StreamingSocket(FakeSocket):
+        def __init__(self):
+            super().__init__()
+            self.seen = [threading.Event() for _ in range(3)]
+
+        async def send_json(self, data):
+            await super().send_json(data)
+            if "segment" in data:
+                self.seen[int(data["segment"]["start"])].set()
+
+    websocket = StreamingSocket()
+
+    class StreamingModel:
+        def transcribe(self, audio, **kwargs):
+            def segments():
+                for i in range(3):
+                    # the previous segment must reach the client before the next one is decoded
+                    assert i == 0 or websocket.seen[i - 1].wait(5)
+                    yield fake_segment(i)
+            return segments(), types.SimpleNamespace(language="en", language_probability=0.9, duration=3.0)
+
+    monkeypatch.setattr(mc.model_cache, 'get', lambda engine, name: mc.CachedModel(StreamingModel(), 0))
+    asyncio.run(asyncio.wait_for(helper.transcribe_file_fast(websocket, media_file, "speech.wav", "tiny", "txt"), 20))
+    segments = [message["segment"]["text"] for message in websocket.messages if "segment" in message]
+    assert segments == [" segment 0", " segment 1", " segment 2"]
+    assert websocket.messages[-1]["status"] == "success"
+
+
+def test_fast_transcription_stops_when_client_disconnects(media_file, scheduler, monkeypatch):
+    produced = []
+
+    class ClosedSocket(FakeSocket):
+        async def send_json(self, data):
+            if "segment" in data:
+                raise ConnectionError("client went away")
+            await super().send_json(data)
+
+    class EndlessModel:
+        def transcribe(self, audio, **kwargs):
+            def segments():
+                for i in range(1000):
+                    produced.append(i)
+                    time.sleep(0.001)
+                    yield fake_segment(i)
+            return segments(), types.SimpleNamespace(language="en", language_probability=0.9, duration=1000.0)
+
+    monkeypatch.setattr(mc.model_cache, 'get', lambda engine, name: mc.CachedModel(EndlessModel(), 0))
+    websocket = ClosedSocket()
+    asyncio.run(asyncio.wait_for(helper.transcribe_file_fast(websocket, media_file, "speech.wav", "tiny", "txt"), 20))
+    assert websocket.messages[-1] == {"status": "error", "message": "client went away"}
+    # transcribe_file_fast only returns once the worker thread has stopped draining the generator
+    assert len(produced) < 1000
+    assert scheduler.running() == 0